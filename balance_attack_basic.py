@@ -12,6 +12,7 @@ from test_framework.blocktools import create_transaction, create_block
 from test_framework.test_framework import ConfluxTestFramework
 from test_framework.mininode import *
 from test_framework.util import *
+from link_emulator import LinkEmulator, LinkMatrix, connect_nodes_with_link
 
 
 # Convert weight to integer
@@ -35,6 +36,13 @@ class P2PTest(ConfluxTestFramework):
             default=0.3,
             type=float,
         )
+        parser.add_argument(
+            "--link-matrix",
+            dest="link_matrix",
+            default="",
+            type=str,
+            help="json link matrix to connect the nodes through emulated links instead of addlatency",
+        )
 
     def setup_chain(self):
         self.log.info("Initializing test directory " + self.options.tmpdir)
@@ -49,10 +57,19 @@ class P2PTest(ConfluxTestFramework):
             "heartbeat_timeout_ms": "1000000000",
             "max_inflight_request_count": "1000000"
         }
+        if self.options.link_matrix:
+            # Nodes must not learn the real addresses of each other and bypass the emulated link
+            self.conf_parameters["enable_discovery"] = "false"
         self._initialize_chain_clean()
 
     def setup_network(self):
         self.setup_nodes()
+        if self.options.link_matrix:
+            targets = dict((i, (node.ip, node.port)) for (i, node) in enumerate(self.nodes))
+            self.link_emulator = LinkEmulator(LinkMatrix.load(self.options.link_matrix), targets).start()
+            connect_nodes_with_link(self.nodes, 0, 1, self.link_emulator)
+            return
+
         connect_nodes(self.nodes, 0, 1)
 
         # Set latency between two groups
@@ -5,8 +5,13 @@ import random
 import threading
 import json
 import enum
-import copy
 import argparse
+import collections
+import heapq
+import hashlib
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import eth_utils
 import rlp
 
@@ -14,20 +19,108 @@ from conflux.rpc import RpcClient
 from test_framework.test_framework import ConfluxTestFramework
 from test_framework.mininode import *
 from test_framework.util import *
+from rpc_batch import BatchRpcClient, BatchRpcError
 
 DEFAULT_HASH = '0x0000000000000000000000000000000000000000000000000000000000000000'
 NUM_TX_PER_BLOCK = 10
+GENERATE_BLOCK_RPC = 'test_generate_block_with_nonce_and_timestamp'
+STATUS_INTERVAL = 5
+RECOVERY_MODES = ['stop', 'clean', 'kill']
 CRASH_EXIT_CODE = 100
 CRASH_EXIT_PROBABILITY = 0.01
 
 
-class Timer(threading.Timer):
-    def run(self):
-        while not self.finished.wait(self.interval):
-            if not self.finished.is_set():
-                self.function(*self.args, **self.kwargs)
-            else:
-                break
+class FaultScheduler(object):
+    """
+        single loop driving periodic actions on a monotonic or virtual timeline.
+
+        A tick missed while an earlier action overran is skipped instead of piling up, and
+        counted as an overrun. Every executed action is recorded with the arguments it ran
+        with, and a recorded schedule can be replayed action for action.
+    """
+    def __init__(self, log, virtual_time=False, record=None, report_interval=60):
+        self.log = log
+        self._actions = collections.OrderedDict()
+        self._virtual_time = virtual_time
+        self._record = record
+        self._report_interval = report_interval
+        self._now = 0.0
+        self._start = None
+        self.executed = collections.Counter()
+        # actions which did something, e.g. a crash is skipped if too few peers are alive
+        self.applied = collections.Counter()
+        self.overruns = collections.Counter()
+        self.busy_time = 0.0
+
+    def add(self, name, interval, action):
+        """
+            `action(**args)` returns the arguments to replay it with, or None if it did nothing
+        """
+        self._actions[name] = (interval, action)
+
+    def _clock(self):
+        return self._now if self._virtual_time else time.monotonic() - self._start
+
+    def _wait_until(self, t):
+        if self._virtual_time:
+            self._now = max(self._now, t)
+        else:
+            time.sleep(max(0, t - self._clock()))
+
+    def _execute(self, t, name, args):
+        begin = time.monotonic()
+        used_args = self._actions[name][1](**args)
+        self.busy_time += time.monotonic() - begin
+        self.executed[name] += 1
+        if used_args is not None:
+            self.applied[name] += 1
+            if self._record is not None:
+                self._record({'t': round(t, 6), 'action': name, 'args': used_args})
+
+    def run(self, duration):
+        self._start = time.monotonic()
+        last_report = 0
+        due = [(interval, order, name) for (order, (name, (interval, _))) in enumerate(self._actions.items())]
+        heapq.heapify(due)
+        while len(due) > 0 and due[0][0] <= duration:
+            (t, order, name) = heapq.heappop(due)
+            self._wait_until(t)
+            self._execute(t, name, {})
+            interval = self._actions[name][0]
+            next_t = t + interval
+            now = self._clock()
+            if next_t <= now:
+                missed = int((now - next_t) // interval) + 1
+                self.overruns[name] += missed
+                next_t += missed * interval
+            heapq.heappush(due, (next_t, order, name))
+            if now - last_report >= self._report_interval:
+                last_report = now
+                self.log.info("scheduler: {}".format(self.report()))
+
+    def replay(self, schedule):
+        """
+            execute the recorded actions at their recorded offsets, late actions are not skipped
+        """
+        self._start = time.monotonic()
+        for entry in schedule:
+            self._wait_until(entry['t'])
+            self._execute(entry['t'], entry['action'], entry['args'])
+
+    def status(self):
+        return {
+            'elapsed': self._clock(),
+            'executed': dict(self.executed),
+            'applied': dict(self.applied),
+            'overruns': dict(self.overruns),
+        }
+
+    def report(self):
+        elapsed = max(self._clock(), 1e-6)
+        total = sum(self.executed.values())
+        return "{} actions in {:.1f}s ({:.2f}/s), busy {:.1f}%, executed {}, overruns {}".format(
+            total, elapsed, total / elapsed, 100 * self.busy_time / max(time.monotonic() - self._start, 1e-6),
+            dict(self.executed), dict(self.overruns))
 
 
 class BlockStatus(enum.Enum):
@@ -70,12 +163,32 @@ class StartEvent(EventBase):
     def __init__(self):
         super().__init__()
         self._name = 'start'
+        # seconds since the start of the last execution when each step finished
+        self.timings = {}
 
-    def execute(self, node):
+    def execute(self, node, track_phases=False):
+        """
+            with `track_phases`, wait until NormalSyncPhase and record when each sync phase is first seen
+        """
+        start = time.time()
         node.start()
+        self.timings = {'process': time.time() - start}
         node.wait_for_rpc_connection()
+        self.timings['rpc'] = time.time() - start
         node.wait_for_nodeid()
-        node.wait_for_recovery(["NormalSyncPhase", "CatchUpSyncBlockPhase"], wait_time=100000)
+        self.timings['node_id'] = time.time() - start
+        if not track_phases:
+            node.wait_for_recovery(["NormalSyncPhase", "CatchUpSyncBlockPhase"], wait_time=100000)
+            self.timings['recovered'] = time.time() - start
+            return
+        while True:
+            assert time.time() - start < 100000, "node not recovered"
+            phase = node.current_sync_phase()
+            if phase == "NormalSyncPhase":
+                break
+            self.timings.setdefault(phase, time.time() - start)
+            time.sleep(0.1)
+        self.timings['recovered'] = time.time() - start
 
     def name(self):
         return self._name
@@ -122,23 +235,70 @@ class NewBlockEvent(EventBase):
         }
 
 
+class HashInterner(object):
+    """
+        global table of the block hashes seen by the tracer, which maps every hash to a small int id,
+        so that the status records and maps of all peers share one copy of each hash.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._hashes = []
+
+    def intern(self, h):
+        key = bytes.fromhex(h[2:])
+        hash_id = self._ids.get(key)
+        if hash_id is None:
+            with self._lock:
+                hash_id = self._ids.setdefault(key, len(self._hashes))
+                if hash_id == len(self._hashes):
+                    self._hashes.append(key)
+        return hash_id
+
+    def hash(self, hash_id):
+        return '0x' + self._hashes[hash_id].hex()
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+HASHES = HashInterner()
+DEFAULT_HASH_ID = HASHES.intern(DEFAULT_HASH)
+
+
 class ConsensusBlockStatus(object):
+    __slots__ = ('hash_id', 'best_block_id', 'block_status', 'era_block_id', 'adaptive')
+    # fields checked against a verified status, which may differ from the canonical one when equal
+    VERIFIED_FIELDS = ('era_block_id',)
+
     def __init__(self, json_data):
-        self.hash = json_data['blockHash']
-        self.best_block_hash = json_data['bestBlockHash']
+        self.hash_id = HASHES.intern(json_data['blockHash'])
+        self.best_block_id = HASHES.intern(json_data['bestBlockHash'])
         self.block_status = BlockStatus(int(json_data['blockStatus'], 16))
-        self.era_block_hash = json_data['eraBlockHash']
+        self.era_block_id = HASHES.intern(json_data['eraBlockHash'])
         self.adaptive = json_data['adaptive']
 
+    @property
+    def hash(self):
+        return HASHES.hash(self.hash_id)
+
+    @property
+    def best_block_hash(self):
+        return HASHES.hash(self.best_block_id)
+
+    @property
+    def era_block_hash(self):
+        return HASHES.hash(self.era_block_id)
+
     def __eq__(self, other):
         if self.block_status == BlockStatus.Pending or \
                 other.block_status == BlockStatus.Pending:
             return True
-        if self.era_block_hash != DEFAULT_HASH and \
-                other.era_block_hash != DEFAULT_HASH and \
-                self.era_block_hash != other.era_block_hash:
+        if self.era_block_id != DEFAULT_HASH_ID and \
+                other.era_block_id != DEFAULT_HASH_ID and \
+                self.era_block_id != other.era_block_id:
             return False
-        return self.hash == other.hash and \
+        return self.hash_id == other.hash_id and \
             self.block_status == other.block_status and \
             self.adaptive == other.adaptive
 
@@ -157,18 +317,39 @@ class ConsensusBlockStatus(object):
 
 
 class ConsensusExecutionStatus(object):
+    __slots__ = ('hash_id', 'state_root', 'receipt_root', 'logs_bloom_hash', 'state_valid')
+    # fields checked against a verified status, all compared by `__eq__` as well
+    VERIFIED_FIELDS = ('state_root', 'receipt_root', 'logs_bloom_hash', 'state_valid')
+
     def __init__(self, json_data):
-        self.hash = json_data['blockHash']
-        self.deferred_state_root = json_data['deferredStateRoot']
-        self.deferred_receipt_root = json_data['deferredReceiptRoot']
-        self.deferred_logs_bloom_hash = json_data['deferredLogsBloomHash']
+        self.hash_id = HASHES.intern(json_data['blockHash'])
+        # roots are unique to a block, so they are kept as bytes instead of interned
+        self.state_root = bytes.fromhex(json_data['deferredStateRoot'][2:])
+        self.receipt_root = bytes.fromhex(json_data['deferredReceiptRoot'][2:])
+        self.logs_bloom_hash = bytes.fromhex(json_data['deferredLogsBloomHash'][2:])
         self.state_valid = json_data['stateValid']
 
+    @property
+    def hash(self):
+        return HASHES.hash(self.hash_id)
+
+    @property
+    def deferred_state_root(self):
+        return '0x' + self.state_root.hex()
+
+    @property
+    def deferred_receipt_root(self):
+        return '0x' + self.receipt_root.hex()
+
+    @property
+    def deferred_logs_bloom_hash(self):
+        return '0x' + self.logs_bloom_hash.hex()
+
     def __eq__(self, other):
-        return self.hash == other.hash and \
-            self.deferred_state_root == other.deferred_state_root and \
-            self.deferred_receipt_root == other.deferred_receipt_root and \
-            self.deferred_logs_bloom_hash == other.deferred_logs_bloom_hash and \
+        return self.hash_id == other.hash_id and \
+            self.state_root == other.state_root and \
+            self.receipt_root == other.receipt_root and \
+            self.logs_bloom_hash == other.logs_bloom_hash and \
             self.state_valid == other.state_valid
 
     def __str__(self):
@@ -185,74 +366,214 @@ class ConsensusExecutionStatus(object):
             self.state_valid)
 
 
+class VerifiedStatusTable(object):
+    """
+        statuses verified by the peers, shared by all peers: the canonical status of a hash is
+        kept once, with a bitmask of the peers which have verified it.
+    """
+    def __init__(self):
+        self.statuses = {}
+        self.peers = {}
+
+    def view(self, peer_id):
+        return VerifiedStatuses(self, 1 << peer_id)
+
+
+class VerifiedStatuses(object):
+    """
+        the statuses verified by one peer in a VerifiedStatusTable, used like a dict.
+
+        A status equal to the canonical one, but with different `VERIFIED_FIELDS`, e.g. a default
+        era block hash, is kept for the peer only. Fields no check reads, e.g. the best block hash,
+        may differ from the canonical status.
+    """
+    __slots__ = ('_table', '_bit', '_overrides')
+
+    def __init__(self, table, bit):
+        self._table = table
+        self._bit = bit
+        self._overrides = {}
+
+    def __contains__(self, hash_id):
+        return self._table.peers.get(hash_id, 0) & self._bit != 0
+
+    def __getitem__(self, hash_id):
+        if hash_id not in self:
+            raise KeyError(hash_id)
+        return self._overrides.get(hash_id, self._table.statuses[hash_id])
+
+    def __setitem__(self, hash_id, status):
+        canonical = self._table.statuses.setdefault(hash_id, status)
+        if canonical is not status and \
+                any(getattr(canonical, f) != getattr(status, f) for f in status.VERIFIED_FIELDS):
+            self._overrides[hash_id] = status
+        else:
+            self._overrides.pop(hash_id, None)
+        self._table.peers[hash_id] = self._table.peers.get(hash_id, 0) | self._bit
+
+
 class ConsensusSnapshot(object):
-    def __init__(self, peer_id):
+    def __init__(self, peer_id, block_table=None, exec_table=None):
         self.peer_id = peer_id
-        self.block_status_verified = {}
+        # the verified statuses are kept in tables shared by all peers, if any
+        self.block_status_verified = {} if block_table is None else block_table.view(peer_id)
         self.block_status_unverified = {}
-        self.exec_status_verified = {}
+        self.exec_status_verified = {} if exec_table is None else exec_table.view(peer_id)
         self.exec_status_unverified = {}
+        # hash ids whose unverified status is added or changed since the last check of the predicates
+        self.dirty_blocks = set()
+        self.dirty_execs = set()
 
     def add_block(self, block):
-        if block.hash in self.block_status_verified:
-            verified_block = self.block_status_verified[block.hash]
+        if block.hash_id in self.block_status_verified:
+            verified_block = self.block_status_verified[block.hash_id]
             if block.block_status != BlockStatus.Pending:
                 assert block.block_status == verified_block.block_status, "peer[{}] block[{}] status[{}], expect [{}]".format(
                     self.peer_id, block.hash, block.block_status, verified_block.block_status)
                 assert block.adaptive == verified_block.adaptive, "peer[{}] block[{}] adaptive[{}], expect [{}]".format(
                     self.peer_id, block.hash, block.adaptive, verified_block.adaptive)
-                assert block.era_block_hash == verified_block.era_block_hash or \
-                    block.era_block_hash == DEFAULT_HASH, "peer[{}] block[{}] era_block_hash[{}], expect [{}]".format(
+                assert block.era_block_id == verified_block.era_block_id or \
+                    block.era_block_id == DEFAULT_HASH_ID, "peer[{}] block[{}] era_block_hash[{}], expect [{}]".format(
                         self.peer_id, block.hash, block.era_block_hash, verified_block.era_block_hash)
-        elif block.hash in self.block_status_unverified:
-            unverified_block = self.block_status_unverified[block.hash]
+        elif block.hash_id in self.block_status_unverified:
+            unverified_block = self.block_status_unverified[block.hash_id]
             if unverified_block.block_status == BlockStatus.Pending:
-                self.block_status_unverified[block.hash] = block
+                self.block_status_unverified[block.hash_id] = block
+                self.dirty_blocks.add(block.hash_id)
             else:
                 if block.block_status != BlockStatus.Pending:
                     assert block.block_status == unverified_block.block_status, "peer[{}] block[{}] status[{}], expect [{}]".format(
                         self.peer_id, block.hash, block.block_status, unverified_block.block_status)
                     assert block.adaptive == unverified_block.adaptive, "peer[{}] block[{}] adaptive[{}], expect [{}]".format(
                         self.peer_id, block.hash, block.adaptive, unverified_block.adaptive)
-                    assert block.era_block_hash == unverified_block.era_block_hash or \
-                        block.era_block_hash == DEFAULT_HASH or \
-                        unverified_block.era_block_hash == DEFAULT_HASH, "peer[{}] block[{}] era_block_hash[{}], expect [{}]".format(
+                    assert block.era_block_id == unverified_block.era_block_id or \
+                        block.era_block_id == DEFAULT_HASH_ID or \
+                        unverified_block.era_block_id == DEFAULT_HASH_ID, "peer[{}] block[{}] era_block_hash[{}], expect [{}]".format(
                             self.peer_id, block.hash, block.era_block_hash, unverified_block.era_block_hash)
         else:
-            self.block_status_unverified[block.hash] = block
+            self.block_status_unverified[block.hash_id] = block
+            self.dirty_blocks.add(block.hash_id)
 
     def add_exec(self, exec):
-        if exec.hash in self.exec_status_verified:
-            verified_exec = self.exec_status_verified[exec.hash]
-            assert exec.deferred_state_root == verified_exec.deferred_state_root, "peer[{}] block[{}] deferred_state_root[{}], expect[{}]".format(
+        if exec.hash_id in self.exec_status_verified:
+            verified_exec = self.exec_status_verified[exec.hash_id]
+            assert exec.state_root == verified_exec.state_root, "peer[{}] block[{}] deferred_state_root[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.deferred_state_root, verified_exec.deferred_state_root)
-            assert exec.deferred_receipt_root == verified_exec.deferred_receipt_root, "peer[{}] block[{}] deferred_receipt_root[{}], expect[{}]".format(
+            assert exec.receipt_root == verified_exec.receipt_root, "peer[{}] block[{}] deferred_receipt_root[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.deferred_receipt_root, verified_exec.deferred_receipt_root)
-            assert exec.deferred_logs_bloom_hash == verified_exec.deferred_logs_bloom_hash, "peer[{}] block[{}] deferred_logs_bloom_hash[{}], expect[{}]".format(
+            assert exec.logs_bloom_hash == verified_exec.logs_bloom_hash, "peer[{}] block[{}] deferred_logs_bloom_hash[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.deferred_logs_bloom_hash, verified_exec.deferred_logs_bloom_hash)
             assert exec.state_valid == verified_exec.state_valid, "peer[{}] block[{}] state_valid[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.state_valid, verified_exec.state_valid)
-        elif exec.hash in self.exec_status_unverified:
-            unverified_exec = self.exec_status_unverified[exec.hash]
-            assert exec.deferred_state_root == unverified_exec.deferred_state_root, "peer[{}] block[{}] deferred_state_root[{}], expect[{}]".format(
+        elif exec.hash_id in self.exec_status_unverified:
+            unverified_exec = self.exec_status_unverified[exec.hash_id]
+            assert exec.state_root == unverified_exec.state_root, "peer[{}] block[{}] deferred_state_root[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.deferred_state_root, unverified_exec.deferred_state_root)
-            assert exec.deferred_receipt_root == unverified_exec.deferred_receipt_root, "peer[{}] block[{}] deferred_receipt_root[{}], expect[{}]".format(
+            assert exec.receipt_root == unverified_exec.receipt_root, "peer[{}] block[{}] deferred_receipt_root[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.deferred_receipt_root, unverified_exec.deferred_receipt_root)
-            assert exec.deferred_logs_bloom_hash == unverified_exec.deferred_logs_bloom_hash, "peer[{}] block[{}] deferred_logs_bloom_hash[{}], expect[{}]".format(
+            assert exec.logs_bloom_hash == unverified_exec.logs_bloom_hash, "peer[{}] block[{}] deferred_logs_bloom_hash[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.deferred_logs_bloom_hash, unverified_exec.deferred_logs_bloom_hash)
             assert exec.state_valid == unverified_exec.state_valid, "peer[{}] block[{}] state_valid[{}], expect[{}]".format(
                 self.peer_id, exec.hash, exec.state_valid, unverified_exec.state_valid)
         else:
-            self.exec_status_unverified[exec.hash] = exec
+            self.exec_status_unverified[exec.hash_id] = exec
+            self.dirty_execs.add(exec.hash_id)
+
+
+class TraceLog(object):
+    """
+        append-only JSONL log in files `<name>.<seq>.jsonl` of a directory,
+        rotated to a new file every `max_bytes` and fsynced at most every `fsync_interval` seconds.
+    """
+    def __init__(self, directory, name, max_bytes=64 << 20, fsync_interval=1.0):
+        self._directory = directory
+        self._name = name
+        self._max_bytes = max_bytes
+        self._fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._seq = len(TraceLog.files(directory, name))
+        self._fp = None
+        self._last_sync = time.time()
+        self._open()
+
+    def _open(self):
+        path = os.path.join(self._directory, "{}.{:06d}.jsonl".format(self._name, self._seq))
+        self._fp = open(path, 'a')
+        self._seq += 1
+
+    def append(self, record):
+        with self._lock:
+            self._fp.write(json.dumps(record) + '\n')
+            if self._fp.tell() >= self._max_bytes:
+                self._sync()
+                self._fp.close()
+                self._open()
+            elif time.time() - self._last_sync >= self._fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._last_sync = time.time()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._fp.close()
+
+    @staticmethod
+    def files(directory, name):
+        prefix = name + '.'
+        return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                      if f.startswith(prefix) and f.endswith('.jsonl') and f[len(prefix):-len('.jsonl')].isdigit())
+
+    @staticmethod
+    def read(directory, name):
+        """
+            yield the records in the order of appending, ignoring a truncated last line
+        """
+        for path in TraceLog.files(directory, name):
+            with open(path, 'r') as fp:
+                for line in fp:
+                    if line.endswith('\n'):
+                        yield json.loads(line)
+
+    @staticmethod
+    def index(directory, name, key):
+        """
+            return {record[key]: (path, offset)} to read the records on demand by `read_at`
+        """
+        result = {}
+        for path in TraceLog.files(directory, name):
+            with open(path, 'rb') as fp:
+                offset = 0
+                for line in fp:
+                    if line.endswith(b'\n'):
+                        result[json.loads(line)[key]] = (path, offset)
+                    offset += len(line)
+        return result
+
+    @staticmethod
+    def read_at(location):
+        (path, offset) = location
+        with open(path, 'rb') as fp:
+            fp.seek(offset)
+            return json.loads(fp.readline())
 
 
 class Snapshot(object):
-    def __init__(self, peer_id, genesis):
+    def __init__(self, peer_id, genesis, event_log=None, block_table=None, exec_table=None):
         self.genesis = genesis
         self.peer_id = peer_id
-        self.consensus = ConsensusSnapshot(peer_id)
+        self.consensus = ConsensusSnapshot(peer_id, block_table, exec_table)
         self.sync_graph = None
         self.network = None
+        # events are streamed to the event log if any, otherwise kept in memory
+        self.event_log = event_log
         self.event_list = []
 
     def update(self, delta):
@@ -264,15 +585,21 @@ class Snapshot(object):
         for exec_status in delta['blockExecutionStateVec']:
             self.consensus.add_exec(ConsensusExecutionStatus(exec_status))
 
+    def _append_event(self, event):
+        if self.event_log is None:
+            self.event_list.append(event)
+        else:
+            self.event_log.append(event.to_json())
+
     def stop(self):
-        self.event_list.append(StopEvent())
+        self._append_event(StopEvent())
 
     def start(self):
-        self.event_list.append(StartEvent())
+        self._append_event(StartEvent())
 
     def new_blocks(self, blocks):
         for block in blocks:
-            self.event_list.append(NewBlockEvent(
+            self._append_event(NewBlockEvent(
                 block['blockHash'],
                 block['parent'],
                 block['referees'],
@@ -287,6 +614,92 @@ class Snapshot(object):
         }
 
 
+def sign_fake_txs(nonces, epoch_height):
+    client = RpcClient(None)
+    txs = []
+    for nonce in nonces:
+        addr = client.rand_addr()
+        txs.append(client.new_tx(receiver=addr, nonce=nonce, value=0, gas=client.DEFAULT_TX_GAS, data=b'',
+                                 epoch_height=epoch_height))
+    return eth_utils.encode_hex(rlp.encode(txs))
+
+
+class TxReservoir(object):
+    """
+        RLP encoded fake txs of the next blocks of every peer, signed ahead in worker processes.
+
+        Every peer has a queue of pending signing jobs, in the order of their nonce ranges,
+        which a background thread refills up to `target_depth` blocks. Popping the txs of
+        a block only waits if the job at the head of the queue is not done yet, which is
+        counted as a starvation.
+    """
+    def __init__(self, num_peers, txs_per_block, epoch_height_fn, target_depth=8, workers=None):
+        self._txs_per_block = txs_per_block
+        self._epoch_height_fn = epoch_height_fn
+        self._target_depth = target_depth
+        self._queues = [collections.deque() for _ in range(num_peers)]
+        self._next_nonce = [0] * num_peers
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._executor = ProcessPoolExecutor(workers)
+        self._thread = threading.Thread(target=self._refill, daemon=True)
+        self.popped = 0
+        self.starved = 0
+        self.starved_time = 0.0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self._executor.shutdown(cancel_futures=True)
+
+    def _submit(self, peer, epoch_height):
+        nonce = self._next_nonce[peer]
+        self._next_nonce[peer] = nonce + self._txs_per_block
+        self._queues[peer].append(self._executor.submit(
+            sign_fake_txs, range(nonce, nonce + self._txs_per_block), epoch_height))
+
+    def _refill(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopped or
+                                    any(len(q) < self._target_depth for q in self._queues))
+                if self._stopped:
+                    return
+            # sign with a recent epoch height so that the txs stay in the epoch bound
+            epoch_height = self._epoch_height_fn()
+            with self._cond:
+                for peer in range(len(self._queues)):
+                    while len(self._queues[peer]) < self._target_depth:
+                        self._submit(peer, epoch_height)
+
+    def pop(self, peer):
+        """
+            return the RLP encoded txs of the next block of the peer
+        """
+        with self._cond:
+            if len(self._queues[peer]) == 0:
+                self._submit(peer, self._epoch_height_fn())
+            job = self._queues[peer].popleft()
+            self._cond.notify()
+        self.popped += 1
+        if not job.done():
+            start = time.time()
+            result = job.result()
+            self.starved += 1
+            self.starved_time += time.time() - start
+            return result
+        return job.result()
+
+    def report(self):
+        return "{} blocks, starved {} times for {:.3f}s".format(self.popped, self.starved, self.starved_time)
+
+
 class Predicate(object):
     def __call__(self, snapshots, stopped_peers):
         raise NotImplementedError()
@@ -303,10 +716,28 @@ class ConfluxTracing(ConfluxTestFramework):
             db_crash_timeout=10,
             replay=False,
             snapshot_file=None,
-            txs_file=None):
+            txs_file=None,
+            trace_dir=None,
+            replay_peer=0,
+            tx_reservoir_depth=8,
+            seed=None,
+            schedule_file=None,
+            virtual_time=False,
+            status_file=None,
+            recovery_chain_lengths=None,
+            recovery_repeats=3,
+            recovery_modes=RECOVERY_MODES,
+            recovery_output='recovery.json',
+            replay_batch_size=200,
+            checkpoint_interval=0,
+            checkpoint_dir='replay_checkpoints'):
         super().__init__()
         self._lock = threading.Lock()
         self._peer_lock = threading.Lock()
+        # per-peer locks to retrieve the snapshot of a peer, always acquired after `_peer_lock` if both
+        self._peer_locks = []
+        self._snapshot_executor = None
+        self._fetch_latencies = []
         self._crash_timeout = crash_timeout
         self._start_timeout = start_timeout
         self._blockgen_timeout = blockgen_timeout
@@ -315,11 +746,35 @@ class ConfluxTracing(ConfluxTestFramework):
         self.num_nodes = nodes
         self._replay = replay
         self._snapshot_file = snapshot_file
+        # stream events and txs to append-only logs in this directory instead of keeping them in memory
+        self._trace_dir = trace_dir
+        self._replay_peer = replay_peer
+        self._replay_batch_size = replay_batch_size
+        # checkpoint the data dir of the replaying node every this many events, 0 to disable
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_dir = checkpoint_dir
+        self._tx_log = None
+        self._tx_reservoir_depth = tx_reservoir_depth
+        self._tx_reservoir = None
+        # all random choices of the fault injection are drawn from one seeded RNG
+        self._seed = random.randrange(1 << 32) if seed is None else seed
+        self._rng = random.Random(self._seed)
+        # replay the actions recorded in this schedule instead of drawing new ones
+        self._schedule_file = schedule_file
+        self._virtual_time = virtual_time
+        self._schedule = []
+        self._schedule_log = None
+        # periodically write the progress of the run to this json file, e.g. for a launcher of many runs
+        self._status_file = status_file
+        # benchmark the recovery of nodes at these chain lengths instead of random testing
+        self._recovery_chain_lengths = recovery_chain_lengths
+        self._recovery_repeats = recovery_repeats
+        self._recovery_modes = recovery_modes
+        self._recovery_output = recovery_output
 
         self._snapshots = []
         self._predicates = []
         self._stopped_peers = []
-        self._peer_nonce = []
         if txs_file is None:
             self._block_txs = {}
         else:
@@ -334,122 +789,188 @@ class ConfluxTracing(ConfluxTestFramework):
                     alive_peer_indices.setdefault(sync_phase, []).append(i)
         return alive_peer_indices
 
-    def _random_start(self):
+    def _random_start(self, peer=None):
         try:
             if len(self._stopped_peers):
                 with self._peer_lock:
-                    chosen_peer = self._stopped_peers[random.randint(
-                        0, len(self._stopped_peers) - 1)]
-                    self._stopped_peers.remove(chosen_peer)
-                    self.log.info("starting {}".format(chosen_peer))
-                    self.start_node(chosen_peer, phase_to_wait=None)
-                    self._snapshots[chosen_peer].start()
-                    self.log.info("started {}".format(chosen_peer))
+                    if peer is None:
+                        chosen_peer = self._stopped_peers[self._rng.randint(
+                            0, len(self._stopped_peers) - 1)]
+                    elif peer in self._stopped_peers:
+                        chosen_peer = peer
+                    else:
+                        self.log.info("skip starting {} which is not stopped".format(peer))
+                        return None
+                    with self._peer_locks[chosen_peer]:
+                        self._stopped_peers.remove(chosen_peer)
+                        self.log.info("starting {}".format(chosen_peer))
+                        self.start_node(chosen_peer, phase_to_wait=None)
+                        self._snapshots[chosen_peer].start()
+                        self.log.info("started {}".format(chosen_peer))
+                    return {'peer': chosen_peer}
         except Exception as e:
             self.log.info('got exception[{}] during start'.format(repr(e)))
             self.persist_snapshot()
             raise e
 
-    def _random_crash(self):
+    def _random_crash(self, peer=None, clean=None):
         try:
             with self._peer_lock:
-                alive_peer_indices = self._retrieve_alive_peers(
-                    ["NormalSyncPhase", "CatchUpSyncBlockPhase"])
-                normal_peers = alive_peer_indices.get('NormalSyncPhase', [])
-                catch_up_peers = alive_peer_indices.get('CatchUpSyncBlockPhase', [])
-                if (len(normal_peers) - 1) * 2 <= len(self.nodes):
-                    return
-                alive_peer_indices = normal_peers + catch_up_peers
-                # We need peer[0] to run forever as a reference
-                chosen_peer = alive_peer_indices[random.randint(
-                    1, len(alive_peer_indices) - 1)]
+                if peer is None:
+                    alive_peer_indices = self._retrieve_alive_peers(
+                        ["NormalSyncPhase", "CatchUpSyncBlockPhase"])
+                    normal_peers = alive_peer_indices.get('NormalSyncPhase', [])
+                    catch_up_peers = alive_peer_indices.get('CatchUpSyncBlockPhase', [])
+                    if (len(normal_peers) - 1) * 2 <= len(self.nodes):
+                        return None
+                    alive_peer_indices = normal_peers + catch_up_peers
+                    # We need peer[0] to run forever as a reference
+                    chosen_peer = alive_peer_indices[self._rng.randint(
+                        1, len(alive_peer_indices) - 1)]
+                    clean = self._rng.random() <= 0.5
+                elif peer != 0 and peer not in self._stopped_peers:
+                    chosen_peer = peer
+                else:
+                    self.log.info("skip stopping {} which is not running".format(peer))
+                    return None
                 self.log.info("stopping {}".format(chosen_peer))
-                # retrieve new ready blocks before stopping it
-                new_blocks = self.nodes[chosen_peer].sync_graph_state()
-                self._snapshots[chosen_peer].new_blocks(new_blocks['readyBlockVec'])
-                clean_data = True if random.random() <= 0.5 and chosen_peer != 0 else False
-                self.stop_node(chosen_peer, clean=clean_data)
-                self._stopped_peers.append(chosen_peer)
-                self._snapshots[chosen_peer].stop()
+                with self._peer_locks[chosen_peer]:
+                    # retrieve new ready blocks before stopping it
+                    new_blocks = self.nodes[chosen_peer].sync_graph_state()
+                    self._snapshots[chosen_peer].new_blocks(new_blocks['readyBlockVec'])
+                    self.stop_node(chosen_peer, clean=clean)
+                    self._stopped_peers.append(chosen_peer)
+                    self._snapshots[chosen_peer].stop()
                 self.log.info("stopped {}".format(chosen_peer))
+                return {'peer': chosen_peer, 'clean': clean}
         except Exception as e:
             self.log.info('got exception[{}] during crash'.format(repr(e)))
             self.persist_snapshot()
             raise e
 
-    def _enable_db_crash(self):
+    def _enable_db_crash(self, peer=None):
         try:
             with self._peer_lock:
-                alive_peer_indices = self._retrieve_alive_peers(
-                    ["NormalSyncPhase", "CatchUpSyncBlockPhase"])
-                normal_peers = alive_peer_indices.get('NormalSyncPhase', [])
-                catch_up_peers = alive_peer_indices.get('CatchUpSyncBlockPhase', [])
-                alive_peer_indices = normal_peers + catch_up_peers
-                if len(alive_peer_indices) <= 3:
-                    return
-                # We need peer[0] to run forever as a reference
-                chosen_peer = alive_peer_indices[random.randint(
-                    1, len(alive_peer_indices) - 1)]
+                if peer is None:
+                    alive_peer_indices = self._retrieve_alive_peers(
+                        ["NormalSyncPhase", "CatchUpSyncBlockPhase"])
+                    normal_peers = alive_peer_indices.get('NormalSyncPhase', [])
+                    catch_up_peers = alive_peer_indices.get('CatchUpSyncBlockPhase', [])
+                    alive_peer_indices = normal_peers + catch_up_peers
+                    if len(alive_peer_indices) <= 3:
+                        return None
+                    # We need peer[0] to run forever as a reference
+                    chosen_peer = alive_peer_indices[self._rng.randint(
+                        1, len(alive_peer_indices) - 1)]
+                elif peer != 0 and peer not in self._stopped_peers:
+                    chosen_peer = peer
+                else:
+                    self.log.info("skip enabling db crash {} which is not running".format(peer))
+                    return None
                 self.log.info("enable db crash {}".format(chosen_peer))
                 self.nodes[chosen_peer].save_node_db()
                 self.nodes[chosen_peer].set_db_crash(CRASH_EXIT_PROBABILITY, CRASH_EXIT_CODE)
+                return {'peer': chosen_peer}
         except Exception as e:
             self.log.info('got exception[{}] during db crash'.format(repr(e)))
             self.persist_snapshot()
             raise e
 
-    def _generate_txs(self, peer, num):
-        client = RpcClient(self.nodes[peer])
-        txs = []
-        for _ in range(num):
-            addr = client.rand_addr()
-            tx_gas = client.DEFAULT_TX_GAS
-            nonce = self._peer_nonce[peer]
-            self._peer_nonce[peer] = nonce + 1
-            tx = client.new_tx(receiver=addr, nonce=nonce, value=0, gas=tx_gas, data=b'')
-            txs.append(tx)
-        return txs
-
-    def _generate_block(self):
+    def _write_status(self, scheduler):
+        status = scheduler.status()
+        status['seed'] = self._seed
+        status['stopped_peers'] = list(self._stopped_peers)
+        tmp_file = self._status_file + '.tmp'
+        with open(tmp_file, 'w') as fp:
+            json.dump(status, fp)
+        os.replace(tmp_file, self._status_file)
+        return None
+
+    def _latest_epoch_number(self):
+        for i in range(len(self.nodes)):
+            if i not in self._stopped_peers:
+                try:
+                    return RpcClient(self.nodes[i]).epoch_number()
+                except Exception:
+                    continue
+        return 0
+
+    def _generate_block(self, peer=None, partial_invalid=None):
         """
             random select an alive peer and generate a block
         """
         try:
             with self._peer_lock:
-                alive_peer_indices = self._retrieve_alive_peers(["NormalSyncPhase"])
-                alive_peer_indices = alive_peer_indices.get('NormalSyncPhase', [])
-                if self.options.archive:
-                    assert len(alive_peer_indices) * \
-                        2 > self.num_nodes, "alive[{}] total[{}]".format(len(alive_peer_indices), self.num_nodes)
-                chosen_peer = alive_peer_indices[random.randint(
-                    0, len(alive_peer_indices) - 1)]
-                txs = self._generate_txs(chosen_peer, NUM_TX_PER_BLOCK)
-                if random.randint(1, 100) <= 40:
-                    # this will generate a partial invalid block
-                    block_hash = RpcClient(self.nodes[chosen_peer]).generate_block_with_fake_txs(txs, True)
+                if peer is None:
+                    alive_peer_indices = self._retrieve_alive_peers(["NormalSyncPhase"])
+                    alive_peer_indices = alive_peer_indices.get('NormalSyncPhase', [])
+                    if self.options.archive:
+                        assert len(alive_peer_indices) * \
+                            2 > self.num_nodes, "alive[{}] total[{}]".format(len(alive_peer_indices), self.num_nodes)
+                    chosen_peer = alive_peer_indices[self._rng.randint(
+                        0, len(alive_peer_indices) - 1)]
+                    # in 40% of cases, this will generate a partial invalid block
+                    partial_invalid = self._rng.randint(1, 100) <= 40
+                elif peer not in self._stopped_peers:
+                    chosen_peer = peer
+                else:
+                    self.log.info("skip generating block on {} which is stopped".format(peer))
+                    return None
+                starved = self._tx_reservoir.starved
+                encoded_txs = self._tx_reservoir.pop(chosen_peer)
+                if self._tx_reservoir.starved > starved:
+                    self.log.info("peer[%d] waited for txs to sign, tx reservoir: %s",
+                                  chosen_peer, self._tx_reservoir.report())
+                block_hash = self.nodes[chosen_peer].test_generateblockwithfaketxs(
+                    encoded_txs, partial_invalid)
+                assert_is_hash_string(block_hash)
+                if self._tx_log is None:
+                    self._block_txs[block_hash] = encoded_txs
                 else:
-                    block_hash = RpcClient(self.nodes[chosen_peer]).generate_block_with_fake_txs(txs)
-                self._block_txs[block_hash] = eth_utils.encode_hex(rlp.encode(txs))
+                    self._tx_log.append({'hash': block_hash, 'txs': encoded_txs})
                 self.log.info("peer[%d] generate block[%s]", chosen_peer, block_hash)
+                return {'peer': chosen_peer, 'partial_invalid': partial_invalid}
         except Exception as e:
             self.log.info('got exception[{}] when generateing block'.format(repr(e)))
             self.persist_snapshot()
             raise e
 
+    def _retrieve_peer_snapshot(self, i):
+        """
+            fetch and apply the delta of a peer, return the fetch latency or None if the peer is stopped
+        """
+        # Hold the lock of the peer, so that it is not stopped or started in between,
+        # and its new ready blocks are recorded in order with its stop event.
+        with self._peer_locks[i]:
+            if i in self._stopped_peers:
+                return None
+            node = self.nodes[i]
+            start = time.time()
+            delta = node.consensus_graph_state()
+            new_blocks = node.sync_graph_state()
+            latency = time.time() - start
+            self._snapshots[i].update(delta)
+            self._snapshots[i].new_blocks(new_blocks['readyBlockVec'])
+        self._fetch_latencies[i].append(latency)
+        return latency
+
     def _retrieve_snapshot(self):
         try:
+            start = time.time()
             with self._peer_lock:
-                for (snapshot, (i, node)) in zip(self._snapshots, enumerate(self.nodes)):
-                    # skip stopped nodes
-                    if i in self._stopped_peers:
-                        continue
-                    delta = node.consensus_graph_state()
-                    new_blocks = node.sync_graph_state()
-                    snapshot.update(delta)
-                    snapshot.new_blocks(new_blocks['readyBlockVec'])
+                # skip stopped nodes
+                alive_peers = [i for i in range(len(self.nodes)) if i not in self._stopped_peers]
+            latencies = list(self._snapshot_executor.map(self._retrieve_peer_snapshot, alive_peers))
+            fetched = [(latency, i) for (latency, i) in zip(latencies, alive_peers) if latency is not None]
+            if len(fetched) > 0:
+                (max_latency, slowest_peer) = max(fetched)
+                self.log.debug("snapshot round {:.3f}s, {} peers, fetch latency avg {:.3f}s max {:.3f}s (peer {})".format(
+                    time.time() - start, len(fetched), sum(l for (l, _) in fetched) / len(fetched),
+                    max_latency, slowest_peer))
             with self._lock:
                 for predicate in self._predicates:
                     predicate(self._snapshots, self._stopped_peers)
+            return {}
         except Exception as e:
             self.log.info('got exception[{}] during verify'.format(repr(e)))
             self.persist_snapshot()
@@ -491,8 +1012,8 @@ class ConfluxTracing(ConfluxTestFramework):
         self.log.info("start P2P connection ...")
         start_p2p_connection(self.nodes)
 
-    def setup_balance(self):
-        client = RpcClient(self.nodes[0])
+    def setup_balance(self, node_index=0):
+        client = RpcClient(self.nodes[node_index])
         for (i, node) in enumerate(self.nodes):
             pub_key = node.key
             addr = node.addr
@@ -503,10 +1024,20 @@ class ConfluxTracing(ConfluxTestFramework):
             client.send_tx(tx)
 
     def persist_snapshot(self):
+        if self._trace_dir:
+            self._tx_log.sync()
+            self._schedule_log.sync()
+            for snapshot in self._snapshots:
+                snapshot.event_log.sync()
+            self.log.info("trace logs synced to {}".format(self._trace_dir))
+            return
         self.log.info("saving txs to txs.json")
         with open('txs.json', 'w') as fp:
             fp.write(json.dumps(self._block_txs))
         self.log.info("txs saved to txs.json")
+        with open('schedule.json', 'w') as fp:
+            json.dump({'seed': self._seed, 'schedule': self._schedule}, fp)
+        self.log.info("schedule of seed {} saved to schedule.json".format(self._seed))
         for (index, snapshot) in enumerate(self._snapshots):
             self.log.info('saving snapshot {} to snapshot_{}.json'.format(index, index))
             with open('snapshot_{}.json'.format(index), 'w') as fp:
@@ -515,37 +1046,121 @@ class ConfluxTracing(ConfluxTestFramework):
 
     def run_test(self):
         if self._replay:
-            self.replay(self._snapshot_file)
+            if self._trace_dir:
+                self.replay_trace(self._trace_dir, self._replay_peer)
+            else:
+                self.replay(self._snapshot_file)
+            return
+        if self._recovery_chain_lengths:
+            self.run_recovery_bench()
             return
         genesis_hash = self.nodes[0].best_block_hash()
-        crash_timer = Timer(self._crash_timeout, self._random_crash)
-        start_timer = Timer(self._start_timeout, self._random_start)
-        blockgen_timer = Timer(self._blockgen_timeout, self._generate_block)
-        snapshot_timer = Timer(self._snapshot_timeout, self._retrieve_snapshot)
-        db_crash_timer = Timer(self._db_crash_timeout, self._enable_db_crash)
-
-        self._snapshots = [Snapshot(i, genesis_hash) for i in range(len(self.nodes))]
-        self._peer_nonce = [0] * len(self.nodes)
+        self.log.info("fault injection seed {}".format(self._seed))
+
+        if self._trace_dir:
+            os.makedirs(self._trace_dir, exist_ok=True)
+            assert len(os.listdir(self._trace_dir)) == 0, "trace dir {} is not empty".format(self._trace_dir)
+            with open(os.path.join(self._trace_dir, 'genesis.json'), 'w') as fp:
+                json.dump({'genesis': genesis_hash}, fp)
+            self._tx_log = TraceLog(self._trace_dir, 'txs')
+            self._schedule_log = TraceLog(self._trace_dir, 'schedule')
+            event_logs = [TraceLog(self._trace_dir, 'peer_{}'.format(i)) for i in range(len(self.nodes))]
+        else:
+            event_logs = [None] * len(self.nodes)
+        (block_table, exec_table) = (VerifiedStatusTable(), VerifiedStatusTable())
+        self._snapshots = [Snapshot(i, genesis_hash, event_logs[i], block_table, exec_table)
+                           for i in range(len(self.nodes))]
+        self._tx_reservoir = TxReservoir(len(self.nodes), NUM_TX_PER_BLOCK,
+                                         self._latest_epoch_number, self._tx_reservoir_depth).start()
+        self._peer_locks = [threading.Lock() for _ in self.nodes]
+        self._fetch_latencies = [[] for _ in self.nodes]
+        self._snapshot_executor = ThreadPoolExecutor(len(self.nodes))
         self.setup_balance()
 
-        crash_timer.start()
-        start_timer.start()
-        blockgen_timer.start()
-        snapshot_timer.start()
-        db_crash_timer.start()
-
-        # TODO: we may make it run forever
-        time.sleep(200000)
+        scheduler = FaultScheduler(
+            self.log, self._virtual_time,
+            self._schedule.append if self._schedule_log is None else self._schedule_log.append)
+        scheduler.add('crash', self._crash_timeout, self._random_crash)
+        scheduler.add('start', self._start_timeout, self._random_start)
+        scheduler.add('blockgen', self._blockgen_timeout, self._generate_block)
+        scheduler.add('snapshot', self._snapshot_timeout, self._retrieve_snapshot)
+        scheduler.add('db_crash', self._db_crash_timeout, self._enable_db_crash)
+        if self._status_file:
+            scheduler.add('status', STATUS_INTERVAL, lambda: self._write_status(scheduler))
+        if self._schedule_file:
+            scheduler.replay(self.load_schedule(self._schedule_file))
+        else:
+            # TODO: we may make it run forever
+            scheduler.run(200000)
+        self.log.info("scheduler: {}".format(scheduler.report()))
+
+        self._snapshot_executor.shutdown()
+        self._tx_reservoir.stop()
+        self.log.info("tx reservoir: {}".format(self._tx_reservoir.report()))
+        for (i, latencies) in enumerate(self._fetch_latencies):
+            if len(latencies) > 0:
+                self.log.info("peer[{}] snapshot fetch latency avg {:.3f}s max {:.3f}s in {} rounds".format(
+                    i, sum(latencies) / len(latencies), max(latencies), len(latencies)))
+        self.persist_snapshot()
 
-        crash_timer.cancel()
-        start_timer.cancel()
-        blockgen_timer.cancel()
-        snapshot_timer.cancel()
-        db_crash_timer.cancel()
+    def _crash_and_recover(self, peer, mode):
+        """
+            stop the peer by `mode`, then start it and return the timings of its recovery
+        """
+        node = self.nodes[peer]
+        if mode == 'kill':
+            # an unexpected crash, which keeps the data but skips a clean shutdown,
+            # then mark the node as stopped like `stop_node` does
+            node.process.kill()
+            node.process.wait()
+            node.running = False
+            node.process = None
+        else:
+            self.stop_node(peer, clean=(mode == 'clean'))
+        event = StartEvent()
+        event.execute(node, track_phases=True)
+        return event.timings
 
-        # wait for timer exit
-        time.sleep(20)
-        self.persist_snapshot()
+    def run_recovery_bench(self):
+        """
+            crash peers at each chain length in every mode, and report the distribution of the time to
+            reach each step of the recovery against the chain length
+        """
+        # imported here, so that the other modes do not depend on the script and its dependencies
+        from scripts.stat_latency_map_reduce import Statistics, Percentile
+
+        samples = []
+        peer = 0
+        for chain_length in sorted(self._recovery_chain_lengths):
+            block_count = self.nodes[0].test_getBlockCount()
+            while block_count < chain_length:
+                self.nodes[0].generate_empty_blocks(min(1000, chain_length - block_count))
+                block_count = self.nodes[0].test_getBlockCount()
+            sync_blocks(self.nodes, timeout=3600)
+            for mode in self._recovery_modes:
+                for _ in range(self._recovery_repeats):
+                    # peer[0] generates the blocks and never crashes
+                    peer = peer % (len(self.nodes) - 1) + 1
+                    timings = self._crash_and_recover(peer, mode)
+                    self.log.info("peer[{}] recovered from {} at {} blocks: {}".format(
+                        peer, mode, block_count, {k: round(v, 3) for (k, v) in timings.items()}))
+                    samples.append({'chain_length': block_count, 'mode': mode, 'peer': peer, 'timings': timings})
+                    sync_blocks(self.nodes, timeout=3600)
+
+        summary = []
+        for mode in self._recovery_modes:
+            for chain_length in sorted(set(s['chain_length'] for s in samples)):
+                group = [s['timings'] for s in samples if s['mode'] == mode and s['chain_length'] == chain_length]
+                steps = sorted(set(k for t in group for k in t), key=lambda k: min(t[k] for t in group if k in t))
+                for step in steps:
+                    stat = Statistics([t[step] for t in group if step in t], 3)
+                    summary.append({'mode': mode, 'chain_length': chain_length, 'step': step, 'stat': stat.__dict__})
+                    self.log.info("{:>5} {:>8} blocks {:>40}: p50 {:.3f}s p90 {:.3f}s max {:.3f}s".format(
+                        mode, chain_length, step, stat.get(Percentile.P50), stat.get(Percentile.P90),
+                        stat.get(Percentile.Max)))
+        with open(self._recovery_output, 'w') as fp:
+            json.dump({'samples': samples, 'summary': summary}, fp, indent=1)
+        self.log.info("recovery benchmark of {} samples saved to {}".format(len(samples), self._recovery_output))
 
     def add_predicate(self, predicate):
         assert isinstance(predicate, Predicate)
@@ -597,6 +1212,86 @@ class ConfluxTracing(ConfluxTestFramework):
             type=float,
             default=2,
             help='snapshot retrieve interval')
+        run_parser.add_argument(
+            '-trace_dir',
+            '--trace_dir',
+            dest='trace_dir',
+            default=None,
+            help='stream events and txs to append-only logs in this directory')
+        run_parser.add_argument(
+            '-trd',
+            '--tx-reservoir-depth',
+            dest='tx_reservoir_depth',
+            type=int,
+            default=8,
+            help='number of blocks of txs signed ahead per peer')
+        run_parser.add_argument(
+            '-seed',
+            '--seed',
+            dest='seed',
+            type=int,
+            default=None,
+            help='seed of the random fault injection, random if not set')
+        run_parser.add_argument(
+            '-schedule',
+            '--schedule',
+            dest='schedule',
+            default=None,
+            help='replay the actions recorded in a schedule.json or trace dir')
+        run_parser.add_argument(
+            '-virtual_time',
+            '--virtual_time',
+            dest='virtual_time',
+            action='store_true',
+            help='run the actions back to back on a virtual timeline instead of the wall clock')
+        run_parser.add_argument(
+            '-status_file',
+            '--status_file',
+            dest='status_file',
+            default=None,
+            help='write the progress of the run to this json file every {}s'.format(STATUS_INTERVAL))
+
+        recovery_parser = subparsers.add_parser('recovery')
+        recovery_parser.add_argument(
+            '-n',
+            '--nodes',
+            dest='nodes',
+            type=int,
+            default=4,
+            help='number of nodes to run')
+        recovery_parser.add_argument(
+            '-archive',
+            '--archive',
+            dest='archive',
+            type=int,
+            default=1,
+            help='archive node mode or full node mode')
+        recovery_parser.add_argument(
+            '-chain_lengths',
+            '--chain_lengths',
+            dest='chain_lengths',
+            default='1000,10000,50000',
+            help='comma separated numbers of blocks to crash the peers at')
+        recovery_parser.add_argument(
+            '-repeats',
+            '--repeats',
+            dest='repeats',
+            type=int,
+            default=3,
+            help='number of crashes per mode at each chain length')
+        recovery_parser.add_argument(
+            '-modes',
+            '--modes',
+            dest='modes',
+            default=','.join(RECOVERY_MODES),
+            help='comma separated ways to crash the peers: stop keeps the data, clean removes it, '
+                 'kill kills the process')
+        recovery_parser.add_argument(
+            '-output',
+            '--output',
+            dest='output',
+            default='recovery.json',
+            help='json file of the recovery timings')
 
         replay_parser = subparsers.add_parser('replay')
         replay_parser.add_argument(
@@ -610,150 +1305,400 @@ class ConfluxTracing(ConfluxTestFramework):
             '-snapshot_file',
             '--snapshot_file',
             dest='snapshot_file',
-            required=True,
             help="path of snapshot")
         replay_parser.add_argument(
             '-txs_file',
             '--txs_file',
             dest='txs_file',
-            required=True,
             help="path of txs file")
+        replay_parser.add_argument(
+            '-trace_dir',
+            '--trace_dir',
+            dest='trace_dir',
+            help="directory of trace logs, instead of snapshot and txs file")
+        replay_parser.add_argument(
+            '-peer',
+            '--peer',
+            dest='peer',
+            type=int,
+            default=0,
+            help="peer to replay from the trace logs")
+        replay_parser.add_argument(
+            '-batch_size',
+            '--batch_size',
+            dest='batch_size',
+            type=int,
+            default=200,
+            help="max number of blocks sent in one batch request")
+        replay_parser.add_argument(
+            '-checkpoint_interval',
+            '--checkpoint_interval',
+            dest='checkpoint_interval',
+            type=int,
+            default=0,
+            help="checkpoint the node every this many events to resume from, 0 to disable")
+        replay_parser.add_argument(
+            '-checkpoint_dir',
+            '--checkpoint_dir',
+            dest='checkpoint_dir',
+            default='replay_checkpoints',
+            help="directory of the replay checkpoints")
+
+    @staticmethod
+    def load_schedule(path):
+        """
+            load the schedule recorded in a trace dir or a schedule.json
+        """
+        if os.path.isdir(path):
+            return list(TraceLog.read(path, 'schedule'))
+        with open(path, 'r') as fp:
+            return json.load(fp)['schedule']
 
     def replay(self, file_path):
         snapshot = json.load(open(file_path, 'r'))
-        genesis_hash = snapshot['genesis']
-        events = snapshot['events']
-        self.setup_balance()
+        self._replay_events(snapshot['genesis'], lambda: snapshot['events'], lambda h: self._block_txs[h])
+
+    def replay_trace(self, trace_dir, peer):
+        with open(os.path.join(trace_dir, 'genesis.json'), 'r') as fp:
+            genesis_hash = json.load(fp)['genesis']
+        txs_index = TraceLog.index(trace_dir, 'txs', 'hash')
+        self._replay_events(genesis_hash, lambda: TraceLog.read(trace_dir, 'peer_{}'.format(peer)),
+                            lambda h: TraceLog.read_at(txs_index[h])['txs'])
 
+    def _replay_events(self, genesis_hash, read_events, get_txs):
         node = self.nodes[0]
         self._genesis_hash = node.best_block_hash()
         assert genesis_hash == self._genesis_hash
-        for event in events:
-            if event['name'] == StartEvent().name():
-                self.log.info("stop")
-                StartEvent().execute(node)
-            elif event['name'] == StopEvent().name():
-                self.log.info("start")
-                StopEvent().execute(node)
-            else:
-                self.log.info("new block[{}]".format(event['hash']))
-                txs = self._block_txs[event['hash']]
-                NewBlockEvent(
-                    hash=event['hash'],
-                    parent=event['parent'],
-                    referees=event['referees'],
-                    nonce=event['nonce'],
-                    timestamp=event['timestamp'],
-                    adaptive=event['adaptive'],
-                    txs=txs
-                ).execute(node)
+        ReplayEngine(self, 0, get_txs, self._replay_batch_size, self._checkpoint_interval,
+                     self._checkpoint_dir).run(read_events)
+
+    def replay_event(self, node, event, get_txs):
+        if event['name'] == StartEvent().name():
+            self.log.info("stop")
+            StartEvent().execute(node)
+        elif event['name'] == StopEvent().name():
+            self.log.info("start")
+            StopEvent().execute(node)
+        else:
+            self.log.info("new block[{}]".format(event['hash']))
+            txs = get_txs(event['hash'])
+            NewBlockEvent(
+                hash=event['hash'],
+                parent=event['parent'],
+                referees=event['referees'],
+                nonce=event['nonce'],
+                timestamp=event['timestamp'],
+                adaptive=event['adaptive'],
+                txs=txs
+            ).execute(node)
+
+
+class ReplayEngine(object):
+    """
+        fast-forward replay of the events of a snapshot on one node.
+
+        Consecutive new blocks whose parent and referees are not in the same batch are sent in
+        one batch request over a keep-alive connection, while a background thread reads the txs
+        and prepares the next batches. The data dir of the node is checkpointed every
+        `checkpoint_interval` events, and a replay of the same events resumes from the latest
+        checkpoint.
+    """
+    def __init__(self, framework, node_index, get_txs, batch_size=200, checkpoint_interval=0,
+                 checkpoint_dir='replay_checkpoints', report_interval=10):
+        self.log = framework.log
+        self._framework = framework
+        self._node_index = node_index
+        self._node = framework.nodes[node_index]
+        self._get_txs = get_txs
+        self._batch_size = batch_size
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_dir = checkpoint_dir
+        self._report_interval = report_interval
+        # a batch is never sent again once transmitted, so wait for the node to process the whole
+        # batch, allowing a second per block on a slow node
+        self._client = BatchRpcClient("http://{}:{}".format(self._node.ip, self._node.rpcport),
+                                      timeout=max(framework.rpc_timewait, batch_size))
+        self.events = 0
+        self.blocks = 0
+        self.batches = 0
+
+    @staticmethod
+    def _digest_update(digest, event):
+        digest.update(json.dumps(event, sort_keys=True).encode())
+
+    def _checkpoints(self):
+        if not self._checkpoint_interval or not os.path.isdir(self._checkpoint_dir):
+            return {}
+        result = {}
+        for name in os.listdir(self._checkpoint_dir):
+            meta_file = os.path.join(self._checkpoint_dir, name, 'meta.json')
+            if os.path.exists(meta_file):
+                with open(meta_file, 'r') as fp:
+                    meta = json.load(fp)
+                result[meta['index']] = meta['digest']
+        return result
+
+    def _find_resume_index(self, events):
+        """
+            return the index of the latest checkpoint taken after the same events, or 0
+        """
+        checkpoints = self._checkpoints()
+        if len(checkpoints) == 0:
+            return 0
+        resume_index = 0
+        digest = hashlib.sha1()
+        for (i, event) in enumerate(events):
+            self._digest_update(digest, event)
+            if checkpoints.get(i + 1) == digest.hexdigest():
+                resume_index = i + 1
+        return resume_index
+
+    def _stop_node(self):
+        self._client.close()
+        self._node.stop_node()
+        self._node.wait_until_stopped()
+
+    def _checkpoint(self, index, digest):
+        self._stop_node()
+        path = os.path.join(self._checkpoint_dir, "{:012d}".format(index))
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.copytree(self._node.datadir, os.path.join(tmp_path, 'datadir'))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as fp:
+            json.dump({'index': index, 'digest': digest}, fp)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        StartEvent().execute(self._node)
+        self.log.info("checkpoint of {} events saved to {}".format(index, path))
+
+    def _restore(self, index):
+        path = os.path.join(self._checkpoint_dir, "{:012d}".format(index))
+        self._stop_node()
+        shutil.rmtree(self._node.datadir)
+        shutil.copytree(os.path.join(path, 'datadir'), self._node.datadir)
+        StartEvent().execute(self._node)
+        self.log.info("resumed from the checkpoint of {} events in {}".format(index, path))
+
+    def _prepare(self, events, start_index, batches):
+        """
+            put the next ('blocks', [(event, txs)]), ('event', event) or ('checkpoint', (index, digest))
+            into `batches`, then None
+        """
+        try:
+            digest = hashlib.sha1()
+            blocks = []
+            hashes = set()
+            for (i, event) in enumerate(events):
+                self._digest_update(digest, event)
+                if i < start_index:
+                    continue
+                if event['name'] in (StartEvent().name(), StopEvent().name()):
+                    if len(blocks) > 0:
+                        batches.put(('blocks', blocks))
+                        (blocks, hashes) = ([], set())
+                    batches.put(('event', event))
+                else:
+                    # a block is only sent after the batch of its parent and referees
+                    if len(blocks) >= self._batch_size or event['parent'] in hashes or \
+                            any(h in hashes for h in event['referees']):
+                        batches.put(('blocks', blocks))
+                        (blocks, hashes) = ([], set())
+                    blocks.append((event, self._get_txs(event['hash'])))
+                    hashes.add(event['hash'])
+                if self._checkpoint_interval and (i + 1) % self._checkpoint_interval == 0:
+                    if len(blocks) > 0:
+                        batches.put(('blocks', blocks))
+                        (blocks, hashes) = ([], set())
+                    batches.put(('checkpoint', (i + 1, digest.hexdigest())))
+            if len(blocks) > 0:
+                batches.put(('blocks', blocks))
+            batches.put(None)
+        except Exception as e:
+            batches.put(('error', e))
+
+    def _send_blocks(self, blocks):
+        try:
+            results = self._client.batch(GENERATE_BLOCK_RPC, [
+                [event['parent'], event['referees'], txs, event['nonce'], event['timestamp'], event['adaptive']]
+                for (event, txs) in blocks], raise_errors=True)
+        except BatchRpcError as e:
+            raise AssertionError("failed to replay block[{}]: {}".format(blocks[e.index][0]['hash'], e.error))
+        for ((event, _), block_hash) in zip(blocks, results):
+            assert_equal(block_hash, event['hash'])
+
+    def report(self, elapsed):
+        return "{} events ({} blocks in {} batches) in {:.1f}s, {:.1f} events/s".format(
+            self.events, self.blocks, self.batches, elapsed, self.events / max(elapsed, 1e-6))
+
+    def run(self, read_events):
+        """
+            replay the events of `read_events()`, which is called twice if there are checkpoints
+        """
+        start_index = self._find_resume_index(read_events())
+        if start_index > 0:
+            self._restore(start_index)
+        else:
+            self._framework.setup_balance(self._node_index)
+
+        batches = queue.Queue(maxsize=8)
+        preparer = threading.Thread(target=self._prepare, args=(read_events(), start_index, batches), daemon=True)
+        preparer.start()
+        running = True
+        start = time.time()
+        last_report = start
+        while True:
+            item = batches.get()
+            if item is None:
+                break
+            (kind, payload) = item
+            if kind == 'error':
+                raise payload
+            elif kind == 'blocks':
+                self._send_blocks(payload)
+                self.events += len(payload)
+                self.blocks += len(payload)
+                self.batches += 1
+            elif kind == 'event':
+                self.replay_event(payload)
+                running = payload['name'] == StartEvent().name()
+                self.events += 1
+            elif running:
+                self._checkpoint(*payload)
+            if time.time() - last_report >= self._report_interval:
+                last_report = time.time()
+                self.log.info("replay: {}".format(self.report(last_report - start)))
+        preparer.join()
+        self.log.info("replay from event {}: {}".format(start_index, self.report(time.time() - start)))
+
+    def replay_event(self, event):
+        self._client.close()
+        if event['name'] == StartEvent().name():
+            self.log.info("start")
+            StartEvent().execute(self._node)
+        else:
+            self.log.info("stop")
+            StopEvent().execute(self._node)
+
+
+class VerificationIndex(object):
+    """
+        incremental cross-peer verification of the statuses reported by the snapshots.
+
+        A status reported by a peer stays unverified until the same hash is reported
+        by all peers, or at least by all alive peers, and they agree on it. Then it
+        becomes verified with a canonical value, and later reports of the hash are
+        checked against the canonical value directly. Every check only processes the
+        hashes marked dirty in the snapshots since the last check.
+    """
+    def __init__(self, unverified_attr, verified_attr, dirty_attr, verifiable=lambda status: True):
+        self._unverified_attr = unverified_attr
+        self._verified_attr = verified_attr
+        self._dirty_attr = dirty_attr
+        # whether a status can be verified, e.g. a pending block status can not
+        self._verifiable = verifiable
+        self.canonical = {}
+        # peers which report an unverified status, of the hashes without canonical value
+        self.reporters = {}
+        self._candidates = set()
+        self._stopped_peers = None
+
+    def _unverified(self, snapshot):
+        return getattr(snapshot.consensus, self._unverified_attr)
+
+    def _verified(self, snapshot):
+        return getattr(snapshot.consensus, self._verified_attr)
+
+    def _covered(self, h, num_peers, alive_peers):
+        reporters = self.reporters[h]
+        return len(reporters) == num_peers or alive_peers.issubset(reporters)
+
+    def _move(self, snapshot, h, status):
+        self._verified(snapshot)[h] = status
+        del self._unverified(snapshot)[h]
+
+    def update(self, snapshots, stopped_peers, verify_statuses):
+        num_peers = len(snapshots)
+        alive_peers = set(i for i in range(num_peers) if i not in stopped_peers)
+
+        for (i, snapshot) in enumerate(snapshots):
+            dirty = getattr(snapshot.consensus, self._dirty_attr)
+            unverified = self._unverified(snapshot)
+            for h in dirty:
+                if h not in unverified:
+                    continue
+                if h in self.canonical:
+                    assert_equal(self.canonical[h], unverified[h])
+                    self._move(snapshot, h, self.canonical[h])
+                else:
+                    self.reporters.setdefault(h, set()).add(i)
+                    self._candidates.add(h)
+            dirty.clear()
+
+        stopped = frozenset(stopped_peers)
+        if stopped != self._stopped_peers:
+            # alive peers changed, so any hash may become verifiable
+            self._stopped_peers = stopped
+            self._candidates = set(self.reporters.keys())
+
+        for h in self._candidates:
+            if self._covered(h, num_peers, alive_peers):
+                self._verify(snapshots, h, num_peers, alive_peers, verify_statuses)
+        self._candidates = set()
+
+    def _verify(self, snapshots, h, num_peers, alive_peers, verify_statuses):
+        reporters = self.reporters[h]
+        peers = range(num_peers) if len(reporters) == num_peers else sorted(alive_peers)
+        statuses = [self._unverified(snapshots[i])[h] for i in peers]
+        verify_statuses(statuses)
+        for (i, status) in zip(peers, statuses):
+            if self._verifiable(status):
+                if h not in self.canonical:
+                    self.canonical[h] = status
+                self._move(snapshots[i], h, status)
+        if h in self.canonical:
+            # the rest of reporters only have statuses equal to any status, e.g. pending blocks
+            for i in reporters:
+                unverified = self._unverified(snapshots[i])
+                if h in unverified:
+                    assert_equal(self.canonical[h], unverified[h])
+                    self._move(snapshots[i], h, self.canonical[h])
+            del self.reporters[h]
 
 
 class BlockStatusPredicate(Predicate):
     def __init__(self):
         super().__init__()
+        self.index = VerificationIndex(
+            'block_status_unverified', 'block_status_verified', 'dirty_blocks',
+            verifiable=lambda block: block.block_status != BlockStatus.Pending)
 
     def verify_blocks(self, blocks):
         for i in range(1, len(blocks)):
             assert_equal(blocks[i], blocks[0])
 
-    def verify_snapshots(self, snapshots, hashes):
-        for h in hashes:
-            blocks = [snapshot.consensus.block_status_unverified[h] for snapshot in snapshots]
-            self.verify_blocks(blocks)
-            for (snapshot, block) in zip(snapshots, blocks):
-                if block.block_status != BlockStatus.Pending:
-                    snapshot.consensus.block_status_verified[h] = block
-                    del snapshot.consensus.block_status_unverified[h]
-
     def __call__(self, snapshots, stopped_peers):
-        verified = {}
-        for snapshot in snapshots:
-            for (k, v) in snapshot.consensus.block_status_verified.items():
-                if k in verified:
-                    assert verified[k] == v
-                else:
-                    verified[k] = v
-        verified_hashes = set(verified.keys())
-        verifiable_hashes = None
-        verifiable_hashes_with_stopped = None
-        alive_snapshots = []
-        for (i, snapshot) in enumerate(snapshots):
-            unverified_hashes = set(snapshot.consensus.block_status_unverified.keys())
-            for h in unverified_hashes.intersection(verified_hashes):
-                assert_equal(verified[h], snapshot.consensus.block_status_unverified[h])
-                snapshot.consensus.block_status_verified[h] = verified[h]
-                del snapshot.consensus.block_status_unverified[h]
-            if verifiable_hashes_with_stopped is None:
-                verifiable_hashes_with_stopped = copy.deepcopy(unverified_hashes)
-            else:
-                verifiable_hashes_with_stopped &= unverified_hashes
-            if i not in stopped_peers:
-                if verifiable_hashes is None:
-                    verifiable_hashes = copy.deepcopy(unverified_hashes)
-                else:
-                    verifiable_hashes &= unverified_hashes
-                alive_snapshots.append(snapshot)
-
-        self.verify_snapshots(snapshots, verifiable_hashes_with_stopped)
-        verifiable_hashes -= verifiable_hashes_with_stopped
-        self.verify_snapshots(alive_snapshots, verifiable_hashes)
+        self.index.update(snapshots, stopped_peers, self.verify_blocks)
 
 
 class ExecutionStatusPredicate(Predicate):
     def __init__(self):
         super().__init__()
+        self.index = VerificationIndex('exec_status_unverified', 'exec_status_verified', 'dirty_execs')
 
     def verify_blocks(self, blocks):
         for i in range(1, len(blocks)):
             assert_equal(blocks[i], blocks[0])
 
-    def verify_snapshots(self, snapshots, hashes):
-        for h in hashes:
-            blocks = [snapshot.consensus.exec_status_unverified[h] for snapshot in snapshots]
-            self.verify_blocks(blocks)
-            for (snapshot, block) in zip(snapshots, blocks):
-                snapshot.consensus.exec_status_verified[h] = block
-                del snapshot.consensus.exec_status_unverified[h]
-
     def __call__(self, snapshots, stopped_peers):
-        verified = {}
-        for snapshot in snapshots:
-            for (k, v) in snapshot.consensus.exec_status_verified.items():
-                if k in verified:
-                    assert_equal(verified[k], v)
-                else:
-                    verified[k] = v
-        verified_hashes = set(verified.keys())
-        verifiable_hashes = None
-        verifiable_hashes_with_stopped = None
-        alive_snapshots = []
-        for (i, snapshot) in enumerate(snapshots):
-            unverified_hashes = set(snapshot.consensus.exec_status_unverified.keys())
-            for h in unverified_hashes.intersection(verified_hashes):
-                assert_equal(verified[h], snapshot.consensus.exec_status_unverified[h])
-                snapshot.consensus.exec_status_verified[h] = verified[h]
-                del snapshot.consensus.exec_status_unverified[h]
-            if verifiable_hashes_with_stopped is None:
-                verifiable_hashes_with_stopped = copy.deepcopy(unverified_hashes)
-            else:
-                verifiable_hashes_with_stopped &= unverified_hashes
-            if i not in stopped_peers:
-                if verifiable_hashes is None:
-                    verifiable_hashes = copy.deepcopy(unverified_hashes)
-                else:
-                    verifiable_hashes &= unverified_hashes
-                alive_snapshots.append(snapshot)
-
-        self.verify_snapshots(snapshots, verifiable_hashes_with_stopped)
-        verifiable_hashes -= verifiable_hashes_with_stopped
-        self.verify_snapshots(alive_snapshots, verifiable_hashes)
+        self.index.update(snapshots, stopped_peers, self.verify_blocks)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     ConfluxTracing().add_options(parser)
-    return parser.parse_args()
+    # options of the test framework, e.g. --tmpdir and --portseed, are parsed by main()
+    (args, _) = parser.parse_known_args()
+    return args
 
 
 if __name__ == "__main__":
@@ -764,14 +1709,37 @@ if __name__ == "__main__":
             crash_timeout=args.crash_timeout,
             start_timeout=args.start_timeout,
             blockgen_timeout=args.blockgen_timeout,
-            snapshot_timeout=args.snapshot_timeout)
+            snapshot_timeout=args.snapshot_timeout,
+            trace_dir=args.trace_dir,
+            tx_reservoir_depth=args.tx_reservoir_depth,
+            seed=args.seed,
+            schedule_file=args.schedule,
+            virtual_time=args.virtual_time,
+            status_file=args.status_file)
         conflux_tracing.add_predicate(BlockStatusPredicate())
         conflux_tracing.add_predicate(ExecutionStatusPredicate())
         conflux_tracing.main()
+    elif args.cmd == 'recovery':
+        modes = args.modes.split(',')
+        assert set(modes).issubset(RECOVERY_MODES), "unknown modes {}".format(modes)
+        conflux_tracing = ConfluxTracing(
+            nodes=args.nodes,
+            recovery_chain_lengths=[int(n) for n in args.chain_lengths.split(',')],
+            recovery_repeats=args.repeats,
+            recovery_modes=modes,
+            recovery_output=args.output)
+        conflux_tracing.main()
     elif args.cmd == 'replay':
+        assert args.trace_dir or (args.snapshot_file and args.txs_file), \
+            "either trace_dir or both snapshot_file and txs_file are required"
         conflux_tracing = ConfluxTracing(
             nodes=2,
             replay=True,
             snapshot_file=args.snapshot_file,
-            txs_file=args.txs_file)
+            txs_file=args.txs_file,
+            trace_dir=args.trace_dir,
+            replay_peer=args.peer,
+            replay_batch_size=args.batch_size,
+            checkpoint_interval=args.checkpoint_interval,
+            checkpoint_dir=args.checkpoint_dir)
         conflux_tracing.main()
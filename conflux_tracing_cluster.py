@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import signal
+import argparse
+import subprocess
+
+"""
+Launcher of several independent conflux_tracing.py clusters on one machine.
+
+Every cluster runs in its own work dir, with its own tmpdir, port seed, fault injection
+seed and set of CPUs. The progress of all clusters is aggregated from their status files
+into one status view. When a cluster fails, its work dir is kept as the artifacts of the
+failure, and the cluster is optionally restarted with the next seed, while the others
+keep running.
+"""
+
+TRACING_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conflux_tracing.py")
+
+
+def split_cpus(cpus, clusters, cpus_per_cluster):
+    """
+    Returns disjoint sets of CPUs for the clusters, or the same set for all if there are not enough CPUs.
+    """
+    cpus = sorted(cpus)
+    if cpus_per_cluster <= 0:
+        cpus_per_cluster = max(len(cpus) // clusters, 1)
+    if cpus_per_cluster * clusters > len(cpus):
+        print("{} CPUs for {} clusters of {} CPUs each, clusters share all CPUs".format(
+            len(cpus), clusters, cpus_per_cluster))
+        return [set(cpus)] * clusters
+    return [set(cpus[k * cpus_per_cluster:(k + 1) * cpus_per_cluster]) for k in range(clusters)]
+
+
+class Cluster:
+    def __init__(self, index, cpus, args):
+        self.index = index
+        self.cpus = cpus
+        self.args = args
+        self.seed = args.seed + index
+        self.runs = 0
+        self.failures = 0
+        self.process = None
+        self.work_dir = None
+        self.start_time = None
+        self.status = {}
+        self.last_status = {}
+        self.checks_per_sec = 0.0
+
+    def start(self):
+        self.work_dir = os.path.join(self.args.work_dir, "cluster_{}".format(self.index), "seed_{}".format(self.seed))
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(os.path.join(self.work_dir, "tmp"))
+        cmd = [sys.executable, TRACING_SCRIPT,
+               "--tmpdir={}".format(os.path.join(self.work_dir, "tmp")),
+               # port seeds of the clusters differ, so that their port ranges are disjoint
+               "--portseed={}".format(self.args.portseed + self.index)] + \
+            shlex.split(self.args.framework_args) + \
+            ["run", "--seed", str(self.seed), "--status_file", os.path.join(self.work_dir, "status.json")] + \
+            shlex.split(self.args.tracing_args)
+        self.log_file = open(os.path.join(self.work_dir, "tracing.log"), "w")
+        # conflux nodes started by the script inherit the CPU affinity, and the process group of the
+        # new session, so that they are stopped with the script
+        self.process = subprocess.Popen(cmd, cwd=self.work_dir, stdout=self.log_file, stderr=subprocess.STDOUT,
+                                        start_new_session=True,
+                                        preexec_fn=lambda: os.sched_setaffinity(0, self.cpus))
+        self.start_time = time.time()
+        self.status = {}
+        self.last_status = {}
+        self.runs += 1
+        print("cluster {} started with seed {} on CPUs {} in {}".format(
+            self.index, self.seed, sorted(self.cpus), self.work_dir))
+
+    def poll(self):
+        """
+        Returns the exit code of the cluster if it exited, and refreshes its status otherwise.
+        """
+        exit_code = self.process.poll()
+        status_file = os.path.join(self.work_dir, "status.json")
+        if os.path.exists(status_file):
+            try:
+                with open(status_file, "r") as fp:
+                    status = json.load(fp)
+            except ValueError:
+                status = self.status
+            if status.get("elapsed", 0) > self.status.get("elapsed", 0):
+                (self.last_status, self.status) = (self.status, status)
+                checks = self.applied("snapshot") - self.last_status.get("applied", {}).get("snapshot", 0)
+                elapsed = status["elapsed"] - self.last_status.get("elapsed", 0)
+                self.checks_per_sec = checks / max(elapsed, 1e-6)
+        return exit_code
+
+    def applied(self, action):
+        return self.status.get("applied", {}).get(action, 0)
+
+    def save_failure(self, exit_code):
+        """
+        Keeps the work dir with the snapshots, txs, schedule, tracing log and node logs of the failed run.
+        """
+        self.log_file.close()
+        self.failures += 1
+        failed_dir = os.path.join(self.args.work_dir, "failed", "cluster_{}_seed_{}".format(self.index, self.seed))
+        shutil.rmtree(failed_dir, ignore_errors=True)
+        shutil.move(self.work_dir, failed_dir)
+        with open(os.path.join(failed_dir, "exit_code"), "w") as fp:
+            fp.write(str(exit_code))
+        print("cluster {} with seed {} failed with exit code {}, artifacts saved to {}".format(
+            self.index, self.seed, exit_code, failed_dir))
+
+    def _signal_group(self, sig):
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def stop(self):
+        """
+        Stops the script and the conflux nodes in its process group, including the nodes left
+        running by a script which exited or was killed without shutting them down.
+        """
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self._signal_group(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                pass
+        self._signal_group(signal.SIGKILL)
+        self.process.wait()
+
+
+def print_status(clusters, start_time):
+    print("{:>7} {:>10} {:>8} {:>8} {:>9} {:>8} {:>10} {:>9} {:>9}".format(
+        "cluster", "seed", "state", "uptime", "blocks", "crashes", "db_crashes", "checks/s", "overruns"))
+    totals = [0, 0, 0, 0.0, 0]
+    for cluster in clusters:
+        state = "running" if cluster.process is not None and cluster.process.returncode is None else "exited"
+        row = [cluster.applied("blockgen"), cluster.applied("crash"), cluster.applied("db_crash"),
+               cluster.checks_per_sec, sum(cluster.status.get("overruns", {}).values())]
+        totals = [t + v for (t, v) in zip(totals, row)]
+        print("{:>7} {:>10} {:>8} {:>7.0f}s {:>9} {:>8} {:>10} {:>9.2f} {:>9}".format(
+            cluster.index, cluster.seed, state, time.time() - cluster.start_time, *row))
+    print("{:>7} {:>10} {:>8} {:>7.0f}s {:>9} {:>8} {:>10} {:>9.2f} {:>9}, failures {}".format(
+        "total", "", "", time.time() - start_time, *totals, sum(c.failures for c in clusters)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several conflux_tracing.py clusters on one machine")
+    parser.add_argument("-k", "--clusters", type=int, default=2, help="number of clusters to run")
+    parser.add_argument("--cpus-per-cluster", type=int, default=0,
+                        help="CPUs pinned to every cluster, 0 to split all CPUs evenly")
+    parser.add_argument("--work-dir", default="tracing_clusters", help="work dirs of the clusters and failures")
+    parser.add_argument("--seed", type=int, default=int(time.time()), help="seed of the first cluster")
+    parser.add_argument("--portseed", type=int, default=os.getpid() % 1000, help="port seed of the first cluster")
+    parser.add_argument("--status-interval", type=float, default=30, help="interval to print the status view")
+    parser.add_argument("--restart", action="store_true",
+                        help="restart a failed cluster with the next seed instead of leaving it stopped")
+    parser.add_argument("--framework-args", default="", help="options of the test framework, e.g. --conflux")
+    parser.add_argument("--tracing-args", default="", help="options of conflux_tracing.py run, e.g. -n 11")
+    args = parser.parse_args()
+
+    cpu_sets = split_cpus(os.sched_getaffinity(0), args.clusters, args.cpus_per_cluster)
+    clusters = [Cluster(k, cpu_sets[k], args) for k in range(args.clusters)]
+    start_time = time.time()
+    for cluster in clusters:
+        cluster.start()
+
+    try:
+        last_print = time.time()
+        while any(c.process.returncode is None for c in clusters):
+            time.sleep(1)
+            for cluster in clusters:
+                if cluster.process.returncode is not None:
+                    continue
+                exit_code = cluster.poll()
+                if exit_code is None:
+                    continue
+                # release the ports and CPUs held by the nodes of the cluster, before a restart
+                cluster.stop()
+                if exit_code == 0:
+                    cluster.log_file.close()
+                    print("cluster {} with seed {} finished".format(cluster.index, cluster.seed))
+                    continue
+                cluster.save_failure(exit_code)
+                if args.restart:
+                    # seeds of restarted clusters never collide with the other clusters
+                    cluster.seed += args.clusters
+                    cluster.start()
+            if time.time() - last_print >= args.status_interval:
+                last_print = time.time()
+                print_status(clusters, start_time)
+    finally:
+        for cluster in clusters:
+            if cluster.process.returncode is None:
+                cluster.stop()
+        print_status(clusters, start_time)
+
+
+if __name__ == "__main__":
+    main()
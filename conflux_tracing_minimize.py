@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+import sys, os
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+import re
+import json
+import queue
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from conflux_tracing import *
+
+"""
+Delta debugging of a failing tracing snapshot down to the smallest trace that
+still reproduces its assertion.
+
+A candidate trace is replayed on a target node, with its start and stop events,
+and its blocks are replayed on a reference node without restarts. The candidate
+fails if comparing the consensus state of both nodes raises the same assertion
+as the whole trace. Candidates run in parallel on pairs of isolated local nodes.
+"""
+
+NEW_BLOCK_EVENT = 'new_block'
+
+
+def assertion_signature(message):
+    """
+        assertion message without the hashes and numbers that differ between runs
+    """
+    return re.sub(r'0x[0-9a-fA-F]+|\d+', '#', message)
+
+
+def event_units(events):
+    """
+        group the event indices into the units to minimize: a block, or a stop with its following start
+    """
+    units = []
+    stop_unit = None
+    for (i, event) in enumerate(events):
+        if event['name'] == StopEvent().name():
+            stop_unit = [i]
+            units.append(stop_unit)
+        elif event['name'] == StartEvent().name():
+            assert stop_unit is not None, "event[{}] starts a running node".format(i)
+            stop_unit.append(i)
+            stop_unit = None
+        else:
+            units.append([i])
+    return units
+
+
+def block_closure(events, units):
+    """
+        add the units of the parent and referees of the kept blocks, which are in the trace
+    """
+    block_index = {e['hash']: i for (i, e) in enumerate(events) if e['name'] == NEW_BLOCK_EVENT}
+    keep = set(i for unit in units for i in unit)
+    stack = list(keep)
+    while len(stack) > 0:
+        event = events[stack.pop()]
+        if event['name'] != NEW_BLOCK_EVENT:
+            continue
+        for h in [event['parent']] + event['referees']:
+            j = block_index.get(h)
+            if j is not None and j not in keep:
+                keep.add(j)
+                stack.append(j)
+    return keep
+
+
+def ddmin(units, test, log):
+    """
+        minimize `units` with `test(candidates)`, which returns for every candidate list of units
+        either the closed candidate if it still fails, or None.
+
+        All subsets and complements of a round are tested at once, so that they run in parallel.
+    """
+    n = 2
+    while len(units) >= 2:
+        n = min(n, len(units))
+        chunk_size = (len(units) + n - 1) // n
+        chunks = [units[k:k + chunk_size] for k in range(0, len(units), chunk_size)]
+        complements = [units[:k] + units[k + chunk_size:] for k in range(0, len(units), chunk_size)] \
+            if len(chunks) > 2 else []
+        outcomes = test(chunks + complements)
+        # the closure of a candidate may add back all units, which is no progress
+        failed_chunks = [c for c in outcomes[:len(chunks)] if c is not None and len(c) < len(units)]
+        failed_complements = [c for c in outcomes[len(chunks):] if c is not None and len(c) < len(units)]
+        if len(failed_chunks) > 0:
+            units = min(failed_chunks, key=len)
+            n = 2
+        elif len(failed_complements) > 0:
+            units = min(failed_complements, key=len)
+            n = max(n - 1, 2)
+        elif n < len(units):
+            n = min(2 * n, len(units))
+        else:
+            break
+        log.info("ddmin: {} units at granularity {}".format(len(units), n))
+    return units
+
+
+class ConfluxTracingMinimizer(ConfluxTracing):
+    def __init__(self, workers=2, expect=None, output_dir='.', **kwargs):
+        super().__init__(nodes=2 * workers, replay=True, **kwargs)
+        self._workers = workers
+        self._expect = expect
+        self._output_dir = output_dir
+        self._cache = {}
+        self._cache_file = os.path.join(output_dir, 'minimize_cache.json')
+        self._free_workers = queue.Queue()
+        self.replays = 0
+
+    def set_test_params(self):
+        super().set_test_params()
+        # the nodes of a worker are not connected to any peer
+        self.conf_parameters["dev_allow_phase_change_without_peer"] = "true"
+
+    def setup_network(self):
+        self.setup_nodes()
+
+    def _reset_worker(self, worker):
+        for i in [2 * worker, 2 * worker + 1]:
+            self.stop_node(i, clean=True)
+            self.start_node(i, extra_args=None if self.options.archive else ["--full"])
+            assert_equal(self.nodes[i].best_block_hash(), self._genesis)
+            self.setup_balance(i)
+
+    def _collect_state(self, node, peer_id, timeout=60):
+        """
+            poll the consensus state of a node until it is idle for 3 polls
+        """
+        snapshot = ConsensusSnapshot(peer_id)
+        deadline = time.time() + timeout
+        idle = 0
+        while idle < 3 and time.time() < deadline:
+            delta = node.consensus_graph_state()
+            for block_status in delta['blockStateVec']:
+                snapshot.add_block(ConsensusBlockStatus(block_status))
+            for exec_status in delta['blockExecutionStateVec']:
+                snapshot.add_exec(ConsensusExecutionStatus(exec_status))
+            empty = len(delta['blockStateVec']) == 0 and len(delta['blockExecutionStateVec']) == 0
+            idle = idle + 1 if empty else 0
+            time.sleep(0.5)
+        return snapshot
+
+    def _run_candidate(self, worker, indices):
+        """
+            return the assertion message of the candidate, or None if it passes
+        """
+        self._reset_worker(worker)
+        (target, reference) = (self.nodes[2 * worker], self.nodes[2 * worker + 1])
+        stopped = False
+        for i in indices:
+            event = self._events[i]
+            self.replay_event(target, event, self._get_txs)
+            if event['name'] == NEW_BLOCK_EVENT:
+                self.replay_event(reference, event, self._get_txs)
+            else:
+                stopped = event['name'] == StopEvent().name()
+        # compare with the target running
+        if stopped:
+            StartEvent().execute(target)
+
+        try:
+            expected = self._collect_state(reference, 2 * worker + 1)
+            actual = self._collect_state(target, 2 * worker)
+            check = ConsensusSnapshot(2 * worker)
+            check.block_status_verified = dict(expected.block_status_unverified)
+            check.exec_status_verified = dict(expected.exec_status_unverified)
+            for block in actual.block_status_unverified.values():
+                check.add_block(block)
+            for exec in actual.exec_status_unverified.values():
+                check.add_exec(exec)
+        except AssertionError as e:
+            return str(e)
+        return None
+
+    def _fails(self, message):
+        if message is None:
+            return False
+        if self._expect is not None:
+            return self._expect in message
+        return assertion_signature(message) == self._signature
+
+    def _outcome(self, indices):
+        """
+            return the assertion message of the candidate, or None if it passes or cannot be replayed
+        """
+        key = hashlib.sha1(",".join(map(str, indices)).encode()).hexdigest()
+        if key in self._cache:
+            return self._cache[key]['message']
+        worker = self._free_workers.get()
+        try:
+            self.replays += 1
+            message = self._run_candidate(worker, indices)
+        except Exception as e:
+            # a candidate that cannot be replayed does not reproduce the assertion, but may be
+            # replayed again later since the failure can be transient, e.g. a timeout of node start
+            self.log.info("candidate of {} events unresolved: {}".format(len(indices), repr(e)))
+            return None
+        finally:
+            self._free_workers.put(worker)
+        self._cache[key] = {'message': message}
+        return message
+
+    def _evaluate(self, indices):
+        return self._fails(self._outcome(indices))
+
+    def _test(self, candidates):
+        closed = []
+        for units in candidates:
+            keep = block_closure(self._events, units)
+            closed.append([u for u in self._units if u[0] in keep])
+        with ThreadPoolExecutor(self._workers) as executor:
+            outcomes = list(executor.map(
+                lambda units: self._evaluate(sorted(i for u in units for i in u)), closed))
+        with open(self._cache_file, 'w') as fp:
+            json.dump({'trace': self._trace_digest, 'outcomes': self._cache}, fp)
+        self.log.info("tested {} candidates, {} replays, {} cached outcomes".format(
+            len(candidates), self.replays, len(self._cache)))
+        return [units if failing else None for (units, failing) in zip(closed, outcomes)]
+
+    def _load_trace(self):
+        if self._trace_dir:
+            with open(os.path.join(self._trace_dir, 'genesis.json'), 'r') as fp:
+                genesis_hash = json.load(fp)['genesis']
+            txs_index = TraceLog.index(self._trace_dir, 'txs', 'hash')
+            events = list(TraceLog.read(self._trace_dir, 'peer_{}'.format(self._replay_peer)))
+            return (genesis_hash, events, lambda h: TraceLog.read_at(txs_index[h])['txs'])
+        snapshot = json.load(open(self._snapshot_file, 'r'))
+        return (snapshot['genesis'], snapshot['events'], lambda h: self._block_txs[h])
+
+    def run_test(self):
+        (genesis_hash, self._events, self._get_txs) = self._load_trace()
+        self._genesis = self.nodes[0].best_block_hash()
+        assert genesis_hash == self._genesis
+        self._units = event_units(self._events)
+        # outcomes are keyed by event indices, so they are only reused for the same trace
+        self._trace_digest = hashlib.sha1(json.dumps(self._events, sort_keys=True).encode()).hexdigest()
+        if os.path.exists(self._cache_file):
+            with open(self._cache_file, 'r') as fp:
+                cache = json.load(fp)
+            if cache.get('trace') == self._trace_digest:
+                self._cache = cache['outcomes']
+            else:
+                self.log.info("ignore the cached outcomes of another trace in {}".format(self._cache_file))
+        for worker in range(self._workers):
+            self._free_workers.put(worker)
+
+        all_indices = list(range(len(self._events)))
+        self._signature = None
+        message = self._outcome(all_indices)
+        assert message is not None, "the whole trace of {} events does not fail".format(len(self._events))
+        self.log.info("the whole trace fails with: {}".format(message))
+        self._signature = assertion_signature(message)
+        assert self._fails(message), "the whole trace does not fail with [{}]".format(self._expect)
+
+        units = ddmin(self._units, self._test, self.log)
+        indices = sorted(i for u in units for i in u)
+        events = [self._events[i] for i in indices]
+        with open(os.path.join(self._output_dir, 'minimized_snapshot.json'), 'w') as fp:
+            json.dump({'genesis': genesis_hash, 'events': events}, fp)
+        with open(os.path.join(self._output_dir, 'minimized_txs.json'), 'w') as fp:
+            json.dump({e['hash']: self._get_txs(e['hash']) for e in events if e['name'] == NEW_BLOCK_EVENT}, fp)
+        self.log.info("minimized {} events to {} events with {} replays, saved to {}".format(
+            len(self._events), len(events), self.replays, self._output_dir))
+
+    def add_options(self, parser):
+        parser.add_argument(
+            '-archive',
+            '--archive',
+            dest='archive',
+            type=int,
+            default=1,
+            help='archive node mode or full node mode')
+        parser.add_argument(
+            '-snapshot_file',
+            '--snapshot_file',
+            dest='snapshot_file',
+            help="path of snapshot")
+        parser.add_argument(
+            '-txs_file',
+            '--txs_file',
+            dest='txs_file',
+            help="path of txs file")
+        parser.add_argument(
+            '-trace_dir',
+            '--trace_dir',
+            dest='trace_dir',
+            help="directory of trace logs, instead of snapshot and txs file")
+        parser.add_argument(
+            '-peer',
+            '--peer',
+            dest='peer',
+            type=int,
+            default=0,
+            help="peer to minimize the trace of")
+        parser.add_argument(
+            '-workers',
+            '--workers',
+            dest='workers',
+            type=int,
+            default=2,
+            help="number of candidates replayed in parallel, on 2 nodes each")
+        parser.add_argument(
+            '-expect',
+            '--expect',
+            dest='expect',
+            default=None,
+            help="substring of the assertion to reproduce, by default the assertion of the whole trace")
+        parser.add_argument(
+            '-output_dir',
+            '--output_dir',
+            dest='output_dir',
+            default='.',
+            help="directory of the minimized snapshot and txs file, and the cache of outcomes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    ConfluxTracingMinimizer().add_options(parser)
+    args, _ = parser.parse_known_args()
+    assert args.trace_dir or (args.snapshot_file and args.txs_file), \
+        "either trace_dir or both snapshot_file and txs_file are required"
+    ConfluxTracingMinimizer(
+        workers=args.workers,
+        expect=args.expect,
+        output_dir=args.output_dir,
+        snapshot_file=args.snapshot_file,
+        txs_file=args.txs_file,
+        trace_dir=args.trace_dir,
+        replay_peer=args.peer).main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+import asyncio
+import collections
+import json
+import random
+import socket
+import threading
+import time
+
+"""
+User space WAN emulation for nodes running on one box.
+
+Every ordered pair of nodes (a, b) gets a TCP relay port. When node a dials
+node b at the relay port instead of its p2p port, the bytes from a to b are
+shaped by the link (a, b) of the matrix and the bytes from b to a by the link
+(b, a): a propagation latency with jitter, a bandwidth cap, and packet loss,
+which TCP turns into a retransmission delay since the stream cannot lose bytes.
+
+Only connections dialed through relay_addr() are shaped, so the nodes should not
+also discover and dial each other directly.
+"""
+
+LINK_FIELDS = ["latency_ms", "jitter_ms", "bandwidth_mbps", "loss"]
+
+# Bytes in flight on a link before reading from the sender is paused
+HIGH_WATER = 4 << 20
+LOW_WATER = 1 << 20
+CHUNK_SIZE = 256 << 10
+
+class LinkSpec:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, bandwidth_mbps=0.0, loss=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # 0 for unlimited bandwidth
+        self.bandwidth_mbps = bandwidth_mbps
+        self.loss = loss
+
+    def __repr__(self):
+        return "LinkSpec({})".format(", ".join("{}={}".format(f, getattr(self, f)) for f in LINK_FIELDS))
+
+class LinkMatrix:
+    """
+    Link specs loaded from json, e.g.
+
+        {
+            "default": {"latency_ms": 100, "jitter_ms": 10, "bandwidth_mbps": 20, "loss": 0.001},
+            "latency_ms": [[0, 50], [80, 0]],
+            "links": {"0-1": {"bandwidth_mbps": 5}}
+        }
+
+    The spec of link (a, b) is `default`, overridden by entry [a][b] of the per-field
+    matrices, and then by `links["a-b"]`.
+    """
+    def __init__(self, data:dict):
+        self.data = data
+
+    @staticmethod
+    def load(path:str):
+        with open(path, "r") as fp:
+            return LinkMatrix(json.load(fp))
+
+    def get(self, a:int, b:int):
+        fields = dict(self.data.get("default", {}))
+        for f in LINK_FIELDS:
+            matrix = self.data.get(f)
+            if isinstance(matrix, list) and a < len(matrix) and b < len(matrix[a]):
+                fields[f] = matrix[a][b]
+        fields.update(self.data.get("links", {}).get("{}-{}".format(a, b), {}))
+        return LinkSpec(**fields)
+
+class _Pipe:
+    """
+    Shapes the bytes from one endpoint to the other. Received chunks are queued with
+    their delivery time and written in order, and the sender is paused while too many
+    bytes are in flight or the receiver cannot keep up.
+    """
+    def __init__(self, loop, spec:LinkSpec, rng:random.Random):
+        self.loop = loop
+        self.spec = spec
+        self.rng = rng
+        self.src = None
+        self.dst = None
+        self.queue = collections.deque()
+        self.timer = None
+        self.link_free_at = 0.0
+        self.last_delivery = 0.0
+        self.in_flight = 0
+        self.reading_paused = False
+        self.dst_paused = False
+        self.eof = False
+        self.bytes = 0
+
+    def send(self, data:memoryview):
+        spec = self.spec
+        now = self.loop.time()
+        # Serialization on the link, then propagation
+        start = max(now, self.link_free_at)
+        if spec.bandwidth_mbps > 0:
+            self.link_free_at = start + len(data) * 8 / (spec.bandwidth_mbps * 1e6)
+        else:
+            self.link_free_at = start
+        delay = spec.latency_ms / 1000
+        if spec.jitter_ms > 0:
+            delay += self.rng.uniform(-spec.jitter_ms, spec.jitter_ms) / 1000
+        if spec.loss > 0 and self.rng.random() < spec.loss:
+            # A lost segment is retransmitted after about one RTT plus the minimum RTO
+            delay += 2 * spec.latency_ms / 1000 + 0.2
+        # The stream is delivered in order, so jitter never reorders bytes
+        delivery = max(self.link_free_at + max(delay, 0), self.last_delivery)
+        self.last_delivery = delivery
+
+        self.queue.append((delivery, data))
+        self.in_flight += len(data)
+        if self.timer is None:
+            self.timer = self.loop.call_at(delivery, self._deliver)
+        self._update_reading()
+
+    def close_after_drain(self):
+        self.eof = True
+        if len(self.queue) == 0:
+            self._close_dst()
+
+    def _close_dst(self):
+        if self.dst is not None and not self.dst.is_closing():
+            if self.dst.can_write_eof():
+                self.dst.write_eof()
+            else:
+                self.dst.close()
+
+    def connect_dst(self, transport):
+        self.dst = transport
+        if self.timer is None and len(self.queue) > 0:
+            self.timer = self.loop.call_soon(self._deliver)
+
+    def _deliver(self):
+        self.timer = None
+        if self.dst is None:
+            # Delivered once the connection to the receiver is made
+            return
+        now = self.loop.time()
+        while len(self.queue) > 0 and self.queue[0][0] <= now:
+            (_, data) = self.queue.popleft()
+            self.in_flight -= len(data)
+            self.bytes += len(data)
+            if not self.dst.is_closing():
+                self.dst.write(data)
+        if len(self.queue) > 0:
+            self.timer = self.loop.call_at(self.queue[0][0], self._deliver)
+        elif self.eof:
+            self._close_dst()
+        self._update_reading()
+
+    def set_dst_paused(self, paused:bool):
+        self.dst_paused = paused
+        self._update_reading()
+
+    def _update_reading(self):
+        if self.src is None or self.src.is_closing():
+            return
+        if not self.reading_paused and (self.in_flight > HIGH_WATER or self.dst_paused):
+            self.src.pause_reading()
+            self.reading_paused = True
+        elif self.reading_paused and self.in_flight < LOW_WATER and not self.dst_paused:
+            self.src.resume_reading()
+            self.reading_paused = False
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.queue.clear()
+
+class _Endpoint(asyncio.BufferedProtocol):
+    """
+    One side of a relayed connection. Data is received straight into a chunk buffer
+    and handed to the pipe as a memoryview, so the relay never copies the payload.
+    """
+    def __init__(self, outgoing:_Pipe, incoming:_Pipe, on_lost=None):
+        self.outgoing = outgoing
+        self.incoming = incoming
+        self.on_lost = on_lost
+        self.transport = None
+        self.buf = None
+        self.pos = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.outgoing.src = transport
+        self.incoming.connect_dst(transport)
+
+    def get_buffer(self, sizehint):
+        if self.buf is None or len(self.buf) - self.pos < 4096:
+            # Chunks still queued in the pipe keep the old buffer alive
+            self.buf = bytearray(CHUNK_SIZE)
+            self.pos = 0
+        return memoryview(self.buf)[self.pos:]
+
+    def buffer_updated(self, nbytes):
+        data = memoryview(self.buf)[self.pos:self.pos + nbytes]
+        self.pos += nbytes
+        self.outgoing.send(data)
+
+    def eof_received(self):
+        self.outgoing.close_after_drain()
+        # Keep the transport open to deliver the other direction
+        return True
+
+    def pause_writing(self):
+        self.incoming.set_dst_paused(True)
+
+    def resume_writing(self):
+        self.incoming.set_dst_paused(False)
+
+    def connection_lost(self, exc):
+        self.outgoing.cancel()
+        if self.on_lost is not None:
+            self.on_lost()
+
+def reachable_host(remote_ip:str):
+    """
+    Returns the local address of this host on the route to `remote_ip`, which the remote host can dial.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        # no packet is sent to connect a UDP socket
+        sock.connect((remote_ip, 9))
+        return sock.getsockname()[0]
+
+class LinkEmulator:
+    """
+    Relays with per-link shaping between nodes, served by an event loop in a background thread.
+    `targets` maps the node index to the (host, port) it listens on.
+    """
+    def __init__(self, matrix:LinkMatrix, targets:dict, host:str="127.0.0.1", seed:int=0):
+        self.matrix = matrix
+        self.targets = targets
+        self.host = host
+        self.rng = random.Random(seed)
+        self.servers = {}
+        self.pipes = []
+        self._lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        async def close_all():
+            for server in self.servers.values():
+                server.close()
+                await server.wait_closed()
+        if self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(close_all(), self.loop).result(10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(10)
+
+    def relay_addr(self, a:int, b:int):
+        """
+        Returns the "host:port" for node a to dial node b through the link (a, b).
+        """
+        with self._lock:
+            server = self.servers.get((a, b))
+            if server is None:
+                server = asyncio.run_coroutine_threadsafe(self._serve(a, b), self.loop).result(10)
+                self.servers[(a, b)] = server
+        return "{}:{}".format(self.host, server.sockets[0].getsockname()[1])
+
+    async def _serve(self, a:int, b:int):
+        return await self.loop.create_server(lambda: self._accept(a, b), self.host, 0)
+
+    def _accept(self, a:int, b:int):
+        forward = _Pipe(self.loop, self.matrix.get(a, b), self.rng)
+        backward = _Pipe(self.loop, self.matrix.get(b, a), self.rng)
+        self.pipes.append((a, b, forward, backward))
+        downstream = _Endpoint(forward, backward)
+
+        async def connect_upstream():
+            (host, port) = self.targets[b]
+            try:
+                await self.loop.create_connection(lambda: _Endpoint(backward, forward, upstream_lost), host, port)
+            except OSError:
+                if downstream.transport is not None:
+                    downstream.transport.close()
+
+        def upstream_lost():
+            if downstream.transport is not None and not downstream.transport.is_closing():
+                forward.cancel()
+                downstream.transport.close()
+
+        # Bytes from the dialer are queued in `forward` until the upstream connection is made
+        self.loop.create_task(connect_upstream())
+        return downstream
+
+    def traffic(self):
+        """
+        Returns {(a, b): bytes delivered from a to b}.
+        """
+        result = collections.Counter()
+        for (a, b, forward, backward) in self.pipes:
+            result[(a, b)] += forward.bytes
+            result[(b, a)] += backward.bytes
+        return dict(result)
+
+def connect_nodes_with_link(nodes, a:int, b:int, emulator:LinkEmulator, timeout=60):
+    """
+    Like connect_nodes of the test framework, but node a dials node b through the emulated link.
+    """
+    from test_framework.util import wait_until
+    peers = len(nodes[a].getpeerinfo())
+    nodes[a].addnode(nodes[b].key, emulator.relay_addr(a, b))
+    wait_until(lambda: len(nodes[a].getpeerinfo()) > peers, timeout=timeout)
+
+def connect_sample_nodes_with_links(nodes, log, emulator:LinkEmulator, sample=3, timeout=60):
+    """
+    Like connect_sample_nodes of the test framework, but every connection goes through the emulated link.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    num_nodes = len(nodes)
+    sample = min(num_nodes - 1, sample)
+    peers = [set() for _ in range(num_nodes)]
+    for i in range(num_nodes):
+        for j in random.sample([j for j in range(num_nodes) if j != i], sample):
+            if j not in peers[i] and i not in peers[j]:
+                peers[i].add(j)
+
+    def connect(i):
+        for j in peers[i]:
+            nodes[i].addnode(nodes[j].key, emulator.relay_addr(i, j))
+        return i
+
+    log.info("connecting {} nodes through emulated links ...".format(num_nodes))
+    with ThreadPoolExecutor(min(num_nodes, 32)) as executor:
+        list(executor.map(connect, range(num_nodes)))
+
+    from test_framework.util import wait_until
+    for i in range(num_nodes):
+        wait_until(lambda: len(nodes[i].getpeerinfo()) >= len(peers[i]), timeout=timeout)
+
+def bench(seconds:float=3, spec:LinkSpec=None):
+    """
+    Measures the throughput of one relayed connection on this box.
+    """
+    async def run():
+        loop = asyncio.get_running_loop()
+        received = [0]
+        done = loop.create_future()
+
+        async def sink(reader, writer):
+            while True:
+                data = await reader.read(1 << 20)
+                if not data:
+                    break
+                received[0] += len(data)
+            writer.close()
+            done.set_result(None)
+
+        server = await asyncio.start_server(sink, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        emulator = LinkEmulator(LinkMatrix({"default": (spec or LinkSpec()).__dict__}), {1: ("127.0.0.1", port)})
+        emulator.start()
+        (host, relay_port) = emulator.relay_addr(0, 1).split(":")
+        (_, writer) = await asyncio.open_connection(host, int(relay_port))
+        payload = b"\0" * (1 << 20)
+        start = time.time()
+        sent = 0
+        while time.time() - start < seconds:
+            writer.write(payload)
+            sent += len(payload)
+            await writer.drain()
+        writer.write_eof()
+        await done
+        elapsed = time.time() - start
+        writer.close()
+        server.close()
+        emulator.stop()
+        return (sent, received[0], elapsed)
+
+    (sent, received, elapsed) = asyncio.run(run())
+    assert sent == received, "sent {} bytes but received {}".format(sent, received)
+    print("relayed {} MB in {:.2f}s: {:.0f} Mbit/s".format(received >> 20, elapsed, received * 8 / elapsed / 1e6))
+
+if __name__ == "__main__":
+    bench()
@@ -3,11 +3,13 @@ import sys, os
 sys.path.insert(1, os.path.dirname(sys.path[0]))
 
 from argparse import ArgumentParser, SUPPRESS
-from collections import Counter
+from collections import Counter, OrderedDict
+from itertools import islice
 import eth_utils
+import queue
 import rlp
 import tarfile
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import conflux.config
 from conflux.rpc import RpcClient
@@ -16,6 +18,11 @@ from test_framework.test_framework import ConfluxTestFramework, OptionHelper
 from test_framework.util import *
 import time
 from scripts.stat_latency_map_reduce import Statistics
+from scripts.risk_trajectory import RiskTrajectoryWriter, normalize_risk
+from scripts.pivot_chain import fetch_pivot_chain, save_pivot_chain, load_pivot_chain, PIVOT_CHAIN_FILE
+from rpc_batch import BatchRpcClient
+from remote_transport import get_transport, read_hosts, tree_distribute
+from link_emulator import LinkEmulator, LinkMatrix, connect_sample_nodes_with_links, reachable_host
 import platform
 
 CONFIRMATION_THRESHOLD = 0.1**6 * 2**256
@@ -35,13 +42,24 @@ def execute(cmd, retry, cmd_description):
         retry -= 1
         time.sleep(1)
 
+# Transport of pssh and pscp, see remote_transport.py
+transport = get_transport("pssh")
+
+def set_transport(spec:str):
+    global transport
+    transport.close()
+    transport = get_transport(spec)
+
 def pssh(ips_file:str, remote_cmd:str, retry=3, cmd_description=""):
-    cmd = f'parallel-ssh -O "StrictHostKeyChecking no" -h {ips_file} -p 400 "{remote_cmd}" > /dev/null 2>&1'
-    execute(cmd, retry, cmd_description)
+    """
+    Runs the command on all hosts, and retries on the failed hosts only. Returns {host: HostResult}.
+    """
+    return transport.with_retry(read_hosts(ips_file), lambda hosts: transport.run(hosts, remote_cmd),
+                                retry, cmd_description)
 
 def pscp(ips_file:str, local:str, remote:str, retry=3, cmd_description=""):
-    cmd = f'parallel-scp -O "StrictHostKeyChecking no" -h {ips_file} -p 400 {local} {remote} > /dev/null 2>&1'
-    execute(cmd, retry, cmd_description)
+    return transport.with_retry(read_hosts(ips_file), lambda hosts: transport.copy(hosts, local, remote),
+                                retry, cmd_description)
 
 def kill_remote_conflux(ips_file:str):
     pssh(ips_file, "killall conflux || echo already killed", 3, "kill remote conflux")
@@ -70,6 +88,32 @@ class RemoteSimulate(ConfluxTestFramework):
         tps = 1000,
         txs_per_block = 1,
         generate_tx_data_len = 0,
+        # Record the confirmation risk trajectory of every block into this file if not empty
+        risk_trajectory_file = "",
+        # Max number of block generation jobs in flight or queued on a node
+        max_node_queue_depth = 1,
+        # Number of pre-encoded fake tx payloads to cycle through, 0 for a unique payload per block
+        fake_tx_payload_pool = 0,
+        # Seed of the block generation schedule
+        generation_seed = 0,
+        # Cache of the pivot chain fetched after the run, reused by stat_confirmation.py
+        pivot_chain_file = PIVOT_CHAIN_FILE,
+        # Number of nodes besides node 0 polled by the monitor per tick
+        monitor_sample_size = 8,
+        # A node is stalled if its block count does not grow for this long while behind
+        node_stall_timeout_sec = 30,
+        # Abort the run if this fraction of nodes are stalled or crashed, 0 to never abort
+        abort_unhealthy_fraction = 0.0,
+        # pssh, ssh (multiplexed connections) or local[:<root>] (a local directory per host)
+        transport = "pssh",
+        # Copy files to remote nodes along a k-ary tree with this fanout, 0 to copy from this host to every node
+        distribution_fanout = 0,
+        # Json link matrix to connect the nodes through emulated WAN links on this host, see link_emulator.py.
+        # All traffic between nodes is relayed by this host, and peer discovery is disabled.
+        link_matrix = "",
+        # Address of this host which the nodes dial to reach the emulated links, by default the address
+        # of this host on the route to the first node
+        link_emulator_host = "",
     )
 
     PASS_TO_CONFLUX_OPTIONS = dict(
@@ -132,17 +176,27 @@ class RemoteSimulate(ConfluxTestFramework):
         # FIXME: Double check if disabling this improves performance.
         self.conf_parameters["enable_optimistic_execution"] = "false"
 
+        if self.options.link_matrix:
+            # Nodes must not learn the real addresses of each other and bypass the emulated links
+            self.conf_parameters["enable_discovery"] = "false"
+
     def stop_nodes(self):
         kill_remote_conflux(self.options.ips_file)
 
     def setup_remote_conflux(self):
+        set_transport(self.options.transport)
+
         # tar the config file for all nodes
         zipped_conf_file = os.path.join(self.options.tmpdir, "conflux_conf.tgz")
         with tarfile.open(zipped_conf_file, "w:gz") as tar_file:
             tar_file.add(self.options.tmpdir, arcname=os.path.basename(self.options.tmpdir))
 
         self.log.info("copy conflux configuration files to remote nodes ...")
-        pscp(self.options.ips_file, zipped_conf_file, "~", 3, "copy conflux configuration files to remote nodes")
+        if self.options.distribution_fanout > 0:
+            tree_distribute(transport, read_hosts(self.options.ips_file), zipped_conf_file, "~",
+                            self.options.distribution_fanout, 3, "copy conflux configuration files to remote nodes")
+        else:
+            pscp(self.options.ips_file, zipped_conf_file, "~", 3, "copy conflux configuration files to remote nodes")
         os.remove(zipped_conf_file)
 
         # setup on remote nodes and start conflux
@@ -170,7 +224,17 @@ class RemoteSimulate(ConfluxTestFramework):
         self.start_nodes()
         self.log.info("All nodes started, waiting to be connected")
 
-        connect_sample_nodes(self.nodes, self.log, sample=self.options.connect_peers, timeout=120)
+        if self.options.link_matrix:
+            targets = dict((i, (node.ip, node.port)) for (i, node) in enumerate(self.nodes))
+            host = self.options.link_emulator_host or reachable_host(self.nodes[0].ip)
+            assert not host.startswith("127.") or all(node.ip.startswith("127.") for node in self.nodes), \
+                "link emulator on {} is not reachable from remote nodes, set --link-emulator-host".format(host)
+            self.log.info("Relaying the links between nodes on {}".format(host))
+            self.link_emulator = LinkEmulator(LinkMatrix.load(self.options.link_matrix), targets, host).start()
+            connect_sample_nodes_with_links(self.nodes, self.log, self.link_emulator,
+                                            sample=self.options.connect_peers, timeout=120)
+        else:
+            connect_sample_nodes(self.nodes, self.log, sample=self.options.connect_peers, timeout=120)
 
         self.wait_until_nodes_synced()
 
@@ -187,92 +251,129 @@ class RemoteSimulate(ConfluxTestFramework):
             self.log.info("Time spend (s) on setting up genesis accounts: {}".format(time.time()-start_time))
 
     def generate_blocks_async(self):
-        num_nodes = len(self.nodes)
-
-        max_retry = 200
-        # generate blocks
-        threads = {}
+        # wait at most 10 seconds for a free node to generate block
+        max_wait_sec = 10
         rpc_times = []
-        for i in range(1, self.options.num_blocks + 1):
-            wait_sec = random.expovariate(1000 / self.options.generation_period_ms)
-            start = time.time()
-
-            # find an idle node to generate block
-            p = random.randint(0, num_nodes - 1)
-            retry = 0
-            while retry < max_retry:
-                pre_thread = threads.get(p)
-                if pre_thread is not None and pre_thread.is_alive():
-                    p = random.randint(0, num_nodes - 1)
-                    retry += 1
-                    time.sleep(0.05)
-                else:
-                    break
+        if self.enable_tx_propagation:
+            # Generate a block with the transactions in the node's local tx pool
+            generate = lambda worker: worker.generate_block(self.options.max_block_size_in_bytes)
+        else:
+            # Generate a fixed-size block with fake tx
+            tx_n = self.options.txs_per_block
+            tx_data_len = self.options.generate_tx_data_len
+            pool_size = self.options.fake_tx_payload_pool or self.options.num_blocks
+            payloads = FakeTxPayloadCache(pool_size, RpcClient(self.nodes[0]).epoch_number())
+            start_time = time.time()
+            payloads.prepare(tx_n, tx_data_len)
+            self.log.info("Time spend (s) on encoding {} fake tx payloads: {}".format(pool_size, time.time() - start_time))
+            generate = lambda worker: worker.generate_block_with_fake_txs(payloads.get(tx_n, tx_data_len), tx_data_len)
+        pool = BlockGenerationPool(self.nodes, generate, self.options.max_node_queue_depth, self.log, rpc_times,
+                                   self.confirm_info, self.rpc_timewait)
+
+        # Arrival time of every block relative to the schedule start, i.e. an open-loop Poisson process.
+        # Blocks are dispatched at the absolute arrival times, so a slow dispatch does not shift the
+        # later blocks: the driver catches up by dispatching the overdue blocks without waiting.
+        schedule = poisson_arrival_times(self.options.num_blocks, self.options.generation_period_ms / 1000,
+                                         self.options.generation_seed)
+        lags = []
+        schedule_start = time.monotonic()
+        for (i, arrival) in enumerate(schedule, 1):
+            wait_sec = schedule_start + arrival - time.monotonic()
+            if wait_sec > 0:
+                time.sleep(wait_sec)
+            if self.aborted is not None:
+                break
 
-            if retry >= max_retry:
+            # find a free node to generate block
+            p = pool.acquire(max_wait_sec)
+            if p is None:
                 self.log.warning("too many nodes are busy to generate block, stop to analyze logs.")
                 break
+            pool.submit(p)
 
-            if self.enable_tx_propagation:
-                # Generate a block with the transactions in the node's local tx pool
-                thread = SimpleGenerateThread(self.nodes, p, self.options.max_block_size_in_bytes, self.log, rpc_times,
-                                              self.confirm_info)
-            else:
-                # Generate a fixed-size block with fake tx
-                thread = GenerateThread(self.nodes, p, self.options.txs_per_block, self.options.generate_tx_data_len,
-                                        self.options.max_block_size_in_bytes, self.log, rpc_times, self.confirm_info)
-            thread.start()
-            threads[p] = thread
+            lag = time.monotonic() - schedule_start - arrival
+            lags.append(lag)
+            if lag > 0.01:
+                self.log.debug("%d generating block behind schedule %.2f", p, lag)
 
             if i % self.options.report_progress_blocks == 0:
                 self.log.info("[PROGRESS] %d blocks generated async", i)
 
             self.progress = i
-
-            elapsed = time.time() - start
-            if elapsed < wait_sec:
-                self.log.debug("%d generating block %.2f", p, elapsed)
-                time.sleep(wait_sec - elapsed)
-            elif elapsed > 0.01:
-                self.log.warning("%d generating block slowly %.2f", p, elapsed)
+        schedule_elapsed = time.monotonic() - schedule_start
+        pool.stop()
+        pool.report()
+        if len(lags) > 0:
+            self.log.info("block generation rate: achieved {:.2f}/s, target {:.2f}/s".format(
+                len(lags) / schedule_elapsed, 1000 / self.options.generation_period_ms))
+            lag_stat = Statistics(lags, 3)
+            self.log.info("block dispatch lag (s): P50 {}, P99 {}, Max {}".format(lag_stat.P50, lag_stat.P99, lag_stat.Max))
         self.log.info("generateoneblock RPC latency: {}".format(Statistics(rpc_times, 3).__dict__))
         self.log.info(f"average confirmation latency: {self.confirm_info.get_average_latency()}")
 
     def gather_confirmation_latency_async(self):
-        executor = ThreadPoolExecutor()
-        query_count = 80
-
-        def get_risk(block):
+        # Query the risk of the oldest unconfirmed blocks every round,
+        # in batches of `batch_size` blocks, each batch in one request to a random node.
+        query_count = 400
+        batch_size = 50
+        max_workers = 8
+        executor = ThreadPoolExecutor(max_workers)
+        clients = [BatchRpcClient("http://{}:{}".format(node.ip, node.rpcport)) for node in self.nodes]
+
+        trajectory = None
+        if self.options.risk_trajectory_file:
+            trajectory = RiskTrajectoryWriter(self.options.risk_trajectory_file)
+
+        def get_risks(p, blocks):
             try:
-                p = random.randint(0, len(self.nodes) - 1)
-                risk = self.nodes[p].cfx_getConfirmationRiskByHash(block)
-                self.log.debug(f"risk: {block} {risk}")
-                return (block, risk)
+                risks = clients[p].batch("cfx_getConfirmationRiskByHash", [[block] for block in blocks])
             except Exception as e:
                 self.log.info("get risk failed {}".format(str(e)))
-                return (None, None)
+                return []
+            now = time.time()
+            if trajectory is not None:
+                for (block, risk) in zip(blocks, risks):
+                    if risk is not None:
+                        trajectory.record(now, p, block, normalize_risk(risk))
+            return zip(blocks, risks)
 
         while not self.stopped:
+            round_start = time.time()
+            blocks = self.confirm_info.get_unconfirmed_blocks(query_count)
             futures = []
-            for block in self.confirm_info.get_unconfirmed_blocks()[:query_count]:
-                futures.append(executor.submit(get_risk, block))
+            for i in range(0, len(blocks), batch_size):
+                p = random.randint(0, len(self.nodes) - 1)
+                futures.append(executor.submit(get_risks, p, blocks[i:i + batch_size]))
             for f in futures:
-                block, risk = f.result()
-                if risk is not None and int(risk, 16) <= CONFIRMATION_THRESHOLD:
-                    self.confirm_info.confirm_block(block)
-            self.log.info(self.confirm_info.progress())
+                for (block, risk) in f.result():
+                    if risk is not None and int(risk, 16) <= CONFIRMATION_THRESHOLD:
+                        self.confirm_info.confirm_block(block)
+                        if trajectory is not None:
+                            trajectory.confirm(block)
+            self.log.info("{}, risk polling {} blocks in {:.3f}s".format(
+                self.confirm_info.progress(), len(blocks), time.time() - round_start))
             time.sleep(0.5)
 
+        executor.shutdown()
+        for client in clients:
+            client.close()
+        if trajectory is not None:
+            trajectory.close()
+            self.log.info("risk trajectories saved to {}".format(self.options.risk_trajectory_file))
+
     def run_test(self):
         # setup monitor to report the current block count periodically
         cur_block_count = self.nodes[0].test_getBlockCount()
         # The monitor will check the block_count of nodes[0]
         self.progress = 0
         self.stopped = False
+        # Reason to abort the run, set by the monitor
+        self.aborted = None
         self.confirm_info = BlockConfirmationInfo()
         monitor_thread = threading.Thread(target=self.monitor, args=(cur_block_count, 100), daemon=True)
         monitor_thread.start()
-        threading.Thread(target=self.gather_confirmation_latency_async, daemon=True).start()
+        latency_thread = threading.Thread(target=self.gather_confirmation_latency_async, daemon=True)
+        latency_thread.start()
         # When enable_tx_propagation is set, let conflux nodes generate tx automatically.
         self.init_txgen()
 
@@ -281,6 +382,11 @@ class RemoteSimulate(ConfluxTestFramework):
 
         monitor_thread.join()
         self.stopped = True
+        # let the last polling round finish and the risk trajectories be flushed
+        latency_thread.join(60)
+        if latency_thread.is_alive():
+            self.log.warning("risk polling not stopped in 60s, risk trajectories may be incomplete")
+        assert self.aborted is None, "run aborted: {}".format(self.aborted)
 
         node_idx = 0
         while node_idx < len(self.nodes):
@@ -295,9 +401,11 @@ class RemoteSimulate(ConfluxTestFramework):
 
         ghost_confirmation_time = []
         node0 = RpcClient(self.nodes[0])
-        self.log.info("Best block: {}, height: {}".format(node0.best_block_hash(), node0.epoch_number()))
-        for i in range(1, node0.epoch_number()+1):
-            pivot_block = node0.block_by_epoch(node0.EPOCH_NUM(i))["hash"]
+        best_block = node0.best_block_hash()
+        epoch_number = node0.epoch_number()
+        self.log.info("Best block: {}, height: {}".format(best_block, epoch_number))
+        pivot_chain = self.get_pivot_chain(best_block, epoch_number)
+        for pivot_block in pivot_chain[1:]:
             if pivot_block in self.confirm_info.block_confirmation_time:
                 ghost_confirmation_time.append(self.confirm_info.block_confirmation_time[pivot_block])
         if len(ghost_confirmation_time) != 0:
@@ -307,64 +415,49 @@ class RemoteSimulate(ConfluxTestFramework):
             ))
 
 
+    def get_pivot_chain(self, best_block:str, epoch_number:int):
+        pivot_chain = load_pivot_chain(self.options.pivot_chain_file, best_block)
+        if pivot_chain is not None:
+            self.log.info("pivot chain loaded from {}".format(self.options.pivot_chain_file))
+            return pivot_chain
+
+        start = time.time()
+        client = BatchRpcClient("http://{}:{}".format(self.nodes[0].ip, self.nodes[0].rpcport))
+        pivot_chain = fetch_pivot_chain(client, epoch_number)
+        client.close()
+        self.log.info("Time spend (s) on fetching pivot chain of {} epochs: {}".format(epoch_number, time.time() - start))
+        if pivot_chain[-1] != best_block:
+            # The pivot chain changed since the best block was queried, do not cache it under the best block
+            self.log.warning("pivot chain ends with {} instead of the best block".format(pivot_chain[-1]))
+        elif self.options.pivot_chain_file:
+            save_pivot_chain(self.options.pivot_chain_file, pivot_chain)
+        return pivot_chain
+
     def wait_until_nodes_synced(self):
         """
         Wait for all nodes to reach same block count and best block
         """
         self.log.info("wait for all nodes to sync blocks ...")
-
-        executor = ThreadPoolExecutor()
-
-        start = time.time()
         # Wait for at most 120 seconds
-        while time.time() - start <= 120:
-            block_counts = []
-            best_blocks = []
-            block_count_futures = []
-            best_block_futures = []
-
-            for i in range(len(self.nodes)):
-                n = self.nodes[i]
-                block_count_futures.append(executor.submit(n.test_getBlockCount))
-                best_block_futures.append(executor.submit(n.best_block_hash))
-
-            for f in block_count_futures:
-                # assert f.exception() is None, "failed to get block count: {}".format(f.exception())
-                if f.exception():
-                    self.log.info("failed to get block count: {}".format(f.exception()))
-                else:
-                    block_counts.append(f.result())
-                    
-            max_count = max(block_counts)
-            for i in range(len(block_counts)):
-                if block_counts[i] < max_count - 50:
-                    self.log.info("Slow: {}: {}".format(i, block_counts[i]))
-
-            for f in best_block_futures:
-                # assert f.exception() is None, "failed to get best block: {}".format(f.exception())
-                if f.exception():
-                    self.log.info("failed to get best block: {}".format(f.exception()))
-                else:
-                    best_blocks.append(f.result())
-
-            self.log.info("blocks: {}".format(Counter(block_counts)))
-
-            if block_counts.count(block_counts[0]) == len(self.nodes) and best_blocks.count(best_blocks[0]) == len(self.nodes):
-                break
-
-            time.sleep(5)
-        executor.shutdown()
+        watcher = SyncWatcher(self.nodes, self.log, timeout=120)
+        if watcher.wait():
+            self.log.info("all nodes synced in {:.2f}s".format(watcher.elapsed()))
+        else:
+            self.log.warning("nodes not synced in {:.2f}s".format(watcher.elapsed()))
+        watcher.report()
 
     def monitor(self, cur_block_count:int, retry_max:int):
         pre_block_count = 0
+        fleet = FleetMonitor(self.nodes, self.log, self.options.monitor_sample_size,
+                             self.options.node_stall_timeout_sec)
 
         retry = 0
         while pre_block_count < self.options.num_blocks + cur_block_count:
             time.sleep(self.options.generation_period_ms / 1000 / 2)
 
-            # block count
-            block_count = self.nodes[0].test_getBlockCount()
-            if block_count != pre_block_count:
+            # block count of node 0 and the sampled nodes
+            block_count = fleet.tick(self.progress + cur_block_count)
+            if block_count is not None and block_count != pre_block_count:
                 gap = self.progress + cur_block_count - block_count
                 self.log.info("current blocks: %d (gaps: %d)", block_count, gap)
                 pre_block_count = block_count
@@ -375,33 +468,253 @@ class RemoteSimulate(ConfluxTestFramework):
                     self.log.error("No block generated after %d average block generation intervals", retry_max / 2)
                     break
 
+            unhealthy = fleet.unhealthy_nodes()
+            if self.options.abort_unhealthy_fraction > 0 \
+                    and len(unhealthy) >= self.options.abort_unhealthy_fraction * len(self.nodes):
+                self.aborted = "{} of {} nodes are stalled or crashed: {}".format(
+                    len(unhealthy), len(self.nodes), unhealthy[:20])
+                self.log.error(self.aborted)
+                break
+
+        fleet.report()
         self.log.info("monitor completed.")
 
 
+class FleetMonitor:
+    """
+    Tracks the block count of all nodes during the run. Every tick polls node 0
+    and the next `sample_size` nodes in turn, so the cost of a tick does not
+    grow with the number of nodes.
+
+    A node is crashed after `crash_polls` consecutive failed polls, and stalled if
+    its block count has not grown for `stall_timeout` seconds while it is behind
+    the generated blocks.
+    """
+    HEALTHY = "healthy"
+    STALLED = "stalled"
+    CRASHED = "crashed"
+
+    def __init__(self, nodes, log, sample_size:int, stall_timeout:float, crash_polls:int=3):
+        self.nodes = nodes
+        self.log = log
+        self.sample_size = min(sample_size, len(nodes) - 1)
+        self.stall_timeout = stall_timeout
+        self.crash_polls = crash_polls
+        self.next_sample = 1
+        self.start = time.time()
+        # Per node time series: [(elapsed time, block count, generated blocks - block count)]
+        self.series = [[] for _ in nodes]
+        self.last_growth = [self.start] * len(nodes)
+        self.failed_polls = [0] * len(nodes)
+        self.status = [FleetMonitor.HEALTHY] * len(nodes)
+        self.executor = ThreadPoolExecutor(self.sample_size + 1)
+
+    def _sample(self):
+        sample = [0]
+        for _ in range(self.sample_size):
+            sample.append(self.next_sample)
+            self.next_sample = self.next_sample + 1 if self.next_sample + 1 < len(self.nodes) else 1
+        return sample
+
+    def _poll(self, i):
+        try:
+            return self.nodes[i].test_getBlockCount()
+        except Exception as e:
+            self.log.debug("failed to get block count of node {}: {}".format(i, e))
+            return None
+
+    def _set_status(self, i, status):
+        if self.status[i] != status:
+            self.log.info("node {} is {}".format(i, status))
+            self.status[i] = status
+
+    def tick(self, generated:int):
+        """
+        Polls the sampled nodes, and returns the block count of node 0 or None if the poll failed.
+        """
+        sample = self._sample()
+        counts = list(self.executor.map(self._poll, sample))
+        now = time.time()
+        for (i, count) in zip(sample, counts):
+            if count is None:
+                self.failed_polls[i] += 1
+                if self.failed_polls[i] >= self.crash_polls:
+                    self._set_status(i, FleetMonitor.CRASHED)
+                continue
+
+            self.failed_polls[i] = 0
+            series = self.series[i]
+            if len(series) == 0 or count > series[-1][1]:
+                self.last_growth[i] = now
+            series.append((round(now - self.start, 3), count, generated - count))
+
+            if count < generated and now - self.last_growth[i] >= self.stall_timeout:
+                self._set_status(i, FleetMonitor.STALLED)
+            else:
+                self._set_status(i, FleetMonitor.HEALTHY)
+        return counts[0]
+
+    def unhealthy_nodes(self):
+        return [i for (i, status) in enumerate(self.status) if status != FleetMonitor.HEALTHY]
+
+    def report(self):
+        self.executor.shutdown()
+        self.log.info("fleet status: {}".format(Counter(self.status)))
+        for i in self.unhealthy_nodes():
+            series = self.series[i]
+            last = series[-1] if len(series) > 0 else None
+            self.log.info("node {} {}: last sample (time, blocks, gap) {}".format(i, self.status[i], last))
+        gaps = [s[-1][2] for s in self.series if len(s) > 0]
+        if len(gaps) > 0:
+            self.log.info("last sampled gaps of nodes: {}".format(Statistics(gaps).__dict__))
+
+
+class SyncWatcher:
+    """
+    Polls the block count and best block of all nodes until they agree.
+
+    The poll interval halves while the nodes are catching up and doubles
+    while they are stalled, and is capped by the predicted time to sync,
+    i.e. the largest gap of a node divided by its catch-up rate.
+    """
+    def __init__(self, nodes, log, timeout=120, min_interval=0.1, max_interval=5, max_workers=16):
+        self.nodes = nodes
+        self.log = log
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_workers = max_workers
+        # Per node catch-up curve: [(elapsed time, block count)]
+        self.curves = [[] for _ in nodes]
+        # Per node catch-up rate (blocks/s), smoothed over polls
+        self.rates = [0.0] * len(nodes)
+        self.start = None
+        self.end = None
+
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    def _poll_node(self, i):
+        try:
+            n = self.nodes[i]
+            return (n.test_getBlockCount(), n.best_block_hash())
+        except Exception as e:
+            self.log.info("failed to get block count or best block of node {}: {}".format(i, e))
+            return None
+
+    def _update_rates(self, i, now, count):
+        curve = self.curves[i]
+        if len(curve) > 0:
+            (pre_time, pre_count) = curve[-1]
+            if now > pre_time:
+                rate = (count - pre_count) / (now - pre_time)
+                self.rates[i] = 0.5 * self.rates[i] + 0.5 * rate
+        curve.append((now, count))
+
+    def predict_time_to_sync(self, counts:list):
+        """
+        Returns the predicted seconds for all nodes to reach the max block count, or None if any lagging node stalls.
+        """
+        max_count = max(c for c in counts if c is not None)
+        prediction = 0
+        for (i, count) in enumerate(counts):
+            if count is None or count >= max_count:
+                continue
+            if self.rates[i] <= 0:
+                return None
+            prediction = max(prediction, (max_count - count) / self.rates[i])
+        return prediction
+
+    def wait(self):
+        """
+        Returns True once all nodes have the same block count and best block, or False on timeout.
+        """
+        self.start = time.time()
+        interval = self.min_interval
+        pre_total_gap = None
+        with ThreadPoolExecutor(min(self.max_workers, len(self.nodes))) as executor:
+            while True:
+                results = list(executor.map(self._poll_node, range(len(self.nodes))))
+                now = time.time() - self.start
+                counts = [None if r is None else r[0] for r in results]
+                for (i, count) in enumerate(counts):
+                    if count is not None:
+                        self._update_rates(i, now, count)
+
+                if None not in results and len(set(results)) == 1:
+                    self.end = time.time()
+                    return True
+                if now >= self.timeout:
+                    self.end = time.time()
+                    return False
+                if all(c is None for c in counts):
+                    time.sleep(interval)
+                    continue
+
+                max_count = max(c for c in counts if c is not None)
+                total_gap = sum(max_count - c for c in counts if c is not None)
+                if pre_total_gap is not None and total_gap < pre_total_gap:
+                    interval = max(self.min_interval, interval / 2)
+                else:
+                    interval = min(self.max_interval, interval * 2)
+                pre_total_gap = total_gap
+
+                prediction = self.predict_time_to_sync(counts)
+                lagging = [i for (i, c) in enumerate(counts) if c is not None and c < max_count]
+                self.log.info("blocks: {}, lagging nodes: {}, predicted time to sync: {}".format(
+                    Counter(counts), lagging[:10], "unknown" if prediction is None else "{:.2f}s".format(prediction)))
+                if prediction is not None:
+                    interval = max(self.min_interval, min(interval, prediction))
+                time.sleep(min(interval, max(0, self.timeout - now)))
+
+    def report(self):
+        """
+        Log the catch-up curve of every node that was behind at the first poll.
+        """
+        final_count = max((curve[-1][1] for curve in self.curves if len(curve) > 0), default=0)
+        for (i, curve) in enumerate(self.curves):
+            if len(curve) == 0 or curve[0][1] >= final_count:
+                continue
+            caught_up = next((t for (t, c) in curve if c >= final_count), None)
+            if caught_up is not None and caught_up > 0:
+                rate = (final_count - curve[0][1]) / caught_up
+            else:
+                rate = self.rates[i]
+            # Only keep the points where the block count changes
+            points = [(round(t, 2), c) for (j, (t, c)) in enumerate(curve) if j == 0 or c != curve[j - 1][1]]
+            self.log.info("node {} catch-up: gap {} -> {}, rate {:.1f} blocks/s, caught up at {}, curve {}".format(
+                i, final_count - curve[0][1], final_count - curve[-1][1], rate,
+                "never" if caught_up is None else "{:.2f}s".format(caught_up), points))
+
+
 class BlockConfirmationInfo:
     def __init__(self):
         self.block_start_time = {}
         self.block_confirmation_time = {}
-        self.unconfirmed_block = set()
+        # Unconfirmed blocks in the order of generation
+        self.unconfirmed_block = OrderedDict()
         self._lock = threading.Lock()
 
     def add_block(self, h):
         self._lock.acquire()
         self.block_start_time[h] = time.time()
-        self.unconfirmed_block.add(h)
+        self.unconfirmed_block[h] = None
         self._lock.release()
 
     def confirm_block(self, h):
         self._lock.acquire()
         self.block_confirmation_time[h] = time.time() - self.block_start_time[h]
-        self.unconfirmed_block.remove(h)
+        del self.unconfirmed_block[h]
         self._lock.release()
 
-    def get_unconfirmed_blocks(self):
+    def get_unconfirmed_blocks(self, limit=None):
+        """
+        Returns the `limit` oldest unconfirmed blocks, or all of them if `limit` is None.
+        """
         self._lock.acquire()
-        sorted_blocks = sorted(self.unconfirmed_block, key=lambda h: self.block_start_time[h])
+        blocks = list(islice(self.unconfirmed_block, limit))
         self._lock.release()
-        return sorted_blocks
+        return blocks
 
     def get_average_latency(self):
         self._lock.acquire()
@@ -417,63 +730,199 @@ class BlockConfirmationInfo:
         self._lock.release()
         return s
 
-class GenerateThread(threading.Thread):
-    def __init__(self, nodes, i, tx_n, tx_data_len, max_block_size, log, rpc_times:list, confirm_info: BlockConfirmationInfo):
+def poisson_arrival_times(n:int, mean_interval:float, seed:int):
+    rng = random.Random(seed)
+    arrivals = []
+    t = 0
+    for _ in range(n):
+        t += rng.expovariate(1 / mean_interval)
+        arrivals.append(t)
+    return arrivals
+
+
+def encode_fake_txs(tx_n, tx_data_len, epoch_height):
+    client = RpcClient(None)
+    txs = []
+    for i in range(tx_n):
+        addr = client.rand_addr()
+        tx_gas = client.DEFAULT_TX_GAS + 4 * tx_data_len
+        tx = client.new_tx(receiver=addr, nonce=10000+i, value=0, gas=tx_gas, data=b'\x00' * tx_data_len,
+                           epoch_height=epoch_height)
+        # remove big data field and assemble on full node to reduce network load.
+        tx.__dict__["data"] = b''
+        txs.append(tx)
+    return eth_utils.encode_hex(rlp.encode(txs))
+
+
+class FakeTxPayloadCache:
+    """
+    Pool of RLP encoded fake txs for `test_generateblockwithfaketxs` keyed by (tx_n, tx_data_len).
+    Payloads are signed in worker processes before the generation starts, and handed out
+    round robin, so that generating a block costs the driver no signing or encoding.
+    """
+    def __init__(self, pool_size:int, epoch_height:int, workers:int=None):
+        self.pool_size = pool_size
+        # All payloads are signed with the epoch height at startup rather than at generation time
+        self.epoch_height = epoch_height
+        self.workers = workers
+        self.payloads = {}
+        self.next_index = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, tx_n:int, tx_data_len:int):
+        key = (tx_n, tx_data_len)
+        if key in self.payloads:
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            self.payloads[key] = list(executor.map(encode_fake_txs, [tx_n] * self.pool_size,
+                                                   [tx_data_len] * self.pool_size,
+                                                   [self.epoch_height] * self.pool_size,
+                                                   chunksize=max(1, self.pool_size // 64)))
+        self.next_index[key] = 0
+
+    def get(self, tx_n:int, tx_data_len:int):
+        key = (tx_n, tx_data_len)
+        with self._lock:
+            payloads = self.payloads[key]
+            index = self.next_index[key]
+            self.next_index[key] = (index + 1) % len(payloads)
+        return payloads[index]
+
+
+class BlockGenerationWorker(threading.Thread):
+    """
+    Long-lived worker that generates blocks on one node from its job queue,
+    over its own keep-alive RPC connection to the node.
+    """
+    def __init__(self, pool, node, i, generate, rpc_timeout:int):
         threading.Thread.__init__(self, daemon=True)
-        self.nodes = nodes
+        self.pool = pool
         self.i = i
-        self.tx_n = tx_n
-        self.tx_data_len = tx_data_len
-        self.max_block_size = max_block_size
-        self.log = log
-        self.rpc_times = rpc_times
-        self.confirm_info = confirm_info
+        self.generate = generate
+        self.jobs = queue.Queue()
+        # Only used by the worker thread, so the client keeps a single keep-alive connection to the node
+        # Block generation on a loaded node may be slow, and is never retried as it is not idempotent
+        self.client = BatchRpcClient("http://{}:{}".format(node.ip, node.rpcport), timeout=rpc_timeout)
+
+        # Metrics: [queue depth when a job is submitted], [job queueing time], [RPC latency]
+        self.queue_depths = []
+        self.queue_times = []
+        self.rpc_times = []
+
+    def stop(self):
+        self.jobs.put(None)
 
     def run(self):
-        try:
-            client = RpcClient(self.nodes[self.i])
-            txs = []
-            for i in range(self.tx_n):
-                addr = client.rand_addr()
-                tx_gas = client.DEFAULT_TX_GAS + 4 * self.tx_data_len
-                tx = client.new_tx(receiver=addr, nonce=10000+i, value=0, gas=tx_gas, data=b'\x00' * self.tx_data_len)
-                # remove big data field and assemble on full node to reduce network load.
-                tx.__dict__["data"] = b''
-                txs.append(tx)
-            encoded_txs = eth_utils.encode_hex(rlp.encode(txs))
-
-            start = time.time()
-            h = self.nodes[self.i].test_generateblockwithfaketxs(encoded_txs, False, self.tx_data_len)
-            self.confirm_info.add_block(h)
-            self.rpc_times.append(round(time.time() - start, 3))
-            self.log.debug("node %d actually generate block %s", self.i, h)
-        except Exception as e:
-            self.log.error("Node %d fails to generate block", self.i)
-            self.log.error(str(e))
+        while True:
+            submit_time = self.jobs.get()
+            if submit_time is None:
+                break
+            self.queue_times.append(time.time() - submit_time)
+            try:
+                self.generate(self)
+            except Exception as e:
+                self.pool.log.error("Node %d fails to generate block", self.i)
+                self.pool.log.error(str(e))
+            finally:
+                self.pool.release(self.i)
+        self.client.close()
 
+    def generate_block_with_fake_txs(self, encoded_txs, tx_data_len):
+        start = time.time()
+        h = self.client.call("test_generateblockwithfaketxs", encoded_txs, False, tx_data_len)
+        self.pool.block_generated(self, h, time.time() - start)
 
-class SimpleGenerateThread(threading.Thread):
-    def __init__(self, nodes, i, max_block_size, log, rpc_times:list, confirm_info: BlockConfirmationInfo):
-        threading.Thread.__init__(self, daemon=True)
-        self.nodes = nodes
-        self.i = i
-        self.max_block_size = max_block_size
+    def generate_block(self, max_block_size):
+        # Do not limit num tx in blocks, and block size is already limited by `max_block_size_in_bytes`
+        start = time.time()
+        h = self.client.call("test_generateoneblock", 10000000, max_block_size)
+        self.pool.block_generated(self, h, time.time() - start)
+
+
+class BlockGenerationPool:
+    """
+    One BlockGenerationWorker per node, and the set of free nodes, i.e. nodes
+    with less than `max_queue_depth` outstanding jobs, to dispatch blocks to.
+    """
+    def __init__(self, nodes, generate, max_queue_depth, log, rpc_times:list, confirm_info, rpc_timeout:int):
         self.log = log
+        self.max_queue_depth = max_queue_depth
         self.rpc_times = rpc_times
         self.confirm_info = confirm_info
-
-    def run(self):
-        try:
-            client = RpcClient(self.nodes[self.i])
-            # Do not limit num tx in blocks, and block size is already limited by `max_block_size_in_bytes`
-            start = time.time()
-            h = client.generate_block(10000000, self.max_block_size)
-            self.confirm_info.add_block(h)
-            self.rpc_times.append(round(time.time() - start, 3))
-            self.log.debug("node %d actually generate block %s", self.i, h)
-        except Exception as e:
-            self.log.error("Node %d fails to generate block", self.i)
-            self.log.error(str(e))
+        self.outstanding = [0] * len(nodes)
+        # Free nodes in a list for O(1) random choice, with their positions in the list
+        self.free_nodes = list(range(len(nodes)))
+        self.free_positions = list(range(len(nodes)))
+        self.acquire_times = []
+        self._cond = threading.Condition()
+
+        self.workers = [BlockGenerationWorker(self, node, i, generate, rpc_timeout) for (i, node) in enumerate(nodes)]
+        for worker in self.workers:
+            worker.start()
+
+    def _remove_free(self, i):
+        pos = self.free_positions[i]
+        last = self.free_nodes[-1]
+        self.free_nodes[pos] = last
+        self.free_positions[last] = pos
+        self.free_nodes.pop()
+        self.free_positions[i] = None
+
+    def _add_free(self, i):
+        self.free_positions[i] = len(self.free_nodes)
+        self.free_nodes.append(i)
+
+    def acquire(self, timeout):
+        """
+        Returns a random free node and reserves a job slot on it, or None if no node is free within timeout.
+        """
+        start = time.time()
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self.free_nodes) > 0, timeout):
+                return None
+            i = self.free_nodes[random.randint(0, len(self.free_nodes) - 1)]
+            self.outstanding[i] += 1
+            if self.outstanding[i] >= self.max_queue_depth:
+                self._remove_free(i)
+            outstanding = self.outstanding[i] - 1
+        self.acquire_times.append(time.time() - start)
+        self.workers[i].queue_depths.append(outstanding)
+        return i
+
+    def submit(self, i):
+        self.workers[i].jobs.put(time.time())
+
+    def release(self, i):
+        with self._cond:
+            self.outstanding[i] -= 1
+            if self.free_positions[i] is None:
+                self._add_free(i)
+                self._cond.notify()
+
+    def block_generated(self, worker, h, rpc_time):
+        self.confirm_info.add_block(h)
+        worker.rpc_times.append(rpc_time)
+        self.rpc_times.append(round(rpc_time, 3))
+        self.log.debug("node %d actually generate block %s", worker.i, h)
+
+    def stop(self, timeout=10):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def report(self):
+        """
+        Log the per-node queue metrics. High queue depth or queueing time with low RPC latency
+        means the driver rather than the node is the bottleneck.
+        """
+        self.log.info("wait for free node (s): {}".format(Statistics(self.acquire_times, 3).__dict__))
+        for worker in self.workers:
+            self.log.info("node {}: {} blocks, queue depth {}, queue time {}, rpc time {}".format(
+                worker.i, len(worker.rpc_times),
+                Statistics(worker.queue_depths).__dict__,
+                Statistics(worker.queue_times, 3).__dict__,
+                Statistics(worker.rpc_times, 3).__dict__))
 
 
 if __name__ == "__main__":
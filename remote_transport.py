@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Transports to run commands and copy files on the remote hosts listed in an ips file,
+with the result of every host reported separately so that only failed hosts are retried.
+
+    pssh   parallel-ssh/parallel-scp, a new SSH connection per host per command
+    ssh    ssh/scp over one long-lived multiplexed connection per host (ControlMaster)
+    local  run the commands in a local directory per host, to test the orchestration offline
+"""
+
+SSH_OPTIONS = ["-o", "StrictHostKeyChecking no"]
+
+def home_relative(path:str):
+    """
+    Strips a leading `~` or `~/`, so that the path is relative to the home directory, in which the
+    commands on the hosts run. A quoted `~` is not expanded by the shell of the host.
+    """
+    if path == "~":
+        return ""
+    if path.startswith("~/"):
+        return path[2:]
+    return path
+
+def read_hosts(ips_file:str):
+    with open(ips_file, "r") as fp:
+        return [line.strip() for line in fp if len(line.strip()) > 0 and not line.startswith("#")]
+
+class HostResult:
+    def __init__(self, host:str, exit_code:int, stdout:str="", stderr:str=""):
+        self.host = host
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def ok(self):
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return "HostResult({}, exit_code={})".format(self.host, self.exit_code)
+
+class Transport:
+    def __init__(self, parallelism:int=400, timeout:int=None):
+        self.parallelism = parallelism
+        self.timeout = timeout
+
+    def run(self, hosts:list, remote_cmd:str):
+        """
+        Runs the command on all hosts. Returns {host: HostResult}.
+        """
+        return self._map(hosts, lambda host: self.run_on_host(host, remote_cmd))
+
+    def copy(self, hosts:list, local:str, remote:str):
+        """
+        Copies the local file to the remote path on all hosts. Returns {host: HostResult}.
+        """
+        return self._map(hosts, lambda host: self.copy_to_host(host, local, remote))
+
+    def run_on_host(self, host:str, remote_cmd:str):
+        raise NotImplementedError()
+
+    def copy_to_host(self, host:str, local:str, remote:str):
+        raise NotImplementedError()
+
+    def relay_command(self, src:str, dest_host:str, dest:str):
+        """
+        Returns the command to run on a host to copy its file `src` to `dest` on `dest_host`.
+        """
+        return "scp -o {} {} {}:{}".format(shlex.quote(SSH_OPTIONS[1]), shlex.quote(home_relative(src)), dest_host,
+                                           shlex.quote(home_relative(dest)))
+
+    def close(self):
+        pass
+
+    def _map(self, hosts:list, fn):
+        if len(hosts) == 0:
+            return {}
+        with ThreadPoolExecutor(min(self.parallelism, len(hosts))) as executor:
+            return dict(zip(hosts, executor.map(fn, hosts)))
+
+    def _subprocess(self, host:str, args:list, **kwargs):
+        try:
+            p = subprocess.run(args, capture_output=True, text=True, timeout=self.timeout, **kwargs)
+            return HostResult(host, p.returncode, p.stdout, p.stderr)
+        except subprocess.TimeoutExpired as e:
+            return HostResult(host, -1, "", "timeout after {}s".format(e.timeout))
+
+    def with_retry(self, hosts:list, op, retry:int, cmd_description:str):
+        """
+        Calls `op(hosts)` and then again with only the failed hosts, at most `retry` more times.
+        Returns the last result of every host, and raises AssertionError if any host still fails.
+        """
+        results = {}
+        pending = list(hosts)
+        while True:
+            results.update(op(pending))
+            pending = [host for host in pending if not results[host].ok()]
+            if len(pending) == 0:
+                return results
+
+            for host in pending[:10]:
+                r = results[host]
+                print("Failed to {} on {}, return code = {}: {}".format(
+                    cmd_description, host, r.exit_code, (r.stderr or r.stdout).strip()[-200:]))
+            print("Failed to {} on {}/{} hosts, retry = {} ...".format(cmd_description, len(pending), len(hosts), retry))
+            assert retry > 0, "Failed to {} on hosts {}".format(cmd_description, pending)
+            retry -= 1
+            time.sleep(1)
+
+class PsshTransport(Transport):
+    """
+    parallel-ssh/parallel-scp over the given hosts, with per-host output read from its output directories.
+    """
+    def run(self, hosts:list, remote_cmd:str):
+        return self._parallel(hosts, lambda hosts_file, outdir, errdir: [
+            "parallel-ssh", "-O", SSH_OPTIONS[1], "-h", hosts_file, "-p", str(self.parallelism),
+            "-o", outdir, "-e", errdir] + self._timeout_args() + [remote_cmd])
+
+    def copy(self, hosts:list, local:str, remote:str):
+        return self._parallel(hosts, lambda hosts_file, outdir, errdir: [
+            "parallel-scp", "-O", SSH_OPTIONS[1], "-h", hosts_file, "-p", str(self.parallelism),
+            "-o", outdir, "-e", errdir] + self._timeout_args() + [local, remote])
+
+    def run_on_host(self, host:str, remote_cmd:str):
+        return self.run([host], remote_cmd)[host]
+
+    def copy_to_host(self, host:str, local:str, remote:str):
+        return self.copy([host], local, remote)[host]
+
+    def _timeout_args(self):
+        return [] if self.timeout is None else ["-t", str(self.timeout)]
+
+    def _parallel(self, hosts:list, make_args):
+        if len(hosts) == 0:
+            return {}
+        with tempfile.TemporaryDirectory() as tmp:
+            hosts_file = os.path.join(tmp, "hosts")
+            with open(hosts_file, "w") as fp:
+                fp.write("\n".join(hosts) + "\n")
+            outdir = os.path.join(tmp, "out")
+            errdir = os.path.join(tmp, "err")
+            p = subprocess.run(make_args(hosts_file, outdir, errdir), capture_output=True, text=True)
+
+            # Lines like "[1] 12:00:00 [SUCCESS] host" or "[2] 12:00:00 [FAILURE] host Exited with error code 1"
+            exit_codes = {}
+            for line in p.stdout.splitlines():
+                fields = line.split()
+                if len(fields) < 4 or fields[2] not in ("[SUCCESS]", "[FAILURE]"):
+                    continue
+                if fields[2] == "[SUCCESS]":
+                    exit_codes[fields[3]] = 0
+                else:
+                    exit_codes[fields[3]] = int(fields[-1]) if fields[-1].isdigit() else -1
+
+            results = {}
+            for host in hosts:
+                results[host] = HostResult(host, exit_codes.get(host, -1),
+                                           self._read(os.path.join(outdir, host)), self._read(os.path.join(errdir, host)))
+            return results
+
+    @staticmethod
+    def _read(path:str):
+        if not os.path.exists(path):
+            return ""
+        with open(path, "r", errors="replace") as fp:
+            return fp.read()
+
+class SshMuxTransport(Transport):
+    """
+    ssh/scp sharing one master connection per host, which stays open for `persist`
+    after the last command, so only the first command to a host pays the handshake.
+    """
+    def __init__(self, parallelism:int=400, timeout:int=None, control_dir:str=None, persist:str="10m"):
+        Transport.__init__(self, parallelism, timeout)
+        self.control_dir = control_dir or os.path.join(tempfile.gettempdir(), "conflux_ssh_mux")
+        os.makedirs(self.control_dir, exist_ok=True)
+        self.options = SSH_OPTIONS + [
+            "-o", "ControlMaster=auto",
+            "-o", "ControlPath={}".format(os.path.join(self.control_dir, "%r@%h:%p")),
+            "-o", "ControlPersist={}".format(persist),
+            "-o", "ServerAliveInterval=30",
+        ]
+        self.hosts = set()
+
+    def run_on_host(self, host:str, remote_cmd:str):
+        self.hosts.add(host)
+        return self._subprocess(host, ["ssh"] + self.options + [host, remote_cmd])
+
+    def copy_to_host(self, host:str, local:str, remote:str):
+        self.hosts.add(host)
+        return self._subprocess(host, ["scp"] + self.options + [local, "{}:{}".format(host, remote)])
+
+    def close(self):
+        """
+        Closes the master connections.
+        """
+        self._map(list(self.hosts), lambda host: self._subprocess(host, ["ssh"] + self.options + ["-O", "exit", host]))
+        self.hosts.clear()
+
+class LocalTransport(Transport):
+    """
+    Runs the commands of every host in `<root>/<host>` with HOME set to it,
+    so that `~` and relative paths resolve to the directory of the host.
+    """
+    def __init__(self, parallelism:int=400, timeout:int=None, root:str="local_hosts"):
+        Transport.__init__(self, parallelism, timeout)
+        self.root = os.path.abspath(root)
+
+    def host_dir(self, host:str):
+        path = os.path.join(self.root, host)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def run_on_host(self, host:str, remote_cmd:str):
+        host_dir = self.host_dir(host)
+        env = dict(os.environ, HOME=host_dir)
+        return self._subprocess(host, ["bash", "-c", remote_cmd], cwd=host_dir, env=env)
+
+    def relay_command(self, src:str, dest_host:str, dest:str):
+        dest = os.path.join(self.host_dir(dest_host), home_relative(dest))
+        return "mkdir -p {} && cp {} {}".format(shlex.quote(os.path.dirname(dest)), shlex.quote(home_relative(src)),
+                                                shlex.quote(dest))
+
+    def copy_to_host(self, host:str, local:str, remote:str):
+        dest = os.path.join(self.host_dir(host), home_relative(remote))
+        try:
+            if os.path.isdir(local):
+                shutil.copytree(local, os.path.join(dest, os.path.basename(local)), dirs_exist_ok=True)
+            else:
+                shutil.copy(local, dest)
+            return HostResult(host, 0)
+        except OSError as e:
+            return HostResult(host, 1, "", str(e))
+
+def file_digest(path:str):
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while True:
+            chunk = fp.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def tree_distribute(transport:Transport, hosts:list, local:str, remote_dir:str="~", fanout:int=4, retry:int=3,
+                    cmd_description=""):
+    """
+    Copies the local file into `remote_dir` of all hosts along a k-ary tree: in every round the master
+    and each host that already has the file send it to at most `fanout` hosts that do not, so the master
+    sends `fanout` copies per round instead of one per host. Hosts that already have an identical copy
+    are skipped. Returns the hosts the file was copied to.
+    """
+    name = os.path.basename(local)
+    remote_file = os.path.join(home_relative(remote_dir), name)
+    digest = file_digest(local)
+
+    def identical(hosts):
+        results = transport.run(hosts, "sha256sum {} 2>/dev/null | cut -d ' ' -f 1".format(shlex.quote(remote_file)))
+        return set(h for (h, r) in results.items() if r.ok() and r.stdout.strip() == digest)
+
+    pending = [h for h in hosts if h not in identical(hosts)]
+    print("{}: {} of {} hosts already have {}".format(cmd_description, len(hosts) - len(pending), len(hosts), name))
+    if home_relative(remote_dir) != "" and len(pending) > 0:
+        # scp and cp would otherwise create a file named after a missing directory
+        transport.run(pending, "mkdir -p {}".format(shlex.quote(home_relative(remote_dir))))
+    copied = []
+    failures = {}
+
+    def send(sender, receiver):
+        if sender is None:
+            return transport.copy_to_host(receiver, local, remote_dir)
+        return transport.run_on_host(sender, transport.relay_command(remote_file, receiver, remote_file))
+
+    holders = []
+    with ThreadPoolExecutor(min(transport.parallelism, max(1, len(pending)))) as executor:
+        while len(pending) > 0:
+            # The master is None, and sends first so that it is never idle
+            senders = [None] + holders
+            assignments = []
+            for sender in senders:
+                for _ in range(fanout):
+                    if len(assignments) >= len(pending):
+                        break
+                    assignments.append((sender, pending[len(assignments)]))
+            round_hosts = set(r for (_, r) in assignments)
+            results = list(executor.map(lambda a: send(*a), assignments))
+
+            # Relayed copies are verified before the host relays further
+            received = [receiver for ((_, receiver), r) in zip(assignments, results) if r.ok()]
+            verified = identical(received) if len(received) > 0 else set()
+            for (sender, receiver) in assignments:
+                if receiver in verified:
+                    holders.append(receiver)
+                    copied.append(receiver)
+                    continue
+                failures[receiver] = failures.get(receiver, 0) + 1
+                assert failures[receiver] <= retry, "Failed to {} on host {}".format(cmd_description, receiver)
+            pending = [h for h in pending if h not in round_hosts or h not in verified]
+            print("{}: {} hosts copied, {} pending".format(cmd_description, len(copied), len(pending)))
+    return copied
+
+def get_transport(spec:str, parallelism:int=400, timeout:int=None):
+    """
+    `spec` is one of "pssh", "ssh" and "local[:<root>]".
+    """
+    (name, _, arg) = spec.partition(":")
+    if name == "pssh":
+        return PsshTransport(parallelism, timeout)
+    if name == "ssh":
+        return SshMuxTransport(parallelism, timeout)
+    if name == "local":
+        return LocalTransport(parallelism, timeout, arg or "local_hosts")
+    raise AssertionError("unknown transport [{}]".format(spec))
+
+def check_local(hosts:int=10, fanout:int=2, remote_dir:str="~/sub"):
+    """
+    Distributes a file with the local transport into `remote_dir` of every host, then again to check
+    that identical copies are detected and skipped.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        transport = LocalTransport(root=os.path.join(root, "hosts"))
+        local = os.path.join(root, "payload")
+        with open(local, "wb") as fp:
+            fp.write(os.urandom(1 << 16))
+        names = ["host{}".format(i) for i in range(hosts)]
+        copied = tree_distribute(transport, names, local, remote_dir, fanout, cmd_description="check")
+        assert sorted(copied) == names, "copied to {} of {} hosts".format(len(copied), hosts)
+        for host in names:
+            path = os.path.join(transport.host_dir(host), home_relative(remote_dir), "payload")
+            assert file_digest(path) == file_digest(local), "{} differs on host {}".format(path, host)
+        copied = tree_distribute(transport, names, local, remote_dir, fanout, cmd_description="check")
+        assert copied == [], "copied again to {} hosts".format(len(copied))
+    print("distributed to {} local hosts in {}".format(hosts, remote_dir))
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(usage="%(prog)s [options] <ips_file> <local_file> [<remote_dir>]",
+                                     description="Distribute a file to the hosts along a k-ary tree")
+    parser.add_argument("ips_file", nargs="?")
+    parser.add_argument("local_file", nargs="?")
+    parser.add_argument("remote_dir", nargs="?", default="~")
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--transport", default="pssh")
+    parser.add_argument("--check", action="store_true",
+                        help="distribute a file to local hosts into ~/sub and verify the copies, then exit")
+    args = parser.parse_args()
+    if args.check:
+        for remote_dir in ["~", "~/sub", "~/sub/dir"]:
+            check_local(fanout=args.fanout, remote_dir=remote_dir)
+        exit(0)
+    assert args.ips_file and args.local_file, "ips_file and local_file are required"
+
+    transport = get_transport(args.transport)
+    try:
+        tree_distribute(transport, read_hosts(args.ips_file), args.local_file, args.remote_dir, args.fanout,
+                        cmd_description="distribute {}".format(args.local_file))
+    finally:
+        transport.close()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import http.client
+import json
+import select
+import socket
+import threading
+from urllib.parse import urlparse
+
+
+class BatchRpcError(Exception):
+    def __init__(self, method:str, index:int, error:dict):
+        super().__init__("{} call {} failed: {}".format(method, index, error))
+        self.index = index
+        self.error = error
+
+
+class BatchRpcClient:
+    """
+    JSON-RPC client that sends many calls in one HTTP request.
+
+    Every thread keeps its own keep-alive connection to the node, so the
+    client can be shared by the threads of an executor.
+    """
+    def __init__(self, url:str, timeout=30):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.timeout = timeout
+        self._local = threading.local()
+        # connections of all threads, to close them all
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and conn.sock is not None and len(select.select([conn.sock], [], [], 0)[0]) > 0:
+            # an idle keep-alive connection is only readable if the node closed it
+            self._drop_connection()
+            conn = None
+        # the connection may be closed by `close` from another thread
+        if conn is None or conn.sock is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            conn.connect()
+            # a request is sent in 2 writes of headers and body, do not delay the body
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        conn.close()
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+
+    def _post(self, body:bytes):
+        """
+        Posts the request and returns the response body. The calls may not be idempotent, e.g. block
+        generation, so the request is sent again only if a stale keep-alive connection fails to send it,
+        never after a timeout or a failed response.
+        """
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        for retry in range(2):
+            conn = getattr(self._local, "conn", None)
+            reused = conn is not None and conn.sock is not None
+            try:
+                conn = self._connection()
+                conn.request("POST", self.path, body, headers)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self._drop_connection()
+                # the node closed the reused keep-alive connection before the request was sent
+                if not reused or retry > 0:
+                    raise
+                continue
+            except (http.client.HTTPException, OSError):
+                self._drop_connection()
+                raise
+            try:
+                return conn.getresponse().read()
+            except (http.client.HTTPException, OSError):
+                self._drop_connection()
+                raise
+
+    def batch(self, method:str, params_list:list, raise_errors=False):
+        """
+        Calls `method` once per params in one request, and returns the results in the same order.
+        The result of a failed call is None, or a BatchRpcError of the first failed call is raised
+        if `raise_errors`.
+        """
+        if len(params_list) == 0:
+            return []
+        calls = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for (i, params) in enumerate(params_list)]
+        responses = json.loads(self._post(json.dumps(calls).encode("utf-8")))
+        assert isinstance(responses, list), "batch request failed: {}".format(responses)
+
+        results = [None] * len(params_list)
+        for response in sorted(responses, key=lambda r: r["id"]):
+            if response.get("error") is None:
+                results[response["id"]] = response.get("result")
+            elif raise_errors:
+                raise BatchRpcError(method, response["id"], response["error"])
+        return results
+
+    def call(self, method:str, *params):
+        """
+        Calls `method` with `params`, and returns its result or raises a BatchRpcError if it fails.
+        """
+        return self.batch(method, [list(params)], raise_errors=True)[0]
+
+    def close(self):
+        """
+        Closes the connections of all threads, a thread reconnects on its next call.
+        """
+        with self._lock:
+            (connections, self._connections) = (self._connections, [])
+        for conn in connections:
+            conn.close()
@@ -4,7 +4,7 @@
 
 set -e
 
-log_dir=logs
+log_dir=${1:-logs}
 
 init_log_dir "$log_dir"
 
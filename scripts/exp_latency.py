@@ -7,9 +7,15 @@ sys.path.insert(1, os.path.join(sys.path[0], '..'))
 sys.path.insert(1, os.path.join(sys.path[0], '../..'))
 
 import argparse
-from remote_simulate import RemoteSimulate, pssh, kill_remote_conflux, execute
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from remote_simulate import RemoteSimulate, pssh, kill_remote_conflux, execute, set_transport
 import subprocess
 from test_framework.test_framework import OptionHelper
+from exp_manifest import ArtifactStore, ExperimentManifest
+from pivot_chain import PIVOT_CHAIN_FILE
+from stat_latency import Table
+from stat_latency_map_reduce import BlockLatencyType, LogAggregator, Percentile, load_category_counts
 
 def cleanup_remote_logs(ips_file:str):
     pssh(ips_file, "rm -f *.tgz *.out; rm -rf /tmp/conflux_test_*")
@@ -46,6 +52,72 @@ class RemoteSimulateConfig:
 
         return config_groups
 
+class LatencySLO:
+    """
+    Latency service level objective, e.g. "cons_p99<5,gap_p99<50".
+
+    Each term is <metric><op><value> where op is < or <=. The metric is either
+    <latency_type>_<percentile> for the block broadcast latency rows or
+    gap_<percentile> for the node sync/cons gap rows of stat_latency.py,
+    optionally followed by .<percentile> to choose the column (Avg by default),
+    e.g. "cons_p99.p90<8".
+    """
+    def __init__(self, spec:str):
+        self.spec = spec
+        self.terms = []
+        for term in spec.replace(" and ", ",").split(","):
+            term = term.strip()
+            if len(term) == 0:
+                continue
+            op = "<=" if "<=" in term else "<"
+            fields = term.split(op)
+            if len(fields) != 2:
+                raise AssertionError("invalid SLO term [{}], format is <metric><op><value>".format(term))
+            metric = fields[0].strip().lower()
+            LatencySLO.parse_metric(metric)
+            self.terms.append((metric, op, float(fields[1])))
+        assert len(self.terms) > 0, "empty SLO"
+
+    @staticmethod
+    def parse_percentile(name:str):
+        for p in Percentile:
+            if p.name.lower() == name:
+                return p
+        raise AssertionError("invalid percentile [{}]".format(name))
+
+    @staticmethod
+    def parse_metric(metric:str):
+        (row, column) = metric.split(".") if "." in metric else (metric, "avg")
+        (row_type, row_percentile) = row.split("_")
+        if row_type == "gap":
+            latency_type = None
+        else:
+            latency_type = None
+            for t in BlockLatencyType:
+                if t.name.lower() == row_type:
+                    latency_type = t
+            assert latency_type is not None, "invalid metric [{}]".format(metric)
+        return (latency_type, LatencySLO.parse_percentile(row_percentile), LatencySLO.parse_percentile(column))
+
+    def metrics(self, agg:LogAggregator):
+        result = {}
+        for (metric, _, _) in self.terms:
+            (latency_type, row_percentile, column) = LatencySLO.parse_metric(metric)
+            if latency_type is None:
+                stat = agg.stat_sync_cons_gap(row_percentile)
+            else:
+                stat = agg.stat_block_latency(latency_type, row_percentile)
+            result[metric] = stat.get(column)
+        return result
+
+    def check(self, metrics:dict):
+        for (metric, op, value) in self.terms:
+            if op == "<" and not metrics[metric] < value:
+                return False
+            if op == "<=" and not metrics[metric] <= value:
+                return False
+        return True
+
 class LatencyExperiment:
     def __init__(self):
         self.exp_name = "latency_latest"
@@ -58,6 +130,24 @@ class LatencyExperiment:
         self.exp_latency_options = dict(
             vms = 10,
             batch_config = "500:1:150000:1000,500:1:200000:1000,500:1:250000:1000,500:1:300000:1000,500:1:350000:1000",
+            # Analyze the logs of each config in background while the next config runs
+            pipeline = False,
+            analysis_workers = 2,
+            # Skip configs already completed in the batch manifest, and reuse their collected logs
+            resume = False,
+            # Re-analyze the collected logs of the batch without running the cluster again
+            reanalyze = False,
+            # Defaults to exp_manifest_<digest of batch config>.json
+            manifest = "",
+            artifacts_dir = "artifacts",
+            # Search for the capacity frontier under the SLO instead of running batch_config, see LatencySLO
+            search_slo = "",
+            # One of tx_size, txs_per_block and block_gen_interval_ms
+            search_param = "tx_size",
+            search_range = "100000:500000",
+            search_precision = 10000,
+            # <block_gen_interval_ms>:<txs_per_block>:<tx_size>:<num_blocks>, the searched field is overwritten
+            search_base = "500:1:150000:1000",
         )
         OptionHelper.add_options(parser, self.exp_latency_options)
 
@@ -66,7 +156,9 @@ class LatencyExperiment:
             return k
 
         remote_simulate_options = dict(filter(
-            lambda kv: k_from_kv(kv) in set(["bandwidth", "profiler", "enable_tx_propagation", "ips_file", "enable_flamegraph"]),
+            lambda kv: k_from_kv(kv) in set(["bandwidth", "profiler", "enable_tx_propagation", "ips_file", "enable_flamegraph",
+                                          "risk_trajectory_file", "abort_unhealthy_fraction", "transport",
+                                          "distribution_fanout"]),
             list(RemoteSimulate.SIMULATE_OPTIONS.items())))
         remote_simulate_options.update(RemoteSimulate.PASS_TO_CONFLUX_OPTIONS)
         # Configs with different default values than RemoteSimulate
@@ -77,6 +169,7 @@ class LatencyExperiment:
 
         OptionHelper.add_options(parser, remote_simulate_options)
         self.options = parser.parse_args()
+        set_transport(self.options.transport)
 
         if os.path.getsize("./genesis_secrets.txt") % 65 != 0:
             print("genesis secrets account error, file size should be multiple of 65")
@@ -84,57 +177,324 @@ class LatencyExperiment:
         self.options.txgen_account_count = int((os.path.getsize("./genesis_secrets.txt")/65) //
                                                (self.options.vms * self.options.nodes_per_host))
 
-    def run(self):
-        for config in RemoteSimulateConfig.parse(self.options.batch_config):
-            print("=========================================================")
-            print("Experiment started, config = {} ...".format(config))
-            
-            print("kill remote conflux and cleanup logs ...")
-            kill_remote_conflux(self.options.ips_file)
-            cleanup_remote_logs(self.options.ips_file)
-            setup_bandwidth_limit(self.options.ips_file, self.options.bandwidth, self.options.nodes_per_host)
-
-            print("Run remote simulator ...")
-            self.run_remote_simulate(config)
+        if self.options.search_slo:
+            batch_key = "search:{}:{}:{}:{}:{}".format(self.options.search_slo, self.options.search_param,
+                self.options.search_range, self.options.search_precision, self.options.search_base)
+        else:
+            batch_key = self.options.batch_config
+        manifest_path = self.options.manifest or ExperimentManifest.default_path(
+            batch_key, self.options.vms, self.options.nodes_per_host)
+        self.manifest = ExperimentManifest.open(manifest_path, batch_key)
+        self.store = ArtifactStore(self.options.artifacts_dir)
 
-            print("Kill remote conflux and copy logs ...")
-            kill_remote_conflux(self.options.ips_file)
-            self.copy_remote_logs()
-            # Do not cleanup logs here because they may be needed for debug later, and they will be deleted when the
-            # next run begins
-            # cleanup_remote_logs(self.options.ips_file)
+    def run(self):
+        if self.options.search_slo:
+            self.search()
+            return
 
-            print("Statistic logs ...")
-            os.system("echo throttling logs: `grep -i thrott -r logs | wc -l`")
-            os.system("echo error logs: `grep -i thrott -r logs | wc -l`")
+        configs = RemoteSimulateConfig.parse(self.options.batch_config)
+        tags = self.unique_tags(configs)
+        print("batch manifest: {}".format(self.manifest.path))
 
-            print("Computing latencies ...")
-            self.stat_latency(config)
+        executor = ThreadPoolExecutor(max_workers=self.options.analysis_workers) if self.options.pipeline else None
+        analyses = []
 
-            print("Collecting metrics ...")
-            tag = self.tag(config)
-            execute("./copy_file_from_slave.sh metrics.log {} > /dev/null".format(tag), 3, "collect metrics")
-            execute("./copy_file_from_slave.sh conflux.log {} > /dev/null".format(tag), 3, "collect rust log")
-            if self.options.enable_flamegraph:
+        for (config, tag) in zip(configs, tags):
+            print("=========================================================")
+            log_dir = self.prepare_logs(config, tag)
+            if log_dir is None:
+                continue
+
+            if executor is None:
+                self.analyze(config, tag, log_dir)
+            else:
+                print("Analyze logs of [{}] in background ...".format(tag))
+                analyses.append((tag, executor.submit(self.analyze, config, tag, log_dir)))
+
+        failed_tags = []
+        if executor is not None:
+            print("=========================================================")
+            print("wait for {} background analyses ...".format(len(analyses)))
+            for (tag, future) in analyses:
                 try:
-                    execute("./copy_file_from_slave.sh conflux.svg {} > /dev/null".format(tag), 10, "collect flamegraph")
-                except:
-                    print("Failed to copy flamegraph file conflux.svg, please try again via copy_file_from_slave.sh in manual")
-
-            execute("cp exp.log {}.exp.log".format(tag), 3, "copy exp.log")
+                    future.result()
+                except Exception as e:
+                    print("Failed to analyze logs of [{}]: {}".format(tag, e))
+                    failed_tags.append(tag)
+            executor.shutdown()
+
+        self.archive(tags)
+
+        assert len(failed_tags) == 0, "Failed to analyze logs of {}".format(failed_tags)
+
+    def prepare_logs(self, config:RemoteSimulateConfig, tag:str, analyzed_ok:bool=False):
+        """
+        Returns the logs directory of the config, reusing the stored logs if resumed,
+        or None if the config should be skipped.
+        """
+        log_dir = self.manifest.artifact(tag, "logs")
+        status = self.manifest.status(tag)
+        if (self.options.resume or self.options.reanalyze) and log_dir is not None:
+            if status == ExperimentManifest.ANALYZED and not self.options.reanalyze and not analyzed_ok:
+                print("Skip completed experiment [{}] ...".format(tag))
+                return None
+            print("Reuse collected logs of experiment [{}] in [{}] ...".format(tag, log_dir))
+            return log_dir
+        elif self.options.reanalyze:
+            print("Skip experiment [{}] without collected logs ...".format(tag))
+            return None
+
+        print("Experiment started, config = {} ...".format(config))
+        try:
+            self.simulate(config, tag)
+        except BaseException as e:
+            # e.g. the simulator aborted the run as too many nodes stalled or crashed
+            self.manifest.update(tag, ExperimentManifest.FAILED, error=repr(e), **self.collect_partial(tag))
+            raise
+
+        try:
+            return self.collect(config, tag)
+        except BaseException as e:
+            self.manifest.update(tag, ExperimentManifest.FAILED, error=repr(e))
+            raise
+
+    def search(self):
+        """
+        Bisect the searched parameter for the capacity frontier under the SLO.
+        Larger tx_size or txs_per_block, or smaller block_gen_interval_ms, is harder to sustain.
+        """
+        slo = LatencySLO(self.options.search_slo)
+        param = self.options.search_param
+        base = RemoteSimulateConfig.parse(self.options.search_base)[0]
+        assert param in base.__dict__ and param != "num_blocks", "invalid search param [{}]".format(param)
+        (lo, hi) = [int(v) for v in self.options.search_range.split(":")]
+        assert lo <= hi, "invalid search range [{}]".format(self.options.search_range)
+        harder_when_larger = param != "block_gen_interval_ms"
+        print("batch manifest: {}".format(self.manifest.path))
+        print("search {} in [{}, {}] under SLO [{}] ...".format(param, lo, hi, slo.spec))
+
+        evidence = []
+        def evaluate(value):
+            config = RemoteSimulateConfig(**base.__dict__)
+            config.__dict__[param] = value
+            tag = "{}_{}{}".format(self.tag(config), param, value)
+            print("=========================================================")
+            try:
+                log_dir = self.prepare_logs(config, tag, analyzed_ok=True)
+                if log_dir is None:
+                    # e.g. --reanalyze without collected logs, which is no evidence either way
+                    print("{} = {}: no logs to analyze".format(param, value))
+                    return None
+                if self.options.reanalyze or self.manifest.status(tag) != ExperimentManifest.ANALYZED:
+                    self.analyze(config, tag, log_dir)
+                agg = LogAggregator.load(log_dir)
+                assert len(agg.blocks) > 0, "no block in the logs"
+                metrics = slo.metrics(agg)
+                passed = slo.check(metrics)
+            except Exception as e:
+                # A config overloading the cluster may crash the nodes or the simulator
+                print("Experiment [{}] failed and is regarded as violating the SLO: {}".format(tag, e))
+                metrics = {}
+                passed = False
+            print("{} = {}: {} {}".format(param, value, "PASS" if passed else "FAIL", metrics))
+            evidence.append((value, tag, metrics, passed))
+            return passed
+
+        # `easy` always satisfies the SLO and `hard` always violates it
+        (easy, hard) = (lo, hi) if harder_when_larger else (hi, lo)
+        frontier = None
+        # the value without logs to evaluate, which stops the search
+        unevaluated = None
+        passed = evaluate(hard)
+        if passed is None:
+            unevaluated = hard
+        elif passed:
+            frontier = hard
+        else:
+            passed = evaluate(easy)
+            if passed is None:
+                unevaluated = easy
+            elif passed:
+                while abs(hard - easy) > self.options.search_precision:
+                    mid = (easy + hard) // 2
+                    passed = evaluate(mid)
+                    if passed is None:
+                        unevaluated = mid
+                        break
+                    if passed:
+                        easy = mid
+                    else:
+                        hard = mid
+                frontier = easy
+
+        evidence_tags = [tag for (_, tag, _, _) in evidence]
+        self.archive(evidence_tags)
 
         print("=========================================================")
-        print("archive the experiment results into [{}] ...".format(self.stat_archive_file))
-        cmd = "tar cvfz {} {} *.exp.log *nodes.csv *.metrics.log *.conflux.log".format(self.stat_archive_file, self.stat_log_file)
+        table = Table([param, "tag"] + [metric for (metric, _, _) in slo.terms] + ["SLO"])
+        for (value, tag, metrics, passed) in sorted(evidence, key=lambda e: e[0]):
+            table.add_row([value, tag] + [metrics.get(metric, "-") for (metric, _, _) in slo.terms]
+                          + ["PASS" if passed else "FAIL"])
+        table.pretty_print()
+        if unevaluated is not None:
+            print("Search stopped at {} = {} without logs to analyze, the frontier is in [{}, {}]".format(
+                param, unevaluated, min(easy, hard), max(easy, hard)))
+        elif frontier is None:
+            print("No {} in [{}, {}] satisfies the SLO [{}]".format(param, lo, hi, slo.spec))
+        else:
+            print("Capacity frontier: {} = {} satisfies the SLO [{}] (precision {})".format(
+                param, frontier, slo.spec, self.options.search_precision))
+
+    def unique_tags(self, configs:list):
+        """
+        Tags of the configs in the batch, with a suffix for repeated configs
+        so that their artifacts do not overwrite each other.
+        """
+        tags = []
+        for config in configs:
+            tag = self.tag(config)
+            repeated = tags.count(tag) + len([t for t in tags if t.startswith(tag + "_run")])
+            tags.append(tag if repeated == 0 else "{}_run{}".format(tag, repeated))
+        return tags
+
+    def simulate(self, config:RemoteSimulateConfig, tag:str):
+        self.manifest.reset(tag)
+
+        print("kill remote conflux and cleanup logs ...")
+        kill_remote_conflux(self.options.ips_file)
+        cleanup_remote_logs(self.options.ips_file)
+        setup_bandwidth_limit(self.options.ips_file, self.options.bandwidth, self.options.nodes_per_host)
+
+        # Each config writes its own simulator log so that neither a background
+        # analysis nor a resumed batch reads the log of another config.
+        simulate_log_file = "{}.{}".format(tag, self.simulate_log_file)
+        if os.path.exists(simulate_log_file):
+            os.remove(simulate_log_file)
+
+        pivot_chain_file = "{}.{}".format(tag, PIVOT_CHAIN_FILE)
+        if os.path.exists(pivot_chain_file):
+            os.remove(pivot_chain_file)
+
+        print("Run remote simulator ...")
+        self.run_remote_simulate(config, simulate_log_file, pivot_chain_file)
+        artifacts = {"exp_log": self.store.put_file(simulate_log_file, self.simulate_log_file)}
+        if os.path.exists(pivot_chain_file):
+            artifacts["pivot_chain"] = self.store.put_file(pivot_chain_file, PIVOT_CHAIN_FILE)
+        self.manifest.update(tag, ExperimentManifest.SIMULATED, **artifacts)
+
+    def collect(self, config:RemoteSimulateConfig, tag:str):
+        """
+        Copy logs of the config from the remote nodes, which must be done before
+        the next config cleans them up. Returns the stored logs directory.
+        """
+        log_dir = "logs_{}".format(tag)
+
+        print("Kill remote conflux and copy logs ...")
+        kill_remote_conflux(self.options.ips_file)
+        self.copy_remote_logs(log_dir)
+        # Do not cleanup logs here because they may be needed for debug later, and they will be deleted when the
+        # next run begins
+        # cleanup_remote_logs(self.options.ips_file)
+
+        print("Collecting metrics ...")
+        artifacts = {}
+        execute("./copy_file_from_slave.sh metrics.log {} > /dev/null".format(tag), 3, "collect metrics")
+        artifacts["metrics_log"] = self.store.put_file("{}.metrics.log".format(tag))
+        execute("./copy_file_from_slave.sh conflux.log {} > /dev/null".format(tag), 3, "collect rust log")
+        artifacts["conflux_log"] = self.store.put_file("{}.conflux.log".format(tag))
         if self.options.enable_flamegraph:
-            cmd = cmd + " *.conflux.svg"
-        os.system(cmd)
-
-    def copy_remote_logs(self):
-        execute("./copy_logs.sh > /dev/null", 3, "copy logs")
-        os.system("echo `ls logs/logs_tmp | wc -l` logs copied.")
+            try:
+                execute("./copy_file_from_slave.sh conflux.svg {} > /dev/null".format(tag), 10, "collect flamegraph")
+                artifacts["flamegraph"] = self.store.put_file("{}.conflux.svg".format(tag))
+            except:
+                print("Failed to copy flamegraph file conflux.svg, please try again via copy_file_from_slave.sh in manual")
+
+        # stat_confirmation.py looks for the best block in exp.log of the logs directory
+        execute("cp {} {}/{}".format(self.manifest.artifact(tag, "exp_log"), log_dir, self.simulate_log_file),
+                3, "copy exp.log")
+        pivot_chain_file = self.manifest.artifact(tag, "pivot_chain")
+        if pivot_chain_file is not None:
+            execute("cp {} {}/{}".format(pivot_chain_file, log_dir, PIVOT_CHAIN_FILE), 3, "copy pivot chain")
+
+        artifacts["logs"] = self.store.put_dir(log_dir)
+        self.manifest.update(tag, ExperimentManifest.COLLECTED, **artifacts)
+        print("logs of [{}] stored in [{}]".format(tag, artifacts["logs"]))
+
+        return artifacts["logs"]
+
+    def collect_partial(self, tag:str):
+        """
+        Store the simulator log and the remote logs of a failed run for debug.
+        Returns the stored artifacts.
+        """
+        artifacts = {}
+        try:
+            simulate_log_file = "{}.{}".format(tag, self.simulate_log_file)
+            if os.path.exists(simulate_log_file):
+                artifacts["exp_log"] = self.store.put_file(simulate_log_file, self.simulate_log_file)
+
+            log_dir = "logs_{}_partial".format(tag)
+            print("Kill remote conflux and copy partial logs ...")
+            kill_remote_conflux(self.options.ips_file)
+            self.copy_remote_logs(log_dir)
+            artifacts["partial_logs"] = self.store.put_dir(log_dir)
+            print("partial logs of [{}] stored in [{}]".format(tag, artifacts["partial_logs"]))
+        except Exception as e:
+            print("Failed to collect partial logs of [{}]: {}".format(tag, e))
+        return artifacts
+
+    def analyze(self, config:RemoteSimulateConfig, tag:str, log_dir:str):
+        stat_log_file = "{}.{}".format(tag, self.stat_log_file)
+        if os.path.exists(stat_log_file):
+            os.remove(stat_log_file)
+
+        try:
+            print("Statistic logs of [{}] ...".format(tag))
+            category_counts = load_category_counts(log_dir)
+            print("throttling logs: {}".format(category_counts.get("throttle", 0)))
+            print("error logs: {}".format(category_counts.get("error", 0)))
+
+            print("Computing latencies of [{}] ...".format(tag))
+            self.stat_latency(tag, log_dir, stat_log_file)
+        except BaseException as e:
+            self.manifest.update(tag, ExperimentManifest.FAILED, error=repr(e))
+            raise
+
+        self.manifest.update(tag, ExperimentManifest.ANALYZED,
+                             stat_log=self.store.put_file(stat_log_file, self.stat_log_file),
+                             csv=self.store.put_file("{}.csv".format(tag)))
+
+    def archive(self, tags:list):
+        """
+        Archive the results of the batch recorded in the manifest, in the batch order.
+        """
+        print("=========================================================")
+        with open(self.stat_log_file, "w") as stat_log:
+            for tag in tags:
+                path = self.manifest.artifact(tag, "stat_log")
+                if path is not None:
+                    with open(path, "r") as fp:
+                        stat_log.write(fp.read())
 
-    def run_remote_simulate(self, config:RemoteSimulateConfig):
+        print("archive the experiment results into [{}] ...".format(self.stat_archive_file))
+        num_files = 1
+        with tarfile.open(self.stat_archive_file, "w:gz") as tar_file:
+            tar_file.add(self.stat_log_file)
+            for tag in tags:
+                for (name, suffix) in [("exp_log", "exp.log"), ("csv", "csv"), ("metrics_log", "metrics.log"),
+                                       ("conflux_log", "conflux.log"), ("flamegraph", "conflux.svg"),
+                                       ("pivot_chain", PIVOT_CHAIN_FILE)]:
+                    path = self.manifest.artifact(tag, name)
+                    if path is not None:
+                        tar_file.add(path, arcname="{}.{}".format(tag, suffix))
+                        num_files += 1
+        print("archived {} files of {} experiments into [{}]".format(num_files, len(tags), self.stat_archive_file))
+
+    def copy_remote_logs(self, log_dir="logs"):
+        execute("./copy_logs.sh {} > /dev/null".format(log_dir), 3, "copy logs")
+        os.system("echo `ls {}/logs_tmp | wc -l` logs copied.".format(log_dir))
+
+    def run_remote_simulate(self, config:RemoteSimulateConfig, simulate_log_file:str, pivot_chain_file:str):
         cmd = [
             "python3",
             "../remote_simulate.py",
@@ -144,17 +504,18 @@ class LatencyExperiment:
             "--generate-tx-data-len", str(config.tx_size),
             "--tx-pool-size", str(1_000_000),
             "--conflux-binary", "~/conflux",
+            "--pivot-chain-file", pivot_chain_file,
             "--nocleanup"
         ] + OptionHelper.parsed_options_to_args(
             dict(filter(lambda kv: kv[0] not in self.exp_latency_options, vars(self.options).items()))
         )
 
-        log_file = open(self.simulate_log_file, "a")
-        print("[CMD]: {} >> {}".format(cmd, self.simulate_log_file))
+        log_file = open(simulate_log_file, "a")
+        print("[CMD]: {} >> {}".format(cmd, simulate_log_file))
         ret = subprocess.run(cmd, stdout = log_file, stderr=log_file).returncode
-        assert ret == 0, "Failed to run remote simulator, return code = {}. Please check [{}] for more details".format(ret, self.simulate_log_file)
+        assert ret == 0, "Failed to run remote simulator, return code = {}. Please check [{}] for more details".format(ret, simulate_log_file)
 
-        os.system('grep "(ERROR)" {}'.format(self.simulate_log_file))
+        os.system('grep "(ERROR)" {}'.format(simulate_log_file))
 
     def tag(self, config:RemoteSimulateConfig):
         block_size_kb = config.txs_per_block * config.tx_size // 1000
@@ -165,16 +526,16 @@ class LatencyExperiment:
             self.options.nodes_per_host,
         )
 
-    def stat_latency(self, config:RemoteSimulateConfig):
-        os.system("echo ============================================================ >> {}".format(self.stat_log_file))
+    def stat_latency(self, tag:str, log_dir:str, stat_log_file:str):
+        os.system("echo ============================================================ >> {}".format(stat_log_file))
 
         print("begin to statistic relay latency ...")
-        ret = os.system("python3 stat_latency.py {0} logs {0}.csv >> {1}".format(self.tag(config), self.stat_log_file))
+        ret = os.system("python3 stat_latency.py {0} {1} {0}.csv >> {2}".format(tag, log_dir, stat_log_file))
         assert ret == 0, "Failed to statistic block relay latency, return code = {}".format(ret)
 
         if self.stat_confirmation_latency:
             print("begin to statistic confirmation latency ...")
-            ret = os.system("python3 stat_confirmation.py logs 4 >> {}".format(self.stat_log_file))
+            ret = os.system("python3 stat_confirmation.py {} 4 >> {}".format(log_dir, stat_log_file))
             assert ret == 0, "Failed to statistic block confirmation latency, return code = {}".format(ret)
 
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import os
+import hashlib
+import json
+import shutil
+import threading
+import time
+
+class ArtifactStore:
+    """
+    Content-addressed store of experiment artifacts.
+
+    Files are kept as `<root>/files/<digest>/<name>` and log directories as
+    `<root>/logs/<digest>`, so identical artifacts are stored only once and
+    a stored artifact is never overwritten by a later run.
+    """
+    def __init__(self, root:str="artifacts"):
+        self.root = root
+
+    @staticmethod
+    def digest_file(path:str, h=None):
+        if h is None:
+            h = hashlib.sha256()
+        with open(path, "rb") as fp:
+            while True:
+                chunk = fp.read(1 << 20)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h
+
+    @staticmethod
+    def digest_dir(path:str):
+        h = hashlib.sha256()
+        for (dir_path, dir_names, file_names) in os.walk(path):
+            dir_names.sort()
+            for f in sorted(file_names):
+                file_path = os.path.join(dir_path, f)
+                h.update(os.path.relpath(file_path, path).encode("utf-8"))
+                h.update(b"\0")
+                ArtifactStore.digest_file(file_path, h)
+        return h.hexdigest()
+
+    def _move(self, src:str, dest:str):
+        if os.path.exists(dest):
+            # Same content is already stored
+            if os.path.isdir(src):
+                shutil.rmtree(src)
+            else:
+                os.remove(src)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(src, dest)
+        return dest
+
+    def put_file(self, path:str, name:str=None, keep:bool=False):
+        """
+        Move the file into the store, or copy it if `keep` is set. Returns the stored path.
+        """
+        digest = ArtifactStore.digest_file(path).hexdigest()
+        dest = os.path.join(self.root, "files", digest, name or os.path.basename(path))
+        if keep:
+            if not os.path.exists(dest):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copyfile(path, dest)
+            return dest
+        return self._move(path, dest)
+
+    def put_dir(self, path:str):
+        """
+        Move the directory into the store. Returns the stored path.
+        """
+        digest = ArtifactStore.digest_dir(path)
+        return self._move(path, os.path.join(self.root, "logs", digest))
+
+class ExperimentManifest:
+    """
+    Per-batch record of the status and artifacts of every experiment config,
+    rewritten atomically on each update so that an interrupted batch can resume.
+    """
+    PENDING = "pending"
+    SIMULATED = "simulated"
+    COLLECTED = "collected"
+    ANALYZED = "analyzed"
+    FAILED = "failed"
+
+    def __init__(self, path:str, batch_config:str):
+        self.path = path
+        self.data = {
+            "batch_config": batch_config,
+            "created": time.time(),
+            "configs": {},
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default_path(batch_config:str, *options):
+        key = ",".join([batch_config] + [str(o) for o in options])
+        return "exp_manifest_{}.json".format(hashlib.sha256(key.encode("utf-8")).hexdigest()[:12])
+
+    @staticmethod
+    def open(path:str, batch_config:str):
+        manifest = ExperimentManifest(path, batch_config)
+        if os.path.exists(path):
+            with open(path, "r") as fp:
+                manifest.data = json.load(fp)
+        return manifest
+
+    def entry(self, tag:str):
+        with self._lock:
+            return dict(self.data["configs"].get(tag, {"status": ExperimentManifest.PENDING, "artifacts": {}}))
+
+    def status(self, tag:str):
+        return self.entry(tag)["status"]
+
+    def artifact(self, tag:str, name:str):
+        """
+        Returns the path of the artifact, or None if it was not recorded or is missing on disk.
+        """
+        path = self.entry(tag)["artifacts"].get(name)
+        if path is None or not os.path.exists(path):
+            return None
+        return path
+
+    def reset(self, tag:str):
+        with self._lock:
+            self.data["configs"][tag] = {"status": ExperimentManifest.PENDING, "artifacts": {}}
+            self._save()
+
+    def update(self, tag:str, status:str=None, error:str=None, **artifacts):
+        with self._lock:
+            entry = self.data["configs"].setdefault(tag, {"status": ExperimentManifest.PENDING, "artifacts": {}})
+            if status is not None:
+                entry["status"] = status
+                entry["updated"] = time.time()
+            if error is not None:
+                entry["error"] = error
+            elif status is not None:
+                entry.pop("error", None)
+            entry["artifacts"].update(artifacts)
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(self.data, fp, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Bulk fetch of the pivot chain of a node after a run, cached in a json file
+so that the GHOST stats of remote_simulate.py and stat_confirmation.py
+share one fetch.
+"""
+
+PIVOT_CHAIN_FILE = "pivot_chain.json"
+
+def fetch_window(client, start:int, end:int):
+    """
+    Returns the pivot block hashes of epochs [start, end] via `client`, which has
+    the `batch(method, params_list)` interface of rpc_batch.BatchRpcClient.
+    """
+    chain = client.batch("getPivotChainAndWeight", [[[start, end]]])[0]
+    if chain is not None and len(chain) == end - start + 1:
+        return [h for (h, _) in chain]
+
+    # Fall back to query pivot blocks by epoch, in one batch request
+    blocks = client.batch("cfx_getBlockByEpochNumber", [[hex(e), False] for e in range(start, end + 1)])
+    assert None not in blocks, "failed to get pivot blocks of epochs [{}, {}]".format(start, end)
+    return [block["hash"] for block in blocks]
+
+def fetch_pivot_chain(client, epoch_number:int, window:int=1000, workers:int=8):
+    """
+    Returns the pivot block hashes of epochs [0, epoch_number], fetched in windows in parallel.
+    """
+    windows = [(start, min(start + window - 1, epoch_number)) for start in range(0, epoch_number + 1, window)]
+    with ThreadPoolExecutor(workers) as executor:
+        chunks = executor.map(lambda w: fetch_window(client, w[0], w[1]), windows)
+        return [h for chunk in chunks for h in chunk]
+
+def save_pivot_chain(path:str, chain:list):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump({"best_block": chain[-1], "epoch_number": len(chain) - 1, "pivot_chain": chain}, fp)
+    os.replace(tmp_path, path)
+
+def load_pivot_chain(path:str, best_block:str=None):
+    """
+    Returns the cached pivot chain, or None if it is missing or does not end with `best_block` if specified.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as fp:
+        data = json.load(fp)
+    if best_block is not None and data["best_block"] != best_block:
+        return None
+    return data["pivot_chain"]
@@ -1,14 +1,10 @@
 #!/bin/bash
 
-python3 stat_latency_map_reduce.py /tmp blocks.log
+# Reduce the node logs and extract the log categories (throttle.log, error.log, txgen.log,
+# tx_pack.log, partially_invalid.log, tx_sample.log and their counts in categories.json)
+# in a single pass over each conflux.log.
+python3 stat_latency_map_reduce.py /tmp blocks.log .
 
-find /tmp/conflux_test_* -name conflux.log | xargs grep -i "thrott" > throttle.log
-find /tmp/conflux_test_* -name conflux.log | xargs grep -i "error" > error.log
-find /tmp/conflux_test_* -name conflux.log | xargs grep -i "txgen" > txgen.log
-find /tmp/conflux_test_* -name conflux.log | xargs grep -i "packing" > tx_pack.log
-find /tmp/conflux_test_* -name conflux.log | xargs grep -i "Partially invalid" > partially_invalid.log
-find /tmp/conflux_test_* -name conflux.log | xargs grep -i "Sampled transaction" > tx_sample.log
+tar cvfz log.tgz *.log categories.json
 
-tar cvfz log.tgz *.log
-
-rm *.log
+rm *.log categories.json
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import sys
+import struct
+import threading
+from array import array
+
+CHUNK_MAGIC = b"RTJ1"
+CHUNK_HEADER = struct.Struct("<4sI")
+
+# Column layout of each chunk: (name, array typecode)
+COLUMNS = [
+    ("time", "d"),
+    ("node", "H"),
+    ("block", "I"),
+    ("risk", "d"),
+]
+
+RISK_SCALE = 2 ** 256
+
+def normalize_risk(risk_hex:str):
+    return int(risk_hex, 16) / RISK_SCALE
+
+class RiskTrajectoryWriter:
+    """
+    Append-only columnar recorder of (time, node, block, risk) samples.
+
+    Samples are buffered per column and appended to `path` as one chunk once
+    `chunk_rows` samples are buffered, so the poller only pays for an array
+    append per sample. Block hashes are interned into ids which are appended
+    to the sidecar file `<path>.blocks`, one hash per line in id order.
+    A sample is only recorded when the risk of a block changes.
+    """
+    def __init__(self, path:str, chunk_rows=4096):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.block_ids = {}
+        self.last_risk = {}
+        self.columns = [array(typecode) for (_, typecode) in COLUMNS]
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._data_file = open(path, "wb")
+        self._blocks_file = open(path + ".blocks", "w")
+
+    def record(self, timestamp:float, node:int, block_hash:str, risk:float):
+        with self._lock:
+            block_id = self.block_ids.get(block_hash)
+            if block_id is None:
+                block_id = len(self.block_ids)
+                self.block_ids[block_hash] = block_id
+                self._blocks_file.write(block_hash + "\n")
+            elif self.last_risk.get(block_id) == risk:
+                return
+            self.last_risk[block_id] = risk
+
+            for (column, value) in zip(self.columns, (timestamp, node, block_id, risk)):
+                column.append(value)
+            self.rows += 1
+
+            if self.rows >= self.chunk_rows:
+                self._flush_chunk()
+
+    def confirm(self, block_hash:str):
+        """
+        Drop the dedup state of a confirmed block, it will not be polled again.
+        """
+        with self._lock:
+            block_id = self.block_ids.get(block_hash)
+            if block_id is not None:
+                self.last_risk.pop(block_id, None)
+
+    def _flush_chunk(self):
+        if self.rows == 0:
+            return
+        self._data_file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.rows))
+        for column in self.columns:
+            if sys.byteorder == "big":
+                column.byteswap()
+            column.tofile(self._data_file)
+        self._data_file.flush()
+        self._blocks_file.flush()
+        self.columns = [array(typecode) for (_, typecode) in COLUMNS]
+        self.rows = 0
+
+    def close(self):
+        with self._lock:
+            self._flush_chunk()
+            self._data_file.close()
+            self._blocks_file.close()
+
+class RiskTrajectoryReader:
+    @staticmethod
+    def load(path:str):
+        """
+        Returns the trajectories as {block_hash: [(time, node, risk)]} sorted by time.
+        A truncated trailing chunk (e.g. the simulator was killed) is ignored.
+        """
+        with open(path + ".blocks", "r") as fp:
+            hashes = [line.strip() for line in fp if len(line.strip()) > 0]
+
+        trajectories = {}
+        with open(path, "rb") as fp:
+            while True:
+                header = fp.read(CHUNK_HEADER.size)
+                if len(header) < CHUNK_HEADER.size:
+                    break
+                (magic, rows) = CHUNK_HEADER.unpack(header)
+                assert magic == CHUNK_MAGIC, "invalid risk trajectory chunk in {}".format(path)
+
+                columns = []
+                try:
+                    for (_, typecode) in COLUMNS:
+                        column = array(typecode)
+                        column.fromfile(fp, rows)
+                        if sys.byteorder == "big":
+                            column.byteswap()
+                        columns.append(column)
+                except EOFError:
+                    break
+
+                for (timestamp, node, block_id, risk) in zip(*columns):
+                    if block_id < len(hashes):
+                        trajectories.setdefault(hashes[block_id], []).append((timestamp, node, risk))
+
+        for samples in trajectories.values():
+            samples.sort()
+
+        return trajectories
@@ -4,6 +4,7 @@ sys.path.insert(1, os.path.join(sys.path[0], '../..'))
 
 from stat_latency_map_reduce import LogAggregator, BlockLatencyType, Percentile, parse_value, Statistics
 from stat_latency import Table
+from pivot_chain import load_pivot_chain, PIVOT_CHAIN_FILE
 import pickle
 from queue import Queue
 import math
@@ -35,10 +36,11 @@ def treeSize(t, node, subtree):
     return len(subtree[node])
 
 
-def compute_latency(parents, refs, final_block, g_time, r_time, lambda_n=4, risk=0.0001, adversary_power=0.2):
+def compute_confirmation_times(parents, refs, g_time, r_time, lambda_n=4, risk=0.0001, final_block=None):
+    """
+    Returns the confirmation time of each block under the offline model.
+    """
     r = risk
-    # q = adversary_power / (1 - adversary_power)
-    final_block = None
 
     chain = []
     index = final_block
@@ -130,6 +132,12 @@ def compute_latency(parents, refs, final_block, g_time, r_time, lambda_n=4, risk
             for f in future[b]:
                 if f in final_c_time and final_c_time[f] < final_c_time[b]:
                     final_c_time[f] = final_c_time[b]
+    return final_c_time
+
+
+def compute_latency(parents, refs, final_block, g_time, r_time, lambda_n=4, risk=0.0001, adversary_power=0.2):
+    # q = adversary_power / (1 - adversary_power)
+    final_c_time = compute_confirmation_times(parents, refs, g_time, r_time, lambda_n, risk)
     lat = []
     for b in final_c_time:
         lat.append((final_c_time[b] - g_time[b]))
@@ -139,11 +147,35 @@ def compute_latency(parents, refs, final_block, g_time, r_time, lambda_n=4, risk
         lat_s) * 0.25)], sum(lat_s) / len(lat_s), lat_s[int(len(lat_s) * 0.75)], lat_s[-1]))
     return lat_s
 
+def load_block_times(agg:LogAggregator):
+    parents = {}
+    refs = {}
+    generate_times = {}
+    received_times_max = {}
+    received_times_p99 = {}
+
+    for block in agg.blocks.values():
+        parents[block.hash] = block.parent
+        refs[block.hash] = block.referees
+        generate_times[block.hash] = block.timestamp
+        latencies_stat = Statistics(block.get_latencies(BlockLatencyType.Cons))
+        received_times_max[block.hash] = block.timestamp + latencies_stat.get(Percentile.Max)
+        received_times_p99[block.hash] = block.timestamp + latencies_stat.get(Percentile.P99)
+
+    return (parents, refs, generate_times, received_times_max, received_times_p99)
+
 def find_best_block(logs_dir:str):
     full_path = os.path.abspath(logs_dir)
-    log_path = os.path.join(os.path.dirname(full_path), "exp.log")
+    # Prefer the pivot chain cached by remote_simulate.py
+    for path in [os.path.join(full_path, PIVOT_CHAIN_FILE), os.path.join(os.path.dirname(full_path), PIVOT_CHAIN_FILE)]:
+        pivot_chain = load_pivot_chain(path)
+        if pivot_chain is not None:
+            print("best block:", pivot_chain[-1])
+            return pivot_chain[-1]
+
+    log_path = os.path.join(full_path, "exp.log")
     if not os.path.exists(log_path):
-        log_path = os.path.join(full_path, "exp.log")
+        log_path = os.path.join(os.path.dirname(full_path), "exp.log")
         if not os.path.exists(log_path):
             print("cannot find the log file exp.log")
             sys.exit(2)
@@ -169,19 +201,7 @@ if __name__ == "__main__":
 
     print("Loading logs ...")
     agg = LogAggregator.load(logs_dir)
-    parents = {}
-    refs = {}
-    generate_times = {}
-    received_times_max = {}
-    received_times_p99 = {}
-
-    for block in agg.blocks.values():
-        parents[block.hash] = block.parent
-        refs[block.hash] = block.referees
-        generate_times[block.hash] = block.timestamp
-        latencies_stat = Statistics(block.get_latencies(BlockLatencyType.Cons))
-        received_times_max[block.hash] = block.timestamp + latencies_stat.get(Percentile.Max)
-        received_times_p99[block.hash] = block.timestamp + latencies_stat.get(Percentile.P99)
+    (parents, refs, generate_times, received_times_max, received_times_p99) = load_block_times(agg)
 
     #print("computing with broadcast latency (Max) ...")
     #latencies_max = compute_latency(parents, refs, best_block, generate_times, received_times_max, lambda_n)
@@ -5,6 +5,7 @@ sys.path.insert(1, os.path.join(sys.path[0], '../..'))
 import dateutil.parser
 import json
 import enum
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
 def parse_value(log_line:str, prefix:str, suffix:str):
@@ -22,6 +23,36 @@ class BlockLatencyType(enum.Enum):
     Sync = 1
     Cons = 2
 
+# [category, case insensitive pattern], the lines matching a pattern are extracted into <category>.log
+LOG_CATEGORIES = [
+    ("throttle", "thrott"),
+    ("error", "error"),
+    ("txgen", "txgen"),
+    ("tx_pack", "packing"),
+    ("partially_invalid", "partially invalid"),
+    ("tx_sample", "sampled transaction"),
+]
+
+class LogCategoryWriter:
+    """
+    Extract the log lines of each category into <output_dir>/<category>.log
+    in the same format as `grep -i <pattern>` over multiple files.
+    """
+    def __init__(self, output_dir:str):
+        self.files = {}
+        self.locks = {}
+        for (category, _) in LOG_CATEGORIES:
+            self.files[category] = open(os.path.join(output_dir, category + ".log"), "w", encoding='UTF-8')
+            self.locks[category] = threading.Lock()
+
+    def write(self, category:str, lines:list):
+        with self.locks[category]:
+            self.files[category].writelines(lines)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
 
 
 
@@ -221,25 +252,52 @@ class Statistics:
         return result
 
 class NodeLogMapper:
-    def __init__(self, log_file:str):
+    # Number of extracted lines buffered per category before written
+    CATEGORY_BUFFER_LINES = 1000
+
+    def __init__(self, log_file:str, category_writer:LogCategoryWriter=None):
         assert os.path.exists(log_file), "log file not found: {}".format(log_file)
         self.log_file = log_file
+        self.category_writer = category_writer
 
         self.blocks = {}
         self.txs = {}
         self.by_block_ratio=[]
         self.sync_cons_gaps = []
+        self.category_counts = {}
+        self.category_lines = {}
+        for (category, _) in LOG_CATEGORIES:
+            self.category_counts[category] = 0
+            self.category_lines[category] = []
 
     @staticmethod
-    def mapf(log_file:str):
-        mapper = NodeLogMapper(log_file)
+    def mapf(log_file:str, category_writer:LogCategoryWriter=None):
+        mapper = NodeLogMapper(log_file, category_writer)
         mapper.map()
         return mapper
 
     def map(self):
         with open(self.log_file, "r", encoding='UTF-8') as file:
-            for line in file.readlines():
-                    self.parse_log_line(line)
+            for line in file:
+                self.count_categories(line)
+                self.parse_log_line(line)
+
+        if self.category_writer is not None:
+            for (category, lines) in self.category_lines.items():
+                self.category_writer.write(category, lines)
+                lines.clear()
+
+    def count_categories(self, line:str):
+        lower_line = line.lower()
+        for (category, pattern) in LOG_CATEGORIES:
+            if pattern in lower_line:
+                self.category_counts[category] += 1
+                if self.category_writer is not None:
+                    lines = self.category_lines[category]
+                    lines.append(self.log_file + ":" + line)
+                    if len(lines) >= NodeLogMapper.CATEGORY_BUFFER_LINES:
+                        self.category_writer.write(category, lines)
+                        lines.clear()
 
     def parse_log_line(self, line:str):
         if "transaction received by block" in line:
@@ -276,12 +334,16 @@ class HostLogReducer:
         self.txs = {}
         self.sync_cons_gap_stats = []
         self.by_block_ratio = []
+        self.category_counts = {}
 
     def reduce(self):
         for mapper in self.node_mappers:
             self.sync_cons_gap_stats.append(Statistics(mapper.sync_cons_gaps))
             self.by_block_ratio.extend(mapper.by_block_ratio)
 
+            for (category, count) in mapper.category_counts.items():
+                self.category_counts[category] = self.category_counts.get(category, 0) + count
+
             for b in mapper.blocks.values():
                 Block.add_or_merge(self.blocks, b)
 
@@ -294,11 +356,16 @@ class HostLogReducer:
             "sync_cons_gap_stats": self.sync_cons_gap_stats,
             "txs": self.txs,
             "by_block_ratio": self.by_block_ratio,
+            "category_counts": self.category_counts,
         }
 
         with open(output_file, "w") as fp:
             json.dump(data, fp, default=lambda o: o.__dict__)
 
+    def dump_category_counts(self, output_file:str):
+        with open(output_file, "w") as fp:
+            json.dump(self.category_counts, fp)
+
     def dumps(self):
         data = {
             "blocks": self.blocks,
@@ -316,6 +383,9 @@ class HostLogReducer:
         for by_block_ratio in data["by_block_ratio"]:
             reducer.by_block_ratio.append(by_block_ratio)
 
+        # Not available in logs collected before the categories were counted
+        reducer.category_counts = data.get("category_counts", {})
+
         for stat_dict in data["sync_cons_gap_stats"]:
             stat = Statistics([1])
             stat.__dict__ = stat_dict
@@ -340,13 +410,13 @@ class HostLogReducer:
             return HostLogReducer.load(data)
 
     @staticmethod
-    def reduced(log_dir:str, executor:ThreadPoolExecutor):
+    def reduced(log_dir:str, executor:ThreadPoolExecutor, category_writer:LogCategoryWriter=None):
         futures = []
         for (path, _, files) in os.walk(log_dir):
             for f in files:
                 if f == "conflux.log":
                     log_file = os.path.join(path, f)
-                    futures.append(executor.submit(NodeLogMapper.mapf, log_file))
+                    futures.append(executor.submit(NodeLogMapper.mapf, log_file, category_writer))
 
         mappers = []
         for f in futures:
@@ -363,6 +433,7 @@ class LogAggregator:
         self.blocks = {}
         self.txs = {}
         self.sync_cons_gap_stats = []
+        self.category_counts = {}
 
         # [latency_type, [block_hash, latency_stat]]
         self.block_latency_stats = {}
@@ -382,6 +453,9 @@ class LogAggregator:
     def add_host(self, host_log:HostLogReducer):
         self.sync_cons_gap_stats.extend(host_log.sync_cons_gap_stats)
 
+        for (category, count) in host_log.category_counts.items():
+            self.category_counts[category] = self.category_counts.get(category, 0) + count
+
 
         for b in host_log.blocks.values():
             Block.add_or_merge(self.blocks, b)
@@ -514,15 +588,33 @@ class LogAggregator:
 
         return agg
 
+def load_category_counts(logs_dir:str):
+    """
+    Sum up the category counts of all hosts, without loading the host logs.
+    """
+    counts = {}
+    for (path, _, files) in os.walk(logs_dir):
+        for f in files:
+            if f == "categories.json":
+                with open(os.path.join(path, f), "r") as fp:
+                    for (category, count) in json.load(fp).items():
+                        counts[category] = counts.get(category, 0) + count
+    return counts
+
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Parameter required: <log_dir> <output_file>")
+        print("Parameter required: <log_dir> <output_file> [<category_output_dir>]")
         sys.exit(1)
 
     log_dir = sys.argv[1]
     output_file = sys.argv[2]
+    category_output_dir = None if len(sys.argv) == 3 else sys.argv[3]
 
+    category_writer = None if category_output_dir is None else LogCategoryWriter(category_output_dir)
     executor = ThreadPoolExecutor()
-    reducer = HostLogReducer.reduced(log_dir, executor)
+    reducer = HostLogReducer.reduced(log_dir, executor, category_writer)
     reducer.dump(output_file)
+    if category_output_dir is not None:
+        category_writer.close()
+        reducer.dump_category_counts(os.path.join(category_output_dir, "categories.json"))
     executor.shutdown()
\ No newline at end of file
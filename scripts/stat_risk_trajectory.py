@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import os, sys
+sys.path.insert(1, os.path.join(sys.path[0], '../..'))
+
+from stat_latency_map_reduce import LogAggregator, Statistics
+from stat_latency import Table
+from stat_confirmation import compute_confirmation_times, load_block_times
+from risk_trajectory import RiskTrajectoryReader
+
+"""
+Line up the confirmation risk trajectories reported by the nodes
+(recorded by remote_simulate.py with --risk-trajectory-file) against
+the offline confirmation model in stat_confirmation.py for the same blocks.
+"""
+
+def node_confirmation_time(samples:list, risk:float):
+    for (timestamp, _, r) in samples:
+        if r <= risk:
+            return timestamp
+    return None
+
+def node_risk_at(samples:list, timestamp:float):
+    """
+    Returns the latest risk reported by any node at or before the timestamp.
+    """
+    result = None
+    for (t, _, r) in samples:
+        if t > timestamp:
+            break
+        result = r
+    return result
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Parameter required: <logs_dir> <trajectory_file> <lambda_n> [<risk>]")
+        sys.exit(1)
+
+    logs_dir = sys.argv[1]
+    trajectory_file = sys.argv[2]
+    lambda_n = 1/float(sys.argv[3])
+    # Same threshold as CONFIRMATION_THRESHOLD in remote_simulate.py by default
+    risk = float(sys.argv[4]) if len(sys.argv) >= 5 else 0.1**6
+
+    print("Loading risk trajectories ...")
+    trajectories = RiskTrajectoryReader.load(trajectory_file)
+    print("{} blocks with risk trajectory, {} samples".format(
+        len(trajectories), sum(len(samples) for samples in trajectories.values())))
+
+    print("Loading logs ...")
+    agg = LogAggregator.load(logs_dir)
+    (parents, refs, generate_times, _, received_times_p99) = load_block_times(agg)
+
+    print("computing offline confirmation with broadcast latency (P99) ...")
+    model_times = compute_confirmation_times(parents, refs, generate_times, received_times_p99, lambda_n, risk)
+
+    node_latencies = []
+    model_latencies = []
+    latency_gaps = []
+    node_risks_at_model = []
+    node_only = 0
+    model_only = 0
+    for (block_hash, g_time) in generate_times.items():
+        samples = trajectories.get(block_hash)
+        if samples is None:
+            continue
+
+        node_time = node_confirmation_time(samples, risk)
+        model_time = model_times.get(block_hash)
+        if node_time is not None:
+            node_latencies.append(node_time - g_time)
+        if model_time is not None:
+            model_latencies.append(model_time - g_time)
+            node_risk = node_risk_at(samples, model_time)
+            if node_risk is not None:
+                node_risks_at_model.append(node_risk)
+
+        if node_time is not None and model_time is not None:
+            latency_gaps.append(node_time - model_time)
+        elif node_time is not None:
+            node_only += 1
+        elif model_time is not None:
+            model_only += 1
+
+    print("{} blocks confirmed by both, {} by node only, {} by offline model only".format(
+        len(latency_gaps), node_only, model_only))
+
+    table = Table.new_matrix("confirmation (risk {})".format(risk))
+    table.add_data("node-reported latency", "%.2f", node_latencies)
+    table.add_data("offline model latency", "%.2f", model_latencies)
+    table.add_data("node - model latency", "%.2f", latency_gaps)
+    table.add_stat("node risk at model confirmation", "%.2e", Statistics(node_risks_at_model, avg_ndigits=None))
+    table.pretty_print()